@@ -3,7 +3,6 @@ import hashlib
 import logging
 from typing import List, Optional
 from datetime import datetime
-import json
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,8 +10,9 @@ from pydantic import BaseModel
 import uvicorn
 
 from document_processor import DocumentProcessor
-from search_engine import SearchEngine
+from search_engine import preload_search_engine
 from chatbot import ChatBot
+from document_registry import DocumentRegistry
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,12 +30,22 @@ app.add_middleware(
 )
 
 # Initialize components
+# One engine per process, shared with ChatBot. Workers keep separate in-memory indexes
+# and pick up each other's writes from the shared files before every operation.
 document_processor = DocumentProcessor()
-search_engine = SearchEngine()
-chatbot = ChatBot()
+search_engine = preload_search_engine()
+chatbot = ChatBot(search_engine)
 
-# Document storage to prevent duplicates
-PROCESSED_DOCS_FILE = "processed_documents.json"
+# Document registry (SQLite) to prevent duplicates; replaces processed_documents.json.
+# It connects on first use, in the worker process, not at import.
+PROCESSED_DOCS_FILE = "processed_documents.json"  # legacy format, migrated on startup
+registry = DocumentRegistry()
+
+@app.on_event("startup")
+def prepare_registry():
+    """Migrate the legacy JSON registry and drop abandoned reservations"""
+    registry.migrate_from_json(PROCESSED_DOCS_FILE)
+    registry.clear_stale()
 
 class DocumentInfo(BaseModel):
     filename: str
@@ -54,24 +64,6 @@ class ChatRequest(BaseModel):
     question: str
     context_limit: int = 5
 
-def load_processed_docs():
-    """Load list of processed documents to prevent duplicates"""
-    if os.path.exists(PROCESSED_DOCS_FILE):
-        try:
-            with open(PROCESSED_DOCS_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading processed docs: {e}")
-    return {}
-
-def save_processed_docs(docs_info):
-    """Save processed documents info"""
-    try:
-        with open(PROCESSED_DOCS_FILE, 'w') as f:
-            json.dump(docs_info, f, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving processed docs: {e}")
-
 def calculate_file_hash(file_content: bytes) -> str:
     """Calculate SHA-256 hash of file content to detect duplicates"""
     return hashlib.sha256(file_content).hexdigest()
@@ -110,12 +102,9 @@ async def upload_document(file: UploadFile = File(...)):
         file_content = await file.read()
         file_hash = calculate_file_hash(file_content)
         
-        # Load existing processed documents
-        processed_docs = load_processed_docs()
-        
         # Check for duplicate file
-        if file_hash in processed_docs:
-            existing_doc = processed_docs[file_hash]
+        existing_doc = registry.get(file_hash)
+        if existing_doc:
             logger.info(f"Duplicate file detected: {file.filename} (hash: {file_hash})")
             return {
                 "message": "File already processed",
@@ -131,28 +120,7 @@ async def upload_document(file: UploadFile = File(...)):
         # Calculate content hash to detect content duplicates
         content_hash = calculate_content_hash(extracted_text)
         
-        # Check for content duplicates (same content, different file)
-        for existing_hash, doc_info in processed_docs.items():
-            if doc_info.get('content_hash') == content_hash:
-                logger.warning(f"Content duplicate detected: {file.filename} has same content as {doc_info['filename']}")
-                return {
-                    "message": "Document with identical content already exists",
-                    "duplicate": True,
-                    "content_duplicate": True,
-                    "existing_document": doc_info,
-                    "file_hash": file_hash,
-                    "content_hash": content_hash
-                }
-        
-        # Index the document (with deduplication in search engine)
-        doc_id = search_engine.index_document(
-            filename=file.filename,
-            content=extracted_text,
-            file_hash=file_hash,
-            content_hash=content_hash
-        )
-        
-        # Save document info
+        # Register atomically; fails if the file or its content is already registered
         doc_info = DocumentInfo(
             filename=file.filename,
             file_hash=file_hash,
@@ -161,9 +129,32 @@ async def upload_document(file: UploadFile = File(...)):
             file_size=len(file_content),
             doc_type=file_extension[1:]  # Remove dot
         )
+        existing_doc = registry.reserve(doc_info.dict())
+        if existing_doc:
+            content_duplicate = existing_doc['file_hash'] != file_hash
+            if content_duplicate:
+                logger.warning(f"Content duplicate detected: {file.filename} has same content as {existing_doc['filename']}")
+            return {
+                "message": "Document with identical content already exists" if content_duplicate else "File already processed",
+                "duplicate": True,
+                "content_duplicate": content_duplicate,
+                "existing_document": existing_doc,
+                "file_hash": file_hash,
+                "content_hash": content_hash
+            }
         
-        processed_docs[file_hash] = doc_info.dict()
-        save_processed_docs(processed_docs)
+        # Index the document (with deduplication in search engine)
+        try:
+            doc_id = search_engine.index_document(
+                filename=file.filename,
+                content=extracted_text,
+                file_hash=file_hash,
+                content_hash=content_hash
+            )
+        except Exception:
+            registry.delete(file_hash)
+            raise
+        registry.mark_indexed(file_hash)
         
         logger.info(f"Successfully processed document: {file.filename}")
         
@@ -228,13 +219,29 @@ async def chat_with_documents(request: ChatRequest):
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
 @app.get("/documents")
-async def list_documents():
-    """List all processed documents"""
+async def list_documents(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    doc_type: Optional[str] = Query(None, description="pdf, docx, pptx or txt"),
+    filename: Optional[str] = Query(None, description="Substring of the filename"),
+    uploaded_after: Optional[str] = Query(None, description="ISO date/time, inclusive"),
+    uploaded_before: Optional[str] = Query(None, description="ISO date/time, exclusive"),
+):
+    """List processed documents, newest first, with pagination and filters"""
     try:
-        processed_docs = load_processed_docs()
+        total, documents = registry.list(
+            limit=limit,
+            offset=offset,
+            doc_type=doc_type,
+            filename=filename,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before,
+        )
         return {
-            "total_documents": len(processed_docs),
-            "documents": list(processed_docs.values())
+            "total_documents": total,
+            "limit": limit,
+            "offset": offset,
+            "documents": documents
         }
     except Exception as e:
         logger.error(f"Error listing documents: {str(e)}")
@@ -244,17 +251,16 @@ async def list_documents():
 async def delete_document(file_hash: str):
     """Delete a document by its hash"""
     try:
-        processed_docs = load_processed_docs()
-        
-        if file_hash not in processed_docs:
+        if registry.get(file_hash) is None:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Remove from search index
+        # Remove from the search index first: if that fails the registry row stays, and
+        # the delete can be retried instead of leaving an unlisted but searchable document
         search_engine.delete_document(file_hash)
         
-        # Remove from processed docs
-        deleted_doc = processed_docs.pop(file_hash)
-        save_processed_docs(processed_docs)
+        deleted_doc = registry.delete(file_hash)
+        if deleted_doc is None:
+            raise HTTPException(status_code=404, detail="Document not found")
         
         return {
             "message": "Document deleted successfully",
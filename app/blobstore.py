@@ -0,0 +1,251 @@
+"""
+Content-addressed store for uploaded files.
+
+Blobs are keyed by the SHA-256 of their content and sharded as
+`<root>/ab/cd/<sha256>[.gz]`, so identical uploads are stored once no matter
+what they were called. Original filenames are kept only as metadata on the
+references that tie a blob to the documents built from it.
+"""
+import os
+import gzip
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join("data", "blobs"))
+BLOB_COMPRESSION = os.getenv("BLOB_COMPRESSION", "none").lower()   # "none" or "gzip"
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "3600"))   # unreferenced blobs kept this long
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256      TEXT PRIMARY KEY,
+    size        INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    compressed  INTEGER NOT NULL,
+    created_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    sha256     TEXT NOT NULL,
+    doc_id     TEXT NOT NULL,
+    filename   TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (sha256, doc_id)
+);
+CREATE INDEX IF NOT EXISTS idx_refs_doc ON refs(doc_id);
+"""
+
+
+class BlobStore:
+    """Sharded, deduplicating blob store with per-document reference counts"""
+
+    def __init__(self, root: str = BLOB_STORE_DIR, compression: str = BLOB_COMPRESSION):
+        self.root = root
+        self.compression = compression if compression in ("none", "gzip") else "none"
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.root, "blobs.sqlite3"), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def blob_path(self, sha256: str, compressed: bool = False) -> str:
+        path = os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+        return path + ".gz" if compressed else path
+
+    def staging_path(self) -> str:
+        """A fresh temp path on the same filesystem, for streaming an upload before its hash is known."""
+        staging = os.path.join(self.root, "tmp")
+        os.makedirs(staging, exist_ok=True)
+        return os.path.join(staging, uuid.uuid4().hex)
+
+    def get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, stored_size, compressed FROM blobs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(sha256, bool(row[2]))
+        return {"sha256": sha256, "size": row[0], "stored_size": row[1], "compressed": bool(row[2]), "path": path}
+
+    @contextmanager
+    def _write_txn(self) -> Iterator[sqlite3.Connection]:
+        """Serialize blob/ref changes across threads (RLock) and processes (BEGIN IMMEDIATE)."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _stored(self, conn: sqlite3.Connection, sha256: str) -> Optional[str]:
+        row = conn.execute("SELECT compressed FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        if row is None:
+            return None
+        path = self.blob_path(sha256, bool(row[0]))
+        return path if os.path.exists(path) else None
+
+    def put_file(self, tmp_path: str, sha256: str, size: int, doc_id: Optional[str] = None,
+                 filename: Optional[str] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Move a fully written temp file into the store under its hash.
+        Returns (blob_info, created); if the blob already existed the temp file is discarded.
+        With `doc_id`, the document's reference is added in the same transaction, so a
+        concurrent release() or gc() cannot delete the blob before it is referenced.
+        """
+        compressed = self.compression == "gzip"
+        existing = self.get(sha256)
+        if compressed and not (existing and os.path.exists(existing["path"])):
+            # Compress outside the write transaction; discarded if another writer wins the race
+            gz_tmp = tmp_path + ".gz"
+            with open(tmp_path, "rb") as src, gzip.open(gz_tmp, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(tmp_path)
+            tmp_path = gz_tmp
+
+        now = time.time()
+        with self._write_txn() as conn:
+            created = self._stored(conn, sha256) is None
+            if created:
+                final_path = self.blob_path(sha256, compressed)
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                stored_size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, final_path)
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs(sha256, size, stored_size, compressed, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (sha256, size, stored_size, int(compressed), now),
+                )
+            else:
+                os.remove(tmp_path)
+                # Restart the GC grace period for a blob that was just uploaded again
+                conn.execute("UPDATE blobs SET created_at = ? WHERE sha256 = ?", (now, sha256))
+            if doc_id is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO refs(sha256, doc_id, filename, created_at) VALUES (?, ?, ?, ?)",
+                    (sha256, doc_id, filename, now),
+                )
+        return self.get(sha256), created
+
+    @contextmanager
+    def local_path(self, sha256: str) -> Iterator[str]:
+        """Yield a plain readable path for a blob, decompressing to a temp file if needed."""
+        info = self.get(sha256)
+        if info is None:
+            raise FileNotFoundError(f"Blob not found: {sha256}")
+        if not info["compressed"]:
+            yield info["path"]
+            return
+        tmp = self.staging_path()
+        try:
+            with open(tmp, "wb") as dst, gzip.open(info["path"], "rb") as src:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            yield tmp
+        finally:
+            os.remove(tmp)
+
+    # ----------------------------
+    # References
+    # ----------------------------
+    def add_ref(self, sha256: str, doc_id: str, filename: Optional[str] = None):
+        """Reference a blob that is already held by another reference (see put_file for new uploads)."""
+        with self._write_txn() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO refs(sha256, doc_id, filename, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, doc_id, filename, time.time()),
+            )
+
+    def refs(self, sha256: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT doc_id, filename, created_at FROM refs WHERE sha256 = ? ORDER BY created_at", (sha256,)
+            ).fetchall()
+        return [{"doc_id": r[0], "filename": r[1], "created_at": r[2]} for r in rows]
+
+    def release(self, sha256: str, doc_id: str) -> int:
+        """Drop one document's reference; delete the blob when none remain. Returns the new refcount."""
+        with self._write_txn() as conn:
+            conn.execute("DELETE FROM refs WHERE sha256 = ? AND doc_id = ?", (sha256, doc_id))
+            remaining = conn.execute("SELECT COUNT(*) FROM refs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+            if remaining == 0:
+                self._delete_blob(conn, sha256)
+        return remaining
+
+    def _delete_blob(self, conn: sqlite3.Connection, sha256: str):
+        # Inside the write transaction, so no put_file can re-reference the blob meanwhile
+        path = self._stored(conn, sha256)
+        conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+        if path:
+            os.remove(path)
+
+    def clear_refs(self):
+        """Forget all document references (e.g. after the index was reset); run gc() to drop the blobs."""
+        with self._write_txn() as conn:
+            conn.execute("DELETE FROM refs")
+
+    def gc(self, grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> Dict[str, int]:
+        """
+        Delete blobs that no document references and that were stored more than
+        `grace_seconds` ago (e.g. /upload-only files, or everything after a reset),
+        plus abandoned staging files. Returns {"blobs", "bytes", "staging_files"}.
+        """
+        cutoff = time.time() - grace_seconds
+        removed, freed = 0, 0
+        with self._write_txn() as conn:
+            rows = conn.execute(
+                "SELECT sha256, stored_size FROM blobs WHERE created_at <= ? "
+                "AND NOT EXISTS (SELECT 1 FROM refs WHERE refs.sha256 = blobs.sha256)",
+                (cutoff,),
+            ).fetchall()
+            for sha256, stored_size in rows:
+                self._delete_blob(conn, sha256)
+                removed += 1
+                freed += stored_size
+
+        staging_removed = 0
+        staging = os.path.join(self.root, "tmp")
+        if os.path.isdir(staging):
+            for name in os.listdir(staging):
+                path = os.path.join(staging, name)
+                try:
+                    if os.path.getmtime(path) <= cutoff:
+                        os.remove(path)
+                        staging_removed += 1
+                except OSError:
+                    pass   # finished or removed by its writer meanwhile
+        if removed or staging_removed:
+            logger.info(f"Blob GC removed {removed} unreferenced blobs ({freed} bytes) and {staging_removed} staging files")
+        return {"blobs": removed, "bytes": freed, "staging_files": staging_removed}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            blobs, size, stored = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM blobs"
+            ).fetchone()
+            refs = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {
+            "blobs": blobs,
+            "refs": refs,
+            "logical_bytes": size,
+            "stored_bytes": stored,
+            "compression": self.compression,
+        }
+
+
+# Global blob store
+blob_store = BlobStore()
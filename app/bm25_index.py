@@ -0,0 +1,308 @@
+"""
+Persistent, incrementally maintained BM25 index for keyword search.
+
+Postings, chunk lengths and corpus statistics live in a small SQLite file so
+that a keyword query only reads the postings of its own terms instead of
+rebuilding BM25 over the whole Chroma collection.
+"""
+import os
+import math
+import re
+import sqlite3
+import threading
+import heapq
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Tuple, Optional
+
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", os.path.join("data", "bm25_index.sqlite3"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+BM25_IDLE_READERS = int(os.getenv("BM25_IDLE_READERS", "4"))   # read connections kept open between queries
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    chunk_id TEXT PRIMARY KEY,
+    doc_id   TEXT NOT NULL,
+    length   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id);
+CREATE TABLE IF NOT EXISTS postings (
+    term     TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    tf       INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(chunk_id);
+CREATE TABLE IF NOT EXISTS stats (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", (text or "").lower())
+
+
+class BM25Index:
+    """SQLite-backed inverted index with BM25 (Okapi) scoring"""
+
+    def __init__(self, path: str = BM25_INDEX_PATH, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Read connections for queries that skip the lock; borrowed per read, at most
+        # BM25_IDLE_READERS stay open, so a large thread pool does not pin one each.
+        self._idle: List[sqlite3.Connection] = []
+        self._idle_lock = threading.Lock()
+        self._idle_pid = os.getpid()
+
+    # ----------------------------
+    # Connection / schema
+    # ----------------------------
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _ensure_schema(self):
+        if self._conn is None:
+            with self._lock:
+                self._connect()   # creates the file and schema
+
+    @contextmanager
+    def _reader(self):
+        """Borrow a read connection; WAL lets it read while the writer connection writes."""
+        self._ensure_schema()
+        with self._idle_lock:
+            if self._idle_pid != os.getpid():
+                self._idle, self._idle_pid = [], os.getpid()   # inherited across a fork
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._idle_lock:
+                if self._idle_pid == os.getpid() and len(self._idle) < BM25_IDLE_READERS:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    @staticmethod
+    def _bump_stat(conn: sqlite3.Connection, key: str, delta: int):
+        conn.execute(
+            "INSERT INTO stats(key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+            (key, delta),
+        )
+
+    def _remove_chunks(self, conn: sqlite3.Connection, chunk_ids: List[str]):
+        if not chunk_ids:
+            return
+        removed, removed_len = 0, 0
+        for cid in chunk_ids:
+            row = conn.execute("SELECT length FROM chunks WHERE chunk_id = ?", (cid,)).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM postings WHERE chunk_id = ?", (cid,))
+            conn.execute("DELETE FROM chunks WHERE chunk_id = ?", (cid,))
+            removed += 1
+            removed_len += int(row[0])
+        if removed:
+            self._bump_stat(conn, "num_chunks", -removed)
+            self._bump_stat(conn, "total_length", -removed_len)
+            self._bump_stat(conn, "generation", 1)
+
+    def _insert_chunks(self, conn: sqlite3.Connection, doc_id: str, chunk_ids: List[str], texts: List[str]) -> int:
+        written, total_len = 0, 0
+        for cid, text in zip(chunk_ids, texts):
+            tokens = tokenize(text)
+            conn.execute(
+                "INSERT INTO chunks(chunk_id, doc_id, length) VALUES (?, ?, ?)",
+                (cid, doc_id, len(tokens)),
+            )
+            rows = [(term, cid, tf) for term, tf in Counter(tokens).items()]
+            conn.executemany("INSERT INTO postings(term, chunk_id, tf) VALUES (?, ?, ?)", rows)
+            written += len(rows)
+            total_len += len(tokens)
+        self._bump_stat(conn, "num_chunks", len(chunk_ids))
+        self._bump_stat(conn, "total_length", total_len)
+        self._bump_stat(conn, "generation", 1)
+        return written
+
+    # ----------------------------
+    # Writes
+    # ----------------------------
+    def upsert_chunks(self, doc_id: str, chunk_ids: List[str], texts: List[str]) -> int:
+        """Replace every chunk of `doc_id` with the given chunks; return postings written."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                old = [r[0] for r in conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))]
+                self._remove_chunks(conn, list(set(old) | set(chunk_ids)))
+                return self._insert_chunks(conn, doc_id, chunk_ids, texts)
+
+    def remove_document(self, doc_id: str) -> int:
+        """Drop all chunks of a document; return number of chunks removed."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                ids = [r[0] for r in conn.execute("SELECT chunk_id FROM chunks WHERE doc_id = ?", (doc_id,))]
+                self._remove_chunks(conn, ids)
+            return len(ids)
+
+    def _clear(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM postings")
+        conn.execute("DELETE FROM chunks")
+        conn.execute("DELETE FROM stats WHERE key != 'generation'")
+        self._bump_stat(conn, "generation", 1)
+
+    def clear(self):
+        """Remove all postings and statistics (the generation survives and is bumped)."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                self._clear(conn)
+
+    def rebuild(self, batches: Iterable[Tuple[List[str], List[str], List[Dict[str, Any]]]]) -> int:
+        """
+        Rebuild from (ids, docs, metas) batches, e.g. a full Chroma scan.
+
+        Runs as one write transaction: queries keep seeing the old index until it commits.
+        """
+        count = 0
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._clear(conn)
+                for ids, docs, metas in batches:
+                    grouped: Dict[str, Tuple[List[str], List[str]]] = {}
+                    for cid, doc, meta in zip(ids, docs, metas):
+                        doc_id = (meta or {}).get("doc_id") or cid
+                        g = grouped.setdefault(doc_id, ([], []))
+                        g[0].append(cid)
+                        g[1].append(doc or "")
+                    for doc_id, (cids, texts) in grouped.items():
+                        # Unlike upsert_chunks, keep chunks of the same doc seen in earlier batches.
+                        self._remove_chunks(conn, cids)
+                        self._insert_chunks(conn, doc_id, cids, texts)
+                    count += len(ids)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return count
+
+    # ----------------------------
+    # Reads
+    # ----------------------------
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._read_stats(self._connect())
+
+    @staticmethod
+    def _read_stats(conn: sqlite3.Connection) -> Dict[str, Any]:
+        stats = dict(conn.execute("SELECT key, value FROM stats").fetchall())
+        n = int(stats.get("num_chunks", 0))
+        total = int(stats.get("total_length", 0))
+        return {
+            "num_chunks": n,
+            "total_length": total,
+            "avg_length": (total / n) if n else 0.0,
+            "generation": int(stats.get("generation", 0)),
+        }
+
+    def count(self) -> int:
+        return self.get_stats()["num_chunks"]
+
+    def generation(self) -> int:
+        """Counter bumped by every write; cached query results are keyed by it.
+
+        Read on a pooled connection without the index lock, so a cache lookup never
+        waits for a write.
+        """
+        with self._reader() as conn:
+            row = conn.execute("SELECT value FROM stats WHERE key = 'generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def chunk_ids_after(self, after: Optional[str], limit: int) -> List[str]:
+        """Next `limit` chunk ids in id order after `after` (keyset page over the primary key)."""
+        with self._lock:
+            conn = self._connect()
+            if after is None:
+                rows = conn.execute("SELECT chunk_id FROM chunks ORDER BY chunk_id LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT chunk_id FROM chunks WHERE chunk_id > ? ORDER BY chunk_id LIMIT ?", (after, limit)
+                ).fetchall()
+        return [r[0] for r in rows]
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """Return the top-k (chunk_id, score) pairs, reading only the query terms' postings."""
+        if k <= 0:
+            return []
+        scores = self.score_all(query)
+        return heapq.nlargest(k, scores.items(), key=lambda x: x[1])
+
+    def score_all(self, query: str) -> Dict[str, float]:
+        """
+        BM25 score of every chunk matching a query term, e.g. to page through the ranking.
+
+        Reads on a pooled connection without the index lock, so queries neither wait for
+        writes nor block them.
+        """
+        terms = Counter(tokenize(query))
+        if not terms:
+            return {}
+
+        scores: Dict[str, float] = {}
+        with self._reader() as conn:
+            conn.execute("BEGIN")   # one snapshot for the statistics and every term's postings
+            stats = self._read_stats(conn)
+            n, avgdl = stats["num_chunks"], stats["avg_length"] or 1.0
+            if n == 0:
+                return {}
+            for term, qtf in terms.items():
+                rows = conn.execute(
+                    "SELECT p.chunk_id, p.tf, c.length FROM postings p "
+                    "JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                df = len(rows)
+                if not df:
+                    continue
+                # log1p form keeps IDF positive for terms present in most chunks
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                for cid, tf, length in rows:
+                    denom = tf + self.k1 * (1.0 - self.b + self.b * length / avgdl)
+                    scores[cid] = scores.get(cid, 0.0) + qtf * idf * tf * (self.k1 + 1.0) / denom
+        return scores
+
+
+# Global BM25 index
+bm25_index = BM25Index()
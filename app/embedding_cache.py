@@ -0,0 +1,273 @@
+"""
+Content-addressed cache of chunk embeddings.
+
+Vectors are keyed by model name plus the SHA-256 of the whitespace-normalized
+chunk text, so boilerplate paragraphs shared by many documents (or a document
+re-ingested after a metadata change) are embedded once. Each model gets a
+fixed-capacity float32 slot file that is memory-mapped; a small SQLite table
+maps keys to slots and tracks last use for LRU eviction.
+
+The cache directory is shared by processes (the FastAPI app and the legacy
+search engine), so a slot can be evicted and rewritten by another process
+between the SQLite lookup and the read of the vector. Each slot therefore also
+stores the digest of the key it holds, cleared while the vector is rewritten;
+a reader checks it before and after copying the vector and treats a mismatch
+as a miss.
+"""
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+import numpy as np
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join("data", "embedding_cache"))
+EMBEDDING_CACHE_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "200000"))   # vectors per model
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT PRIMARY KEY,
+    dim   INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    model     TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    slot      INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries(model, last_used);
+"""
+
+_LOOKUP_BATCH = 500  # keys per IN (...) query, under SQLite's variable limit
+_DIGEST_BYTES = 32   # SHA-256 of the chunk key, stored next to each slot
+
+
+def model_key(model: str) -> str:
+    """Canonical model name: 'sentence-transformers/all-MiniLM-L6-v2' and 'all-MiniLM-L6-v2' are the same weights."""
+    name = (model or "").strip()
+    prefix = "sentence-transformers/"
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def chunk_key(text: str) -> str:
+    """SHA-256 of the chunk with whitespace collapsed (tokenization ignores it anyway)."""
+    return hashlib.sha256(" ".join((text or "").split()).encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """Disk-backed, memory-mapped LRU cache of embeddings per model"""
+
+    def __init__(self, root: str = EMBEDDING_CACHE_DIR, capacity: int = EMBEDDING_CACHE_CAPACITY):
+        self.root = root
+        self.capacity = max(1, capacity)
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._vectors: Dict[str, np.memmap] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), timeout=30,
+                                   check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Entries from before model names were canonicalized (see model_key) are unreachable
+            conn.execute("DELETE FROM entries WHERE model LIKE 'sentence-transformers/%'")
+            conn.execute("DELETE FROM models WHERE model LIKE 'sentence-transformers/%'")
+            self._conn = conn
+        return self._conn
+
+    def _vector_file(self, model: str, dim: int) -> Tuple[np.memmap, np.memmap]:
+        """Open (creating or growing to capacity) the model's slot file and its key-digest file."""
+        files = self._vectors.get(model)
+        if files is not None and files[0].shape[1] == dim:
+            return files
+        base = os.path.join(self.root, re.sub(r"[^\w.-]", "_", model))
+        path, keys_path = base + ".f32", base + ".keys"
+        if not os.path.exists(keys_path):
+            # Slots written before digests existed cannot be verified; start the model over
+            self._connect().execute("DELETE FROM entries WHERE model = ?", (model,))
+        row_bytes = dim * 4
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < self.capacity * row_bytes:
+            with open(path, "ab") as f:
+                f.truncate(self.capacity * row_bytes)   # sparse until written
+            size = self.capacity * row_bytes
+        slots = size // row_bytes
+        with open(keys_path, "ab") as f:
+            if f.tell() < slots * _DIGEST_BYTES:
+                f.truncate(slots * _DIGEST_BYTES)
+        mm = np.memmap(path, dtype=np.float32, mode="r+", shape=(slots, dim))
+        keys = np.memmap(keys_path, dtype=np.uint8, mode="r+", shape=(slots, _DIGEST_BYTES))
+        self._vectors[model] = (mm, keys)
+        return mm, keys
+
+    @staticmethod
+    def _read_slot(mm: np.memmap, keys: np.memmap, slot: int, digest: bytes) -> Optional[np.ndarray]:
+        """Copy a slot's vector if it still holds `digest` before and after the copy (else None)."""
+        if keys[slot].tobytes() != digest:
+            return None
+        vector = np.array(mm[slot])
+        if keys[slot].tobytes() != digest:
+            return None
+        return vector
+
+    def _model_stats(self, model: str) -> Dict[str, Any]:
+        return self._stats.setdefault(model, {
+            "hits": 0, "misses": 0, "evictions": 0,
+            "compute_seconds": 0.0, "seconds_saved": 0.0,
+        })
+
+    def _dim(self, conn: sqlite3.Connection, model: str) -> Optional[int]:
+        row = conn.execute("SELECT dim FROM models WHERE model = ?", (model,)).fetchone()
+        return row[0] if row else None
+
+    def _lookup(self, conn: sqlite3.Connection, model: str, keys: List[str]) -> Dict[str, int]:
+        slots: Dict[str, int] = {}
+        for start in range(0, len(keys), _LOOKUP_BATCH):
+            batch = keys[start:start + _LOOKUP_BATCH]
+            marks = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, slot FROM entries WHERE model = ? AND key IN ({marks})", [model, *batch]
+            ).fetchall()
+            slots.update(rows)
+        return slots
+
+    def _allocate(self, conn: sqlite3.Connection, model: str, n: int) -> Tuple[List[int], int]:
+        """Return n slots: unused ones first, then least-recently-used entries (which are dropped)."""
+        used = conn.execute("SELECT COUNT(*) FROM entries WHERE model = ?", (model,)).fetchone()[0]
+        fresh = list(range(used, min(self.capacity, used + n)))
+        evict = n - len(fresh)
+        if evict <= 0:
+            return fresh, 0
+        victims = conn.execute(
+            "SELECT key, slot FROM entries WHERE model = ? ORDER BY last_used LIMIT ?", (model, evict)
+        ).fetchall()
+        conn.executemany("DELETE FROM entries WHERE model = ? AND key = ?", [(model, k) for k, _ in victims])
+        return fresh + [slot for _, slot in victims], len(victims)
+
+    def embed(self, model: str, texts: List[str],
+              encode: Callable[[List[str]], Any]) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """
+        Embeddings for texts (one row each), computing only cache misses with `encode`.
+        Returns (float32 matrix, {"hits", "misses", "seconds_saved", "compute_seconds"}).
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), {"hits": 0, "misses": 0, "seconds_saved": 0.0, "compute_seconds": 0.0}
+        if not EMBEDDING_CACHE_ENABLED:
+            start = time.perf_counter()
+            vectors = np.asarray(encode(list(texts)), dtype=np.float32)
+            return vectors, {"hits": 0, "misses": len(texts), "seconds_saved": 0.0,
+                             "compute_seconds": round(time.perf_counter() - start, 4)}
+
+        model = model_key(model)
+        keys = [chunk_key(t) for t in texts]
+        now = time.time()
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            conn = self._connect()
+            dim = self._dim(conn, model)
+            slots = self._lookup(conn, model, list(set(keys))) if dim else {}
+            if slots:
+                mm, digests = self._vector_file(model, dim)
+                for k, slot in slots.items():
+                    vector = self._read_slot(mm, digests, slot, bytes.fromhex(k))
+                    if vector is not None:
+                        found[k] = vector
+                conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE model = ? AND key = ?",
+                    [(now, model, k) for k in found],
+                )
+        hits = [i for i, k in enumerate(keys) if k in found]
+
+        # Encode misses outside the lock; duplicates within the batch are embedded once
+        missing: Dict[str, str] = {}
+        for i, k in enumerate(keys):
+            if k not in found:
+                missing.setdefault(k, texts[i])
+        computed: Dict[str, np.ndarray] = {}
+        compute_seconds = 0.0
+        if missing:
+            start = time.perf_counter()
+            vectors = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            compute_seconds = time.perf_counter() - start
+            computed = dict(zip(missing.keys(), vectors))
+            dim = dim or vectors.shape[1]
+            self._store(model, dim, computed, now)
+
+        rows = [found[k] if k in found else computed[k] for k in keys]
+        result = np.vstack(rows).astype(np.float32, copy=False)
+
+        with self._lock:
+            stats = self._model_stats(model)
+            stats["hits"] += len(hits)
+            stats["misses"] += len(texts) - len(hits)
+            stats["compute_seconds"] += compute_seconds
+            # Time saved = hits x the average cost of computing one embedding so far
+            saved = len(hits) * stats["compute_seconds"] / max(1, stats["misses"])
+            stats["seconds_saved"] += saved
+        return result, {
+            "hits": len(hits),
+            "misses": len(texts) - len(hits),
+            "seconds_saved": round(saved, 4),
+            "compute_seconds": round(compute_seconds, 4),
+        }
+
+    def _store(self, model: str, dim: int, vectors: Dict[str, np.ndarray], now: float):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                known = self._dim(conn, model)
+                if known is None:
+                    conn.execute("INSERT INTO models(model, dim) VALUES (?, ?)", (model, dim))
+                elif known != dim:
+                    raise ValueError(f"Embedding dim changed for {model}: {known} -> {dim}")
+                # Another writer may have stored some of these meanwhile
+                already = self._lookup(conn, model, list(vectors))
+                mm, digests = self._vector_file(model, dim)
+                # Entries whose slot no longer carries their digest (e.g. a write interrupted by a crash) are rewritten in place
+                stale = [(k, slot) for k, slot in already.items() if digests[slot].tobytes() != bytes.fromhex(k)]
+                todo = [k for k in vectors if k not in already][:self.capacity]
+                slots, evicted = self._allocate(conn, model, len(todo))
+                for key, slot in list(zip(todo, slots)) + stale:
+                    # Clear the digest first so a concurrent reader of the old entry sees a miss
+                    digests[slot] = 0
+                    mm[slot] = vectors[key]
+                    digests[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                mm.flush()
+                digests.flush()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries(model, key, slot, last_used) VALUES (?, ?, ?, ?)",
+                    [(model, key, slot, now) for key, slot in zip(todo, slots)],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._model_stats(model)["evictions"] += evicted
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._connect().execute("SELECT model, COUNT(*) FROM entries GROUP BY model").fetchall())
+            out: Dict[str, Any] = {}
+            for model in set(counts) | set(self._stats):
+                stats = dict(self._model_stats(model))
+                lookups = stats["hits"] + stats["misses"]
+                stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+                stats["compute_seconds"] = round(stats["compute_seconds"], 4)
+                stats["seconds_saved"] = round(stats["seconds_saved"], 4)
+                stats["entries"] = counts.get(model, 0)
+                stats["capacity"] = self.capacity
+                out[model] = stats
+        return out
+
+
+# Global embedding cache
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,211 @@
+"""
+Incremental rank fusion with early termination.
+
+Each leg (e.g. keyword, vector) is a ranked stream read by sorted access in
+growing pages: the first page is 2k deep and each later one FUSION_GROWTH times
+deeper. After every round the engine knows, for each candidate seen so
+far, a lower bound on its fused score (unseen legs count as 0) and an upper
+bound (unseen legs could still contribute up to that leg's current threshold,
+the best score any item not yet read from it can have). Following the
+no-random-access variant of Fagin's threshold algorithm, fetching stops as soon
+as the k best groups by lower bound cannot be overtaken: the k-th lower bound
+is at least the upper bound of every other candidate and of anything unseen.
+
+Reading stops after FUSION_MAX_ROUNDS pages even if the bound has not settled;
+the result is then the top-k by what was read (unread contributions count as
+0, as a one-shot fusion of the first pages would) and the report says so.
+
+The fused score is pluggable (`WeightedBlend`, `ReciprocalRankFusion`); both
+are sums of per-leg contributions that never increase with rank, which is all
+the bound needs.
+"""
+import os
+from typing import Dict, Any, List, Optional, Callable, Tuple, Hashable
+
+FUSION_MAX_DEPTH = int(os.getenv("FUSION_MAX_DEPTH", "256"))   # per leg
+FUSION_MAX_ROUNDS = int(os.getenv("FUSION_MAX_ROUNDS", "3"))
+FUSION_GROWTH = int(os.getenv("FUSION_GROWTH", "4"))           # depth multiplier per round
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# (item id, leg score where higher is better, payload)
+Ranked = List[Tuple[str, float, Any]]
+
+
+class Fusion:
+    """Per-leg contribution to a fused score; must not increase with rank"""
+
+    name = "fusion"
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        self.weights = dict(weights or {})
+
+    def weight(self, leg: str) -> float:
+        return self.weights.get(leg, 1.0)
+
+    def contribution(self, leg: str, rank: int, score: float, top_score: float) -> float:
+        """Contribution of the item at 1-based `rank` with `score` (the leg's best is `top_score`)."""
+        raise NotImplementedError
+
+    def bound(self, leg: str, next_rank: int, last_score: float, top_score: float) -> float:
+        """Largest contribution any item not yet read from the leg can still make."""
+        raise NotImplementedError
+
+
+class WeightedBlend(Fusion):
+    """sum(weight * score / best score of the leg); each leg's top hit scores its full weight"""
+
+    name = "blend"
+
+    def contribution(self, leg: str, rank: int, score: float, top_score: float) -> float:
+        return self.weight(leg) * max(score, 0.0) / top_score if top_score > 0 else 0.0
+
+    def bound(self, leg: str, next_rank: int, last_score: float, top_score: float) -> float:
+        return self.contribution(leg, next_rank, last_score, top_score)
+
+
+class ReciprocalRankFusion(Fusion):
+    """sum(weight / (c + rank)); ignores score scales entirely"""
+
+    name = "rrf"
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, c: int = RRF_K):
+        super().__init__(weights)
+        self.c = c
+
+    def contribution(self, leg: str, rank: int, score: float, top_score: float) -> float:
+        return self.weight(leg) / (self.c + rank)
+
+    def bound(self, leg: str, next_rank: int, last_score: float, top_score: float) -> float:
+        return self.contribution(leg, next_rank, last_score, top_score)
+
+
+FUSIONS: Dict[str, Callable[..., Fusion]] = {
+    WeightedBlend.name: WeightedBlend,
+    ReciprocalRankFusion.name: ReciprocalRankFusion,
+}
+
+
+def get_fusion(name: str, weights: Optional[Dict[str, float]] = None) -> Fusion:
+    try:
+        return FUSIONS[name](weights)
+    except KeyError:
+        raise ValueError(f"Unknown fusion '{name}'; expected one of {sorted(FUSIONS)}")
+
+
+class _Leg:
+    def __init__(self, name: str):
+        self.name = name
+        self.items: Ranked = []
+        self.top_score = 0.0
+        self.exhausted = False
+        self.failed = False
+        self.capped = False
+
+    def bound(self, fusion: Fusion) -> float:
+        if self.exhausted or not self.items:
+            return 0.0
+        return fusion.bound(self.name, len(self.items) + 1, self.items[-1][1], self.top_score)
+
+
+def fuse(legs: List[str], fetch: Callable[[Dict[str, int]], Dict[str, Optional[Ranked]]], k: int,
+         fusion: Fusion, group: Callable[[str], Hashable] = lambda item_id: item_id,
+         initial_depth: Optional[int] = None, max_depth: int = FUSION_MAX_DEPTH,
+         max_rounds: int = FUSION_MAX_ROUNDS, growth: int = FUSION_GROWTH
+         ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fuse ranked legs into the top-k groups (best item per group).
+
+    `fetch({leg: depth})` returns each requested leg's top `depth` items (a prefix extending
+    what it returned before), or None if the leg failed. Returns ([{"id", "group",
+    "score_lower_bound", "score_exact", "legs": {leg: payload}}], report) where report has the
+    depth read from each leg, whether the bound stopped fetching before every leg was
+    exhausted ("early_stop") and whether the round cap did ("round_capped", in which case the
+    top-k is not guaranteed exact).
+
+    An early stop guarantees which groups are in the top-k, not their fused scores: a leg
+    that was not read far enough to reach an item contributes nothing to its lower bound, so
+    results are ordered by that bound and the order within the top-k is approximate.
+    "score_exact" marks the items no unread leg could still add to.
+    """
+    state = {name: _Leg(name) for name in legs}
+    seen: Dict[str, Dict[str, Any]] = {}
+    depth = min(max(1, initial_depth or 2 * k), max_depth)
+    rounds = 0
+    round_capped = False
+    selected: List[Dict[str, Any]] = []
+
+    while True:
+        wanted = {name: depth for name, leg in state.items() if not leg.exhausted}
+        if not wanted:
+            break
+        if rounds >= max(1, max_rounds):
+            round_capped = True
+            break
+        rounds += 1
+        fetched = fetch(wanted)
+        for name in wanted:
+            leg = state[name]
+            items = fetched.get(name)
+            if items is None:
+                leg.failed = leg.exhausted = True
+                continue
+            if not leg.items and items:
+                leg.top_score = items[0][1]
+            for rank, (item_id, score, payload) in enumerate(items[len(leg.items):], start=len(leg.items) + 1):
+                entry = seen.setdefault(item_id, {"id": item_id, "group": group(item_id), "known": {}, "legs": {}})
+                entry["known"][name] = fusion.contribution(name, rank, score, leg.top_score)
+                entry["legs"][name] = payload
+            leg.items = list(items)
+            if len(items) < depth:
+                leg.exhausted = True
+            elif depth >= max_depth:
+                leg.capped = leg.exhausted = True
+
+        selected, done = _select(seen, state, fusion, k)
+        if done:
+            break
+        depth = min(depth * max(2, growth), max_depth)
+
+    report = {
+        "fusion": fusion.name,
+        "rounds": rounds,
+        "early_stop": not round_capped and any(not leg.exhausted for leg in state.values()),
+        "round_capped": round_capped,
+        "legs": {
+            name: {"depth": len(leg.items), "exhausted": leg.exhausted and not (leg.failed or leg.capped),
+                   "failed": leg.failed, "capped": leg.capped}
+            for name, leg in state.items()
+        },
+    }
+    results = [
+        {"id": e["id"], "group": e["group"], "score_lower_bound": e["lower"],
+         "score_exact": e["upper"] == e["lower"], "legs": e["legs"]}
+        for e in selected
+    ]
+    return results, report
+
+
+def _select(seen: Dict[str, Dict[str, Any]], state: Dict[str, _Leg], fusion: Fusion,
+            k: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """Top-k groups by lower bound, and whether no other candidate or unseen item can displace them."""
+    bounds = {name: leg.bound(fusion) for name, leg in state.items()}
+    for entry in seen.values():
+        entry["lower"] = sum(entry["known"].values())
+        entry["upper"] = entry["lower"] + sum(b for name, b in bounds.items() if name not in entry["known"])
+
+    best: Dict[Hashable, Dict[str, Any]] = {}
+    for entry in sorted(seen.values(), key=lambda e: e["lower"], reverse=True):
+        best.setdefault(entry["group"], entry)
+        if len(best) >= k:
+            break
+    selected = list(best.values())
+    if all(leg.exhausted for leg in state.values()):
+        return selected, True
+    if len(selected) < k:
+        return selected, False
+
+    threshold = selected[-1]["lower"]
+    if sum(bounds.values()) > threshold:
+        return selected, False
+    chosen = set(best)
+    return selected, all(e["upper"] <= threshold for e in seen.values() if e["group"] not in chosen)
@@ -0,0 +1,118 @@
+"""
+On-disk duplicate-detection index mapping file and normalized-content hashes
+to the doc_id that owns them.
+
+Every ingest path consults it with a primary-key lookup before doing any
+extraction or embedding work, instead of scanning Chroma metadata or a JSON
+file. `claim` is atomic, so two concurrent uploads of the same bytes cannot
+both be indexed.
+"""
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Any, Optional
+
+HASH_INDEX_PATH = os.getenv("HASH_INDEX_PATH", os.path.join("data", "hash_index.sqlite3"))
+
+FILE = "file"
+CONTENT = "content"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    kind       TEXT NOT NULL,
+    hash       TEXT NOT NULL,
+    doc_id     TEXT NOT NULL,
+    filename   TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_hashes_doc ON hashes(doc_id);
+"""
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of extracted text, case- and whitespace-normalized."""
+    normalized = " ".join((text or "").lower().strip().split())
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class HashIndex:
+    """SQLite-backed (kind, hash) -> doc_id map"""
+
+    def __init__(self, path: str = HASH_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def lookup(self, kind: str, value: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT doc_id, filename, created_at FROM hashes WHERE kind = ? AND hash = ?", (kind, value)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"doc_id": row[0], "filename": row[1], "created_at": row[2]}
+
+    def claim(self, kind: str, value: str, doc_id: str, filename: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Record value -> doc_id unless already present.
+        Returns None if this call claimed it, otherwise the existing owner.
+        """
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO hashes(kind, hash, doc_id, filename, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, value, doc_id, filename, time.time()),
+                )
+            if cur.rowcount == 1:
+                return None
+            existing = self.lookup(kind, value)
+        if existing and existing["doc_id"] == doc_id:
+            return None
+        return existing
+
+    def assign(self, kind: str, value: str, doc_id: str, filename: Optional[str] = None):
+        """Point value at doc_id, replacing any previous owner."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO hashes(kind, hash, doc_id, filename, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (kind, value, doc_id, filename, time.time()),
+                )
+
+    def remove_doc(self, doc_id: str) -> int:
+        """Forget every hash owned by doc_id; return rows removed."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute("DELETE FROM hashes WHERE doc_id = ?", (doc_id,)).rowcount
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM hashes")
+
+    def count(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connect().execute("SELECT kind, COUNT(*) FROM hashes GROUP BY kind").fetchall()
+        return {kind: n for kind, n in rows}
+
+
+# Global hash index for the app/ ingest paths
+hash_index = HashIndex()
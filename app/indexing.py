@@ -1,9 +1,13 @@
+import os
 import re
 import time
-from typing import List, Dict, Any
-import chromadb
-from chromadb.utils import embedding_functions
-from .utils import CHROMA_DB_DIR, EMBEDDING_MODEL
+from typing import List, Dict, Any, Optional, Tuple, Iterator, Sequence
+from .resources import resource_registry
+from .bm25_index import bm25_index
+from .embedding_cache import embedding_cache
+
+ITER_DOCS_BATCH_SIZE = int(os.getenv("ITER_DOCS_BATCH_SIZE", "500"))
+_PROJECTION = {"documents": "docs", "metadatas": "metas", "embeddings": "embeddings"}
 
 
 def split_into_chunks(text: str, target_words: int = 1000, overlap_words: int = 100) -> List[str]:
@@ -24,12 +28,11 @@ def split_into_chunks(text: str, target_words: int = 1000, overlap_words: int =
 
 
 def get_chroma_collection(name: str = "docs"):
-    client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
-    ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
-    return client.get_or_create_collection(name=name, embedding_function=ef)
+    return resource_registry.get_collection(name)
 
 
-def upsert_document(doc_id: str, filename: str, text: str, source_path: str) -> Dict[str, Any]:
+def upsert_document(doc_id: str, filename: str, text: str, source_path: str,
+                    extra_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     coll = get_chroma_collection()
     chunks = split_into_chunks(text)
     ids = [f"{doc_id}::chunk::{i}" for i in range(len(chunks))]
@@ -39,27 +42,119 @@ def upsert_document(doc_id: str, filename: str, text: str, source_path: str) ->
             "filename": filename,
             "chunk_index": i,
             "source_path": source_path,
-            "ingested_at": int(time.time())
+            "ingested_at": int(time.time()),
+            **(extra_metadata or {}),
         }
         for i in range(len(chunks))
     ]
-    coll.upsert(ids=ids, documents=chunks, metadatas=metadatas)
-    return {"doc_id": doc_id, "chunks": len(chunks)}
+    embeddings, cache_info = embed_chunks(chunks)
+    coll.upsert(ids=ids, documents=chunks, metadatas=metadatas, embeddings=embeddings)
+    bm25_index.upsert_chunks(doc_id, ids, chunks)
+    return {"doc_id": doc_id, "chunks": len(chunks), "embedding_cache": cache_info}
 
 
-def fetch_all_docs() -> Dict[str, List[str]]:
-    """Return {'ids': [...], 'docs': [...], 'metas': [...]} for building BM25."""
-    coll = get_chroma_collection()
-    all_ids, all_docs, all_metas = [], [], []
-    cursor = 0
-    page = 1000
+def embed_chunks(chunks: List[str]) -> Tuple[List[List[float]], Dict[str, Any]]:
+    """Embed chunks through the content-addressed cache; only unseen chunks hit the model."""
+    ef = resource_registry.get_embedding_function()
+    vectors, cache_info = embedding_cache.embed(resource_registry.model_name, chunks, ef)
+    return vectors.tolist(), cache_info
+
+
+def _bm25_id_pages(batch_size: int) -> Iterator[List[str]]:
+    """Chunk ids in id order, one keyset page at a time (WHERE chunk_id > last)."""
+    after = None
     while True:
-        batch = coll.get(include=["documents", "metadatas"], limit=page, offset=cursor)
-        ids = batch.get("ids", [])
+        ids = bm25_index.chunk_ids_after(after, batch_size)
         if not ids:
-            break
-        all_ids.extend(ids)
-        all_docs.extend(batch.get("documents", []))
-        all_metas.extend(batch.get("metadatas", []))
-        cursor += len(ids)
+            return
+        yield ids
+        after = ids[-1]
+
+
+def _chroma_pages(coll, batch_size: int, include: List[str]) -> Iterator[Dict[str, List[Any]]]:
+    """
+    Batches straight from Chroma with limit/offset, in its storage order.
+
+    Only used to backfill an empty BM25 index; each page is one bounded get().
+    """
+    offset = 0
+    while True:
+        batch = coll.get(limit=batch_size, offset=offset, include=include)
+        ids = list(batch.get("ids") or [])
+        if not ids:
+            return
+        yield _project(batch, ids, include)
+        offset += len(ids)
+
+
+def iter_docs(batch_size: int = ITER_DOCS_BATCH_SIZE,
+              include: Sequence[str] = ("documents", "metadatas"),
+              id_source: str = "auto") -> Iterator[Dict[str, List[Any]]]:
+    """
+    Stream the collection as batches of {'ids', 'docs'?, 'metas'?, 'embeddings'?}.
+
+    `include` is the projection: e.g. ("metadatas",) skips chunk text entirely.
+    With 'bm25' (the default whenever the BM25 index has chunks), ids come in chunk-id
+    order from a keyset scan of the BM25 chunk table, which is kept in step with Chroma
+    on every upsert, and each page is then fetched from Chroma by id. Chunks that exist
+    only in Chroma are not visited. With 'chroma' (used while BM25 is empty, e.g. to
+    backfill it), pages come from Chroma itself by limit/offset in storage order.
+    Either way memory stays bounded by batch_size.
+    """
+    unknown = set(include) - set(_PROJECTION)
+    if unknown:
+        raise ValueError(f"Unsupported include fields: {sorted(unknown)}")
+    coll = get_chroma_collection()
+    if id_source == "auto":
+        id_source = "bm25" if bm25_index.count() > 0 else "chroma"
+    # Choose the id source now, not lazily: a consumer such as bm25_index.rebuild may clear BM25 first
+    if id_source == "chroma":
+        return _chroma_pages(coll, batch_size, list(include))
+    return _fetch_pages(coll, _bm25_id_pages(batch_size), list(include))
+
+
+def _fetch_pages(coll, pages: Iterator[List[str]], include: List[str]) -> Iterator[Dict[str, List[Any]]]:
+    for ids in pages:
+        batch = coll.get(ids=ids, include=include)
+        # Chroma returns rows in its own order; restore id order and drop ids it no longer has
+        position = {cid: i for i, cid in enumerate(batch.get("ids", []))}
+        found = [cid for cid in ids if cid in position]
+        if not found:
+            continue
+        yield _project(batch, found, include, position)
+
+
+def _project(batch: Dict[str, Any], ids: List[str], include: List[str],
+             position: Optional[Dict[str, int]] = None) -> Dict[str, List[Any]]:
+    if position is None:
+        position = {cid: i for i, cid in enumerate(ids)}
+    out: Dict[str, List[Any]] = {"ids": ids}
+    for field in include:
+        values = batch.get(field)
+        values = list(values) if values is not None else [None] * len(position)
+        out[_PROJECTION[field]] = [values[position[cid]] for cid in ids]
+    return out
+
+
+def fetch_all_docs() -> Dict[str, List[str]]:
+    """Return {'ids': [...], 'docs': [...], 'metas': [...]} for the whole collection.
+
+    Holds the entire corpus in memory; full scans should use iter_docs instead.
+    """
+    all_ids, all_docs, all_metas = [], [], []
+    for batch in iter_docs():
+        all_ids.extend(batch["ids"])
+        all_docs.extend(batch["docs"])
+        all_metas.extend(batch["metas"])
     return {"ids": all_ids, "docs": all_docs, "metas": all_metas}
+
+
+def ensure_bm25_index() -> None:
+    """Backfill the BM25 index from Chroma if it is empty but the collection is not."""
+    if bm25_index.count() > 0:
+        return
+    coll = get_chroma_collection()
+    if (coll.count() if hasattr(coll, "count") else 0) == 0:
+        return
+    batches = iter_docs(id_source="chroma")
+    bm25_index.rebuild((b["ids"], b["docs"], b["metas"]) for b in batches)
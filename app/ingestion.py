@@ -1,9 +1,8 @@
 import os
-import io
 import time
 import uuid
 import hashlib
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable
 
 from fastapi import UploadFile
 
@@ -13,15 +12,14 @@ from docx import Document as DocxDocument
 from pptx import Presentation
 from PIL import Image
 
-# Optional OCR for scanned PDFs
-import pytesseract
-try:
-    from pdf2image import convert_from_path  # needs poppler on the system/Docker
-    PDF2IMAGE_AVAILABLE = True
-except Exception:
-    PDF2IMAGE_AVAILABLE = False
+# Optional OCR for scanned PDFs (parallel, page-level)
+from .ocr import iter_ocr_pages, PDF2IMAGE_AVAILABLE
 
-from .indexing import get_chroma_collection
+from .indexing import get_chroma_collection, upsert_document, embed_chunks
+from .bm25_index import bm25_index
+from .blobstore import blob_store
+from .hash_index import hash_index, content_hash, FILE, CONTENT
+from .near_dup import near_dup_index, NEAR_DUP_ENABLED, NEAR_DUP_ACTION
 
 # ----------------------------
 # Config (chunking + OCR)
@@ -29,72 +27,152 @@ from .indexing import get_chroma_collection
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))       # target chars per chunk
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))  # overlap between chunks
 OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() in ("1", "true", "yes")
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "20"))        # fewer native chars -> OCR the page
+OCR_SPARSE_PAGE_CHARS = int(os.getenv("OCR_SPARSE_PAGE_CHARS", "200"))  # ...or this few on an image-heavy page
+OCR_IMAGE_COVERAGE = float(os.getenv("OCR_IMAGE_COVERAGE", "0.5"))      # fraction of page area covered by images
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # bytes read per upload chunk
+
+
+class UploadTooLargeError(ValueError):
+    """Raised while streaming an upload that exceeds the size limit."""
 
 
 # ----------------------------
 # Helpers
 # ----------------------------
-def _sha256_file(path: str) -> str:
-    """Compute SHA-256 hash of a file."""
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
-def _ensure_dirs() -> Tuple[str, str]:
-    """Ensure data directories exist; return (uploads_dir, processed_dir)."""
-    uploads = os.path.join("data", "uploads")
-    processed = os.path.join("data", "processed")
-    os.makedirs(uploads, exist_ok=True)
-    os.makedirs(processed, exist_ok=True)
-    return uploads, processed
-
-
-def _save_upload(file: UploadFile) -> Tuple[str, str]:
-    """Save UploadFile to disk and return (saved_path, filename)."""
-    uploads_dir, _ = _ensure_dirs()
-    filename = file.filename or f"upload_{uuid.uuid4().hex}"
+def _safe_name(filename: str) -> str:
     # Normalize path separators for Windows/Unix
-    safe_name = filename.replace("/", "_").replace("\\", "_")
-    saved_path = os.path.join(uploads_dir, safe_name)
-    with open(saved_path, "wb") as out:
-        out.write(file.file.read())
-    return saved_path, safe_name
+    return filename.replace("/", "_").replace("\\", "_")
+
+
+class _HashingWriter:
+    """Write upload chunks to a blob-store staging file, hashing and size-checking them on the fly."""
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.tmp_path = blob_store.staging_path()
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._out = open(self.tmp_path, "wb")
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise UploadTooLargeError(f"File size exceeds maximum {self.max_bytes}")
+        self._hash.update(chunk)
+        self._out.write(chunk)
+
+    def commit(self, doc_id: Optional[str] = None, filename: Optional[str] = None) -> Dict[str, Any]:
+        """Move the staged file into the blob store under its hash, referenced by `doc_id` if given."""
+        self._out.close()
+        file_hash = self._hash.hexdigest()
+        blob, created = blob_store.put_file(self.tmp_path, file_hash, self.size, doc_id, filename)
+        return {
+            "saved_path": blob["path"],
+            "sha256": file_hash,
+            "size_bytes": self.size,
+            "deduplicated": not created,
+        }
+
+    def abort(self):
+        self._out.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
 
 
-def _text_from_pdf_with_pdfplumber(path: str) -> str:
-    text_parts: List[str] = []
+def _save_upload(file: UploadFile, doc_id: str) -> Tuple[str, str, str]:
+    """Copy an UploadFile into the blob store in fixed-size chunks, referenced by doc_id; return (saved_path, filename, sha256)."""
+    safe_name = _safe_name(file.filename or f"upload_{uuid.uuid4().hex}")
+    writer = _HashingWriter()
+    try:
+        for chunk in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b""):
+            writer.write(chunk)
+        saved = writer.commit(doc_id, safe_name)
+    except BaseException:
+        writer.abort()
+        raise
+    return saved["saved_path"], safe_name, saved["sha256"]
+
+
+def _image_coverage(page) -> float:
+    """Fraction of the page area covered by embedded images (clipped to the page)."""
+    width, height = float(page.width or 0), float(page.height or 0)
+    if width <= 0 or height <= 0:
+        return 0.0
+    covered = 0.0
+    for img in page.images or []:
+        w = min(float(img.get("x1", 0)), width) - max(float(img.get("x0", 0)), 0.0)
+        h = min(float(img.get("bottom", 0)), height) - max(float(img.get("top", 0)), 0.0)
+        if w > 0 and h > 0:
+            covered += w * h
+    return min(1.0, covered / (width * height))
+
+
+def _page_needs_ocr(native_chars: int, coverage: float) -> bool:
+    if native_chars < OCR_MIN_PAGE_CHARS:
+        return True
+    return coverage >= OCR_IMAGE_COVERAGE and native_chars < OCR_SPARSE_PAGE_CHARS
+
+
+def _pick_page_text(ocr_text: str, native_text: str) -> Tuple[str, str]:
+    """(text, method) for an OCR-routed page: keep the native text when OCR failed or found less."""
+    if len(ocr_text.strip()) < len(native_text.strip()):
+        return native_text, "native_fallback"
+    return ocr_text, "ocr"
+
+
+def _extract_pdf_pages(path: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Decide per page between native text and OCR, from the native character count
+    and image coverage. Only pages classified as scanned are rasterized and OCRed.
+    Returns (text, report) where report lists each page's method, stats and timing.
+    """
+    start = time.perf_counter()
+    pages: Dict[int, Dict[str, Any]] = {}
+    texts: Dict[int, str] = {}
+    ocr_pages: List[int] = []
+    ocr_possible = OCR_ENABLED and PDF2IMAGE_AVAILABLE
     with pdfplumber.open(path) as pdf:
-        for page in pdf.pages:
+        for number, page in enumerate(pdf.pages, start=1):
+            t0 = time.perf_counter()
             try:
-                txt = page.extract_text() or ""
-                if txt.strip():
-                    text_parts.append(txt)
+                native_chars = len(page.chars)
+                coverage = _image_coverage(page)
             except Exception:
-                # Skip problematic pages
-                continue
-    return "\n".join(text_parts).strip()
-
-
-def _ocr_pdf(path: str, dpi: int = 200) -> str:
-    """OCR each page of a PDF (if pdf2image/poppler is available)."""
-    if not PDF2IMAGE_AVAILABLE:
-        return ""
-    try:
-        images = convert_from_path(path, dpi=dpi)
-    except Exception:
-        return ""
-    text_parts: List[str] = []
-    for img in images:
-        try:
-            txt = pytesseract.image_to_string(img) or ""
-            if txt.strip():
-                text_parts.append(txt)
-        except Exception:
-            continue
-    return "\n".join(text_parts).strip()
+                native_chars, coverage = 0, 0.0
+            info = {"page": number, "native_chars": native_chars, "image_coverage": round(coverage, 3)}
+            needs_ocr = ocr_possible and _page_needs_ocr(native_chars, coverage)
+            info["method"] = "ocr" if needs_ocr else "native"
+            if needs_ocr:
+                ocr_pages.append(number)
+            if not needs_ocr or native_chars:
+                # Kept for OCR pages too, as the fallback if OCR fails or finds less
+                try:
+                    texts[number] = page.extract_text() or ""
+                except Exception:
+                    # Skip problematic pages
+                    texts[number] = ""
+            info["seconds"] = round(time.perf_counter() - t0, 4)
+            pages[number] = info
+
+    # OCR only the scanned pages, in parallel, streamed back in page order
+    ocr_start = time.perf_counter()
+    for number, txt, seconds in iter_ocr_pages(path, pages=ocr_pages):
+        texts[number], pages[number]["method"] = _pick_page_text(txt, texts.get(number, ""))
+        pages[number]["seconds"] = round(pages[number]["seconds"] + seconds, 4)
+    ocr_seconds = time.perf_counter() - ocr_start if ocr_pages else 0.0
+
+    text = "\n".join(texts[n] for n in sorted(texts) if texts[n].strip()).strip()
+    report = {
+        "page_count": len(pages),
+        "native_pages": sum(1 for p in pages.values() if p["method"] == "native"),
+        "ocr_pages": sum(1 for p in pages.values() if p["method"] == "ocr"),
+        "ocr_fallback_pages": sum(1 for p in pages.values() if p["method"] == "native_fallback"),
+        "ocr_seconds": round(ocr_seconds, 4),
+        "total_seconds": round(time.perf_counter() - start, 4),
+        "pages": [pages[n] for n in sorted(pages)],
+    }
+    return text, report
 
 
 def _text_from_docx(path: str) -> str:
@@ -120,15 +198,19 @@ def _text_from_txt(path: str) -> str:
         return f.read().strip()
 
 
+def extract_text_with_report(path: str, filename: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Like extract_text_any, plus the per-page extraction report for PDFs (None otherwise)."""
+    if filename.lower().endswith(".pdf"):
+        text, report = _extract_pdf_pages(path)
+        return text or "", report
+    return extract_text_any(path, filename), None
+
+
 def extract_text_any(path: str, filename: str) -> str:
-    """Extract text from PDF/DOCX/PPTX/TXT, with optional OCR for PDFs."""
+    """Extract text from PDF/DOCX/PPTX/TXT, with per-page OCR for scanned PDF pages."""
     lower = filename.lower()
     if lower.endswith(".pdf"):
-        # Try native text first
-        text = _text_from_pdf_with_pdfplumber(path)
-        if not text and OCR_ENABLED:
-            # Fallback to OCR for scanned PDFs
-            text = _ocr_pdf(path)
+        text, _report = _extract_pdf_pages(path)
         return text or ""
     elif lower.endswith(".docx"):
         return _text_from_docx(path)
@@ -180,61 +262,135 @@ def _make_metadatas(doc_id: str, filename: str, source_path: str, file_hash: str
     return metas
 
 
+def _find_near_duplicate(doc_id: str, text: str) -> Tuple[Any, Optional[Dict[str, Any]]]:
+    """MinHash the text and look it up in the LSH index. Returns (signature, match or None)."""
+    if not NEAR_DUP_ENABLED:
+        return None, None
+    sig = near_dup_index.signature(text)
+    return sig, near_dup_index.query(sig, exclude=doc_id)
+
+
+def _skip_near_duplicate(doc_id: str, filename: str, text_hash: str, file_hash: Optional[str],
+                         match: Dict[str, Any]):
+    """Point this upload's hashes at the near-duplicate it matched and record the skip."""
+    hash_index.assign(CONTENT, text_hash, match["doc_id"], filename)
+    if file_hash:
+        hash_index.assign(FILE, file_hash, match["doc_id"], filename)
+    near_dup_index.link(doc_id, match, "skip", filename)
+
+
+def _record_near_duplicate(doc_id: str, filename: str, sig: Any, match: Optional[Dict[str, Any]]):
+    """Add an indexed document's signature to the LSH index, linking it to its near-duplicate if any."""
+    if sig is None:
+        return
+    near_dup_index.add(doc_id, sig, filename)
+    if match:
+        near_dup_index.link(doc_id, match, "link", filename)
+
+
+def _near_duplicate_skipped(match: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "message": "Near-duplicate skipped (similar document already ingested)",
+        "duplicate": True,
+        "doc_id": match["doc_id"],
+        "original_filename": match["filename"],
+        "similarity": match["similarity"],
+    }
+
+
 # ----------------------------
 # Public API used by FastAPI routes
 # ----------------------------
-def save_upload(filename: str, raw: bytes) -> str:
-    """Save raw bytes to uploads directory and return saved path."""
-    uploads_dir, _ = _ensure_dirs()
-    # Normalize path separators for Windows/Unix
-    safe_name = filename.replace("/", "_").replace("\\", "_")
-    saved_path = os.path.join(uploads_dir, safe_name)
-    with open(saved_path, "wb") as out:
-        out.write(raw)
-    return saved_path
-
-def extract_text_from_pdf(raw: bytes) -> str:
-    """Extract text from PDF bytes."""
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-        tmp.write(raw)
-        tmp_path = tmp.name
-    try:
-        return extract_text_any(tmp_path, "temp.pdf")
-    finally:
-        os.unlink(tmp_path)
-
-def extract_text_from_docx(raw: bytes) -> str:
-    """Extract text from DOCX bytes."""
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix='.docx', delete=False) as tmp:
-        tmp.write(raw)
-        tmp_path = tmp.name
-    try:
-        return extract_text_any(tmp_path, "temp.docx")
-    finally:
-        os.unlink(tmp_path)
-
-def extract_text_from_pptx(raw: bytes) -> str:
-    """Extract text from PPTX bytes."""
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix='.pptx', delete=False) as tmp:
-        tmp.write(raw)
-        tmp_path = tmp.name
+async def save_upload_stream(file: UploadFile, max_bytes: int = 0, doc_id: Optional[str] = None,
+                             filename: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Stream an upload into the content-addressed blob store in UPLOAD_CHUNK_SIZE pieces,
+    computing SHA-256 and enforcing `max_bytes` as it goes, so the body is never held in memory.
+    With `doc_id`, the blob is stored and referenced by that document in one step.
+    Returns {"saved_path", "sha256", "size_bytes", "deduplicated"}; raises UploadTooLargeError.
+    An empty upload is discarded without touching the store (saved_path and sha256 are None).
+    """
+    writer = _HashingWriter(max_bytes)
     try:
-        return extract_text_any(tmp_path, "temp.pptx")
-    finally:
-        os.unlink(tmp_path)
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        if writer.size == 0:
+            writer.abort()
+            return {"saved_path": None, "sha256": None, "size_bytes": 0, "deduplicated": False}
+        return writer.commit(doc_id, filename)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def process_ingest_job(job: Dict[str, Any], progress: Callable[[str, float], None]) -> Dict[str, Any]:
+    """
+    Queued ingest pipeline: extract text (OCR for PDFs if needed) -> chunk+embed to Chroma.
+    Raises on failure so the worker marks the job failed.
+    """
+    saved_path, filename, doc_id = job["saved_path"], job["filename"], job["doc_id"]
+    file_hash = (job.get("payload") or {}).get("sha256")
+
+    progress("extracting", 0.1)
+    if file_hash:
+        with blob_store.local_path(file_hash) as path:
+            text, extraction = extract_text_with_report(path, filename)
+    else:
+        text, extraction = extract_text_with_report(saved_path, filename)
+    if not text or len(text.strip()) < 5:
+        raise ValueError("No extractable text found (file may be empty or image-only).")
+
+    # Same text under different bytes: link the file to the existing doc instead of re-embedding
+    text_hash = content_hash(text)
+    owner = hash_index.claim(CONTENT, text_hash, doc_id, filename)
+    if owner:
+        if file_hash:
+            hash_index.assign(FILE, file_hash, owner["doc_id"], filename)
+        return {
+            "message": "Duplicate content skipped (already ingested)",
+            "duplicate": True,
+            "doc_id": owner["doc_id"],
+            "filename": filename,
+            "original_filename": owner["filename"],
+            "content_hash": text_hash,
+            "extraction": extraction,
+        }
+
+    # Nearly the same text (edited header, date, one slide...): skip or link per NEAR_DUP_ACTION
+    progress("near_duplicate_check", 0.4)
+    sig, near = _find_near_duplicate(doc_id, text)
+    if near and NEAR_DUP_ACTION == "skip":
+        _skip_near_duplicate(doc_id, filename, text_hash, file_hash, near)
+        return {**_near_duplicate_skipped(near), "filename": filename, "extraction": extraction}
+
+    progress("indexing", 0.5)
+    extra = {"near_duplicate_of": near["doc_id"]} if near else None
+    idx_info = upsert_document(doc_id=doc_id, filename=filename, text=text, source_path=saved_path,
+                               extra_metadata=extra)
+    _record_near_duplicate(doc_id, filename, sig, near)
+
+    return {
+        "message": "Ingested",
+        "doc_id": doc_id,
+        "filename": filename,
+        "chunks": idx_info.get("chunks", 0),
+        "saved_path": saved_path,
+        "near_duplicate_of": near,
+        "embedding_cache": idx_info.get("embedding_cache"),
+        "extraction": extraction,
+    }
 
-def extract_text_from_txt(raw: bytes) -> str:
-    """Extract text from TXT bytes."""
-    return raw.decode('utf-8', errors='ignore').strip()
 
 def upload_only(file: UploadFile) -> Dict[str, Any]:
     """Just save the file; return path/meta (no indexing)."""
-    saved_path, filename = _save_upload(file)
+    doc_id = str(uuid.uuid4())
+    saved_path, filename, _file_hash = _save_upload(file, doc_id)
     return {
         "message": "Uploaded",
+        "doc_id": doc_id,
         "filename": filename,
         "saved_path": saved_path,
         "size_bytes": os.path.getsize(saved_path),
@@ -246,52 +402,88 @@ def ingest(file: UploadFile) -> Dict[str, Any]:
     Save upload -> extract text (OCR for PDFs if needed) -> chunk+embed to Chroma.
     Always returns a dict (never None).
     """
-    saved_path, filename = _save_upload(file)
-
-    # Duplicate protection by file hash
-    file_hash = _sha256_file(saved_path)
-    coll = get_chroma_collection()
-    try:
-        existing = coll.get(where={"file_hash": file_hash}, include=["ids", "metadatas"])
-    except Exception:
-        existing = None
-
-    if existing and existing.get("ids") and existing["ids"][0]:
-        first_meta = (existing.get("metadatas") or [[]])[0]
-        first_meta = first_meta[0] if first_meta else {}
+    doc_id = str(uuid.uuid4())
+    saved_path, filename, file_hash = _save_upload(file, doc_id)
+    result = _ingest_saved(saved_path, filename, file_hash, doc_id)
+    if result.get("doc_id") != doc_id or not result.get("chunks"):
+        # Duplicate, empty or failed: this upload's blob reference is not needed
+        blob_store.release(file_hash, doc_id)
+    return result
+
+
+def _ingest_saved(saved_path: str, filename: str, file_hash: str, doc_id: str) -> Dict[str, Any]:
+    # Duplicate protection by file hash (O(1) hash-index claim)
+    existing = hash_index.claim(FILE, file_hash, doc_id, filename)
+    if existing:
         return {
             "message": "Duplicate skipped (already ingested)",
             "filename": filename,
             "file_hash": file_hash,
-            "doc_id": (first_meta or {}).get("doc_id"),
-            "chunks": len(existing["ids"][0]),
+            "doc_id": existing["doc_id"],
+            "original_filename": existing["filename"],
             "saved_path": saved_path,
         }
 
     # New ingestion
-    text = extract_text_any(saved_path, filename)
+    with blob_store.local_path(file_hash) as path:
+        text, extraction = extract_text_with_report(path, filename)
     if not text.strip():
+        hash_index.remove_doc(doc_id)
         return {
             "message": "No text extracted (empty document or OCR failed)",
             "filename": filename,
             "doc_id": None,
             "chunks": 0,
             "saved_path": saved_path,
+            "extraction": extraction,
+        }
+
+    text_hash = content_hash(text)
+    owner = hash_index.claim(CONTENT, text_hash, doc_id, filename)
+    if owner:
+        hash_index.assign(FILE, file_hash, owner["doc_id"], filename)
+        return {
+            "message": "Duplicate content skipped (already ingested)",
+            "filename": filename,
+            "file_hash": file_hash,
+            "doc_id": owner["doc_id"],
+            "original_filename": owner["filename"],
+            "saved_path": saved_path,
+            "extraction": extraction,
+        }
+
+    sig, near = _find_near_duplicate(doc_id, text)
+    if near and NEAR_DUP_ACTION == "skip":
+        _skip_near_duplicate(doc_id, filename, text_hash, file_hash, near)
+        return {
+            **_near_duplicate_skipped(near),
+            "filename": filename,
+            "file_hash": file_hash,
+            "saved_path": saved_path,
+            "extraction": extraction,
         }
 
     pieces = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-    doc_id = str(uuid.uuid4())
     ids = _make_chunk_ids(doc_id, len(pieces))
     metadatas = _make_metadatas(doc_id, filename, saved_path, file_hash, len(pieces))
+    if near:
+        for meta in metadatas:
+            meta["near_duplicate_of"] = near["doc_id"]
 
     # Upsert into Chroma
     # Prefer upsert if available; fallback to add.
+    coll = get_chroma_collection()
     try:
+        embeddings, cache_info = embed_chunks(pieces)
         if hasattr(coll, "upsert"):
-            coll.upsert(documents=pieces, ids=ids, metadatas=metadatas)
+            coll.upsert(documents=pieces, ids=ids, metadatas=metadatas, embeddings=embeddings)
         else:
-            coll.add(documents=pieces, ids=ids, metadatas=metadatas)
+            coll.add(documents=pieces, ids=ids, metadatas=metadatas, embeddings=embeddings)
+        bm25_index.upsert_chunks(doc_id, ids, pieces)
+        _record_near_duplicate(doc_id, filename, sig, near)
     except Exception as e:
+        hash_index.remove_doc(doc_id)
+        near_dup_index.remove_doc(doc_id)
         return {
             "message": f"Indexing error: {e}",
             "filename": filename,
@@ -306,4 +498,7 @@ def ingest(file: UploadFile) -> Dict[str, Any]:
         "filename": filename,
         "chunks": len(pieces),
         "saved_path": saved_path,
+        "near_duplicate_of": near,
+        "embedding_cache": cache_info,
+        "extraction": extraction,
     }
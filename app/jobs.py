@@ -0,0 +1,317 @@
+"""
+Durable ingestion job queue backed by SQLite, with a local worker pool.
+
+`/ingest` only saves the upload and enqueues a job; worker threads claim jobs,
+run the extraction/indexing pipeline and record stage, progress and timings.
+Jobs survive restarts: anything left `running` by a dead worker is requeued
+once its lease expires.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Callable
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))    # seconds
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))     # requeue running jobs silent this long
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    status       TEXT NOT NULL,
+    stage        TEXT NOT NULL,
+    progress     REAL NOT NULL DEFAULT 0,
+    filename     TEXT,
+    saved_path   TEXT,
+    doc_id       TEXT,
+    payload      TEXT,
+    result       TEXT,
+    error        TEXT,
+    timings      TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    worker       TEXT,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+_JSON_FIELDS = ("payload", "result", "timings")
+
+
+class JobQueue:
+    """SQLite-backed FIFO of ingestion jobs, safe across threads and worker processes"""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job.get(field) else None
+        job["timings"] = job["timings"] or {}
+        return job
+
+    def enqueue(self, filename: str, saved_path: str, doc_id: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO jobs(id, status, stage, progress, filename, saved_path, doc_id, payload, timings, created_at) "
+                "VALUES (?, 'queued', 'queued', 0, ?, ?, ?, ?, '{}', ?)",
+                (job_id, filename, saved_path, doc_id, json.dumps(payload or {}), time.time()),
+            )
+        return self.get(job_id)
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest queued job to `running` and return it."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                now = time.time()
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', stage = 'starting', attempts = attempts + 1, "
+                    "worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (worker, now, now, row["id"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def update_progress(self, job_id: str, stage: str, progress: float, timings: Optional[Dict[str, float]] = None):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET stage = ?, progress = ?, timings = COALESCE(?, timings), heartbeat_at = ? WHERE id = ?",
+                (stage, progress, json.dumps(timings) if timings is not None else None, time.time(), job_id),
+            )
+
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                [(now, job_id) for job_id in job_ids],
+            )
+
+    def complete(self, job_id: str, result: Dict[str, Any], timings: Dict[str, float]):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = 'succeeded', stage = 'done', progress = 1, result = ?, timings = ?, "
+                "finished_at = ? WHERE id = ?",
+                (json.dumps(result), json.dumps(timings), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str, timings: Dict[str, float]):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, timings = ?, finished_at = ? WHERE id = ?",
+                (error[:2000], json.dumps(timings), time.time(), job_id),
+            )
+
+    def cancel_queued(self, reason: str) -> int:
+        """Fail every job not yet claimed (e.g. before an index reset); return how many."""
+        with self._lock:
+            return self._connect().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE status = 'queued'",
+                (reason, time.time()),
+            ).rowcount
+
+    def requeue_stale(self, lease_seconds: int = JOB_LEASE_SECONDS) -> int:
+        """Requeue running jobs whose worker stopped heartbeating; fail those out of attempts."""
+        cutoff = time.time() - lease_seconds
+        with self._lock:
+            conn = self._connect()
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'worker lost; attempts exhausted', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (time.time(), cutoff, JOB_MAX_ATTEMPTS),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0, worker = NULL "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (cutoff,),
+            ).rowcount
+        if requeued or failed:
+            logger.warning(f"Recovered stale jobs: requeued={requeued} failed={failed}")
+        return requeued
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def list(self, status: Optional[str] = None, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        sql = "SELECT * FROM jobs"
+        params: List[Any] = []
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+class JobProgress:
+    """Per-job stage/progress reporter handed to the pipeline"""
+
+    def __init__(self, queue: JobQueue, job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.timings: Dict[str, float] = {}
+        self._stage: Optional[str] = None
+        self._stage_start = time.perf_counter()
+
+    def __call__(self, stage: str, progress: float):
+        self._close_stage()
+        self._stage = stage
+        self.queue.update_progress(self.job_id, stage, progress, self.timings)
+
+    def _close_stage(self):
+        now = time.perf_counter()
+        if self._stage:
+            self.timings[f"{self._stage}_seconds"] = round(now - self._stage_start, 4)
+        self._stage_start = now
+
+    def finish(self) -> Dict[str, float]:
+        self._close_stage()
+        self._stage = None
+        return self.timings
+
+
+class IngestWorkerPool:
+    """Local pool of worker threads that drain the job queue"""
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict[str, Any], JobProgress], Dict[str, Any]],
+                 workers: int = INGEST_WORKERS):
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._running: Dict[str, float] = {}
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self.queue.requeue_stale()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        hb = threading.Thread(target=self._heartbeat_loop, name="ingest-heartbeat", daemon=True)
+        hb.start()
+        self._threads.append(hb)
+        logger.info(f"Started {self.workers} ingest workers ({self.worker_id})")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for t in self._threads:
+            t.join(timeout=timeout)
+        self._threads = []
+
+    def notify(self):
+        """Wake idle workers after an enqueue in this process."""
+        self._wakeup.set()
+
+    def _heartbeat_loop(self):
+        interval = max(1.0, JOB_LEASE_SECONDS / 3)
+        while not self._stop.wait(interval):
+            try:
+                with self._running_lock:
+                    running = list(self._running)
+                self.queue.heartbeat(running)
+                self.queue.requeue_stale()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.worker_id)
+            except Exception:
+                logger.exception("Job claim failed")
+                job = None
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _process(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        progress = JobProgress(self.queue, job_id)
+        with self._running_lock:
+            self._running[job_id] = time.time()
+        try:
+            result = self.handler(job, progress)
+            self.queue.complete(job_id, result, progress.finish())
+        except Exception as e:
+            logger.exception(f"Ingest job {job_id} failed")
+            self.queue.fail(job_id, str(e), progress.finish())
+        finally:
+            with self._running_lock:
+                self._running.pop(job_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._running_lock:
+            running = len(self._running)
+        return {
+            "worker_id": self.worker_id,
+            "workers": self.workers,
+            "running_here": running,
+            "jobs": self.queue.counts(),
+        }
+
+
+# Global job queue
+job_queue = JobQueue()
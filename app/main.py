@@ -1,6 +1,5 @@
 import os
 import uuid
-import traceback
 import logging
 import re
 from typing import Dict, Any
@@ -9,19 +8,25 @@ from datetime import datetime
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
 
 from .config import settings, get_cors_config, get_logging_config
 from .security import security_manager, get_security_headers, check_rate_limit
 from .monitoring import metrics_collector, security_monitor, health_checker, monitor_request
 from .utils import ALLOWED_EXTS
-from .ingestion import (
-    save_upload, extract_text_from_pdf, extract_text_from_docx,
-    extract_text_from_pptx, extract_text_from_txt
-)
-from .indexing import upsert_document
-from .search import keyword_search, vector_search, hybrid_search
+from .ingestion import save_upload_stream, process_ingest_job, UploadTooLargeError
+from .resources import resource_registry
+from .jobs import job_queue, IngestWorkerPool
+from .blobstore import blob_store
+from .hash_index import hash_index, FILE
+from .near_dup import near_dup_index
+from .embedding_cache import embedding_cache
+from .search import keyword_search, vector_search, hybrid_search_with_info, HYBRID_FUSION, REQUEST_THREADS
+from .fusion import FUSIONS
+from .bm25_index import bm25_index
+from .query_cache import query_cache
+from .query_embeddings import query_embedder
 
 # ---------- Logging Setup ----------
 logging_config = get_logging_config()
@@ -84,20 +89,90 @@ async def log_requests(request: Request, call_next):
     
     return response
 
+# ---------- Background Ingestion ----------
+def _run_ingest_job(job: Dict[str, Any], progress) -> Dict[str, Any]:
+    payload = job.get("payload") or {}
+    try:
+        result = process_ingest_job(job, progress)
+    except Exception:
+        metrics_collector.record_file_upload(job.get("filename") or "unknown", 0, False)
+        hash_index.remove_doc(job["doc_id"])
+        near_dup_index.remove_doc(job["doc_id"])
+        if payload.get("sha256"):
+            blob_store.release(payload["sha256"], job["doc_id"])
+        raise
+    if result.get("duplicate") and payload.get("sha256"):
+        # Content (exactly or nearly) matched an existing document; move the blob reference over to it
+        blob_store.add_ref(payload["sha256"], result["doc_id"], job["filename"])
+        blob_store.release(payload["sha256"], job["doc_id"])
+        return result
+    size = payload.get("size_bytes", 0)
+    metrics_collector.record_file_upload(job["filename"], size, True)
+    cache_info = result.get("embedding_cache") or {}
+    metrics_collector.record_embedding_cache(
+        cache_info.get("hits", 0), cache_info.get("misses", 0), cache_info.get("seconds_saved", 0.0)
+    )
+    logger.info(f"Successfully ingested file: {job['filename']} (doc_id: {job['doc_id']}, job: {job['id']})")
+    return result
+
+ingest_workers = IngestWorkerPool(job_queue, _run_ingest_job)
+
+# ---------- Startup ----------
+@app.on_event("startup")
+async def size_request_threads():
+    """Run sync routes on REQUEST_THREADS threads, the concurrency the hybrid leg pool is sized for."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = REQUEST_THREADS
+
+@app.on_event("startup")
+def warm_up_resources():
+    """Load the Chroma client and embedding model once, before the first request."""
+    try:
+        resource_registry.warm_up()
+    except Exception:
+        logger.exception("Resource warm-up failed; resources will load on first use")
+
+@app.on_event("startup")
+def backfill_bm25_index():
+    """Build the BM25 index from Chroma once if it is empty (e.g. an index created before BM25 existed)."""
+    from .indexing import ensure_bm25_index
+    try:
+        ensure_bm25_index()
+    except Exception:
+        logger.exception("BM25 backfill failed; keyword search will be empty until documents are re-ingested")
+
+@app.on_event("startup")
+def collect_unreferenced_blobs():
+    """Drop blobs nothing references anymore (e.g. /upload-only files past the grace period)."""
+    try:
+        blob_store.gc()
+    except Exception:
+        logger.exception("Blob GC failed")
+
+@app.on_event("startup")
+def start_ingest_workers():
+    ingest_workers.start()
+
+@app.on_event("shutdown")
+def stop_ingest_workers():
+    from .ocr import shutdown_pool
+    ingest_workers.stop()
+    query_embedder.stop()
+    shutdown_pool()
+
 # ---------- Helpers ----------
 def _ext(name: str) -> str:
     return os.path.splitext(name)[1].lower()
 
-def _extract_text_by_ext(ext: str, raw: bytes) -> str:
-    if ext == ".pdf":
-        return extract_text_from_pdf(raw)
-    if ext == ".docx":
-        return extract_text_from_docx(raw)
-    if ext == ".pptx":
-        return extract_text_from_pptx(raw)
-    if ext == ".txt":
-        return extract_text_from_txt(raw)
-    raise HTTPException(status_code=400, detail=f"Unsupported file type: {ext}")
+async def _stream_to_disk(file: UploadFile, doc_id: str = None, filename: str = None) -> Dict[str, Any]:
+    """Stream the upload into the blob store with on-the-fly hashing; map size/empty errors to HTTP errors."""
+    try:
+        saved = await save_upload_stream(file, max_bytes=settings.max_file_size, doc_id=doc_id, filename=filename)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if saved["size_bytes"] == 0:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    return saved
 
 # ---------- Authentication Routes ----------
 @app.post("/auth/login")
@@ -154,34 +229,33 @@ def root() -> Dict[str, Any]:
 
 @app.post("/upload")
 async def upload(file: UploadFile = File(...)) -> Dict[str, Any]:
+    """Store a file without ingesting it; unless it gets ingested, blob GC drops it after BLOB_GC_GRACE_SECONDS."""
     ext = _ext(file.filename)
     if ext not in ALLOWED_EXTS:
         raise HTTPException(status_code=400, detail=f"Only {sorted(ALLOWED_EXTS)} supported.")
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-    saved_path = save_upload(file.filename, raw)
-    return {"saved_path": saved_path, "size_bytes": len(raw)}
+    saved = await _stream_to_disk(file)
+    return {
+        "saved_path": saved["saved_path"],
+        "size_bytes": saved["size_bytes"],
+        "sha256": saved["sha256"],
+        "deduplicated": saved["deduplicated"]
+    }
 
-@app.post("/ingest")
+@app.post("/ingest", status_code=202)
 @monitor_request("/ingest", "POST")
 async def ingest(file: UploadFile = File(...), request: Request = None) -> Dict[str, Any]:
     """
-    Save upload -> extract text (OCR for PDFs if needed) -> chunk+embed to Chroma.
-    Always returns a dict (never None).
+    Save upload and enqueue an ingest job (extract -> OCR if needed -> chunk+embed to Chroma).
+    Returns the job id immediately; poll /jobs/{job_id} for stage, progress and result.
     """
     try:
         # Security validation
         if not file.filename:
             raise HTTPException(status_code=400, detail="No filename provided")
         
-        raw = await file.read()
-        if not raw:
-            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-        
-        # Validate file upload
+        # Validate file upload (size is enforced while streaming below)
         validation = security_manager.validate_file_upload(
-            file.filename, len(raw), file.content_type or ""
+            file.filename, 0, file.content_type or ""
         )
         
         if not validation["valid"]:
@@ -199,47 +273,101 @@ async def ingest(file: UploadFile = File(...), request: Request = None) -> Dict[
         if ext not in ALLOWED_EXTS:
             raise HTTPException(status_code=400, detail=f"Only {sorted(ALLOWED_EXTS)} supported.")
 
-        saved_path = save_upload(safe_filename, raw)
-        text = _extract_text_by_ext(ext, raw)
-
-        if not text or len(text.strip()) < 5:
-            raise HTTPException(status_code=422, detail="No extractable text found (file may be empty or image-only).")
-
+        # The blob is stored and referenced by the new doc_id in one step
         doc_id = str(uuid.uuid4())
-        idx_info = upsert_document(doc_id=doc_id, filename=safe_filename, text=text, source_path=saved_path)
+        saved = await _stream_to_disk(file, doc_id, safe_filename)
+        saved_path = saved["saved_path"]
+
+        # Same bytes already ingested (or queued): skip extraction and embedding entirely
+        existing = hash_index.claim(FILE, saved["sha256"], doc_id, safe_filename)
+        if existing:
+            blob_store.release(saved["sha256"], doc_id)
+            logger.info(f"Duplicate upload {safe_filename} matches doc_id {existing['doc_id']}")
+            return {
+                "message": "Duplicate skipped (already ingested)",
+                "duplicate": True,
+                "doc_id": existing["doc_id"],
+                "filename": safe_filename,
+                "original_filename": existing["filename"],
+                "sha256": saved["sha256"],
+                "saved_path": saved_path
+            }
+
+        try:
+            job = job_queue.enqueue(
+                safe_filename, saved_path, doc_id,
+                payload={"size_bytes": saved["size_bytes"], "sha256": saved["sha256"]}
+            )
+        except Exception:
+            hash_index.remove_doc(doc_id)
+            blob_store.release(saved["sha256"], doc_id)
+            raise
+        ingest_workers.notify()
 
-        # Record metrics
-        metrics_collector.record_file_upload(safe_filename, len(raw), True)
-        
-        logger.info(f"Successfully ingested file: {safe_filename} (doc_id: {doc_id})")
+        logger.info(f"Queued ingest job {job['id']} for file: {safe_filename} (doc_id: {doc_id})")
 
         return {
-            "message": "Ingested",
+            "message": "Queued",
+            "job_id": job["id"],
+            "status": job["status"],
             "doc_id": doc_id,
             "filename": safe_filename,
-            "chunks": idx_info.get("chunks", 0),
-            "saved_path": saved_path
+            "saved_path": saved_path,
+            "sha256": saved["sha256"],
+            "size_bytes": saved["size_bytes"],
+            "status_url": f"/jobs/{job['id']}"
         }
 
     except HTTPException:
         raise
-    except Exception as e:
-        tb = traceback.format_exc()
+    except Exception:
         logger.exception("Ingest failed")
         metrics_collector.record_file_upload(file.filename or "unknown", 0, False)
-        return {"message": "Ingest failed", "error": str(e), "trace": tb[:2000]}
+        raise HTTPException(status_code=500, detail="Ingest failed; see server logs for details")
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> Dict[str, Any]:
+    """Return stage, progress, timings and (when finished) the result of an ingest job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("payload", None)
+    return job
+
+@app.get("/jobs")
+def list_jobs(status: str = Query(None), limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)) -> Dict[str, Any]:
+    """List ingest jobs, newest first, optionally filtered by status."""
+    jobs = job_queue.list(status=status, limit=limit, offset=offset)
+    for job in jobs:
+        job.pop("payload", None)
+    return {"jobs": jobs, "counts": job_queue.counts(), "workers": ingest_workers.get_stats()}
+
+def _cached(mode: str, q: str, k: int, compute, cacheable=None):
+    """Serve repeated queries from the result cache until the index generation changes."""
+    value, _ = query_cache.get_or_compute(mode, q, k, bm25_index.generation(), compute, cacheable)
+    return value
+
+def _complete(response: Dict[str, Any]) -> bool:
+    # Partial hybrid results (a leg timed out or failed) are not cached
+    return not response.get("partial")
 
 @app.get("/search/keyword")
 def search_keyword(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
-    return {"query": q, "results": keyword_search(q, k=k)}
+    return {"query": q, "results": _cached("keyword", q, k, lambda: keyword_search(q, k=k))}
 
 @app.get("/search/vector")
 def search_vector(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
-    return {"query": q, "results": vector_search(q, k=k)}
+    return {"query": q, "results": _cached("vector", q, k, lambda: vector_search(q, k=k))}
 
 @app.get("/search/hybrid")
-def search_hybrid(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
-    return {"query": q, "results": hybrid_search(q, k=k)}
+def search_hybrid(q: str = Query(..., min_length=1), k: int = 5,
+                  fusion: str = Query(HYBRID_FUSION, description="blend or rrf")) -> Dict[str, Any]:
+    if fusion not in FUSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown fusion '{fusion}'; expected one of {sorted(FUSIONS)}")
+    def compute() -> Dict[str, Any]:
+        results, info = hybrid_search_with_info(q, k=k, fusion=fusion)
+        return {"results": results, **info}
+    return dict(_cached(f"hybrid:{fusion}", q, k, compute, _complete), query=q)
 
 @app.get("/chat")
 def chat(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
@@ -249,12 +377,16 @@ def chat(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
     - Summarize top excerpts into 2–4 concise sentences
     - Return citations for traceability
     """
-    hits = hybrid_search(q, k=k)
+    return dict(_cached("chat", q, k, lambda: _chat_answer(q, k), _complete), query=q)
+
+def _chat_answer(q: str, k: int) -> Dict[str, Any]:
+    hits, info = hybrid_search_with_info(q, k=k)
     if not hits:
         return {
             "query": q,
             "answer": "I couldn't find enough information in the ingested documents to answer that.",
-            "citations": []
+            "citations": [],
+            "partial": info["partial"]
         }
 
     # Gather candidate sentences from top excerpts
@@ -284,7 +416,7 @@ def chat(q: str = Query(..., min_length=1), k: int = 5) -> Dict[str, Any]:
         "source_path": h["source_path"]
     } for h in hits]
 
-    return {"query": q, "answer": summary, "citations": citations}
+    return {"query": q, "answer": summary, "citations": citations, "partial": info["partial"]}
 
 
 @app.get("/stats")
@@ -307,7 +439,14 @@ def stats() -> Dict[str, Any]:
 @monitor_request("/metrics", "GET")
 def get_metrics() -> Dict[str, Any]:
     """Get application metrics"""
-    return metrics_collector.get_metrics_summary()
+    summary = metrics_collector.get_metrics_summary()
+    summary["resources"] = resource_registry.get_stats()
+    summary["blob_store"] = blob_store.get_stats()
+    summary["near_duplicates"] = near_dup_index.get_stats()
+    summary["embedding_cache"]["models"] = embedding_cache.get_stats()
+    summary["query_embeddings"] = query_embedder.get_stats()
+    summary["query_cache"] = dict(query_cache.get_stats(), generation=bm25_index.generation())
+    return summary
 
 @app.get("/health")
 def health() -> Dict[str, Any]:
@@ -335,18 +474,60 @@ def admin_reset():
     import shutil
     from .utils import CHROMA_DB_DIR
     try:
+        # Queued jobs would index into the fresh store; running ones may still read their
+        # blobs, and uploads may be streaming into staging, so GC keeps its grace period.
+        cancelled = job_queue.cancel_queued("cancelled by index reset")
+        resource_registry.reset_storage()
         shutil.rmtree(CHROMA_DB_DIR, ignore_errors=True)
         os.makedirs(CHROMA_DB_DIR, exist_ok=True)
+        bm25_index.clear()
+        blob_store.clear_refs()
+        blob_store.gc()
+        hash_index.clear()
+        near_dup_index.clear()
+        query_cache.clear()
         
         # Reset metrics
         metrics_collector.reset_metrics()
         
-        logger.info("Database reset completed")
-        return {"message": "index reset", "timestamp": datetime.utcnow().isoformat()}
+        logger.info(f"Database reset completed ({cancelled} queued jobs cancelled)")
+        return {"message": "index reset", "cancelled_jobs": cancelled, "timestamp": datetime.utcnow().isoformat()}
     except Exception as e:
         logger.exception("Admin reset failed")
         raise HTTPException(status_code=500, detail=f"Reset failed: {e}")
 
+@app.get("/admin/duplicates")
+@monitor_request("/admin/duplicates", "GET")
+def admin_duplicates() -> Dict[str, Any]:
+    """List near-duplicate clusters found at ingest time (MinHash/LSH)."""
+    clusters = near_dup_index.clusters()
+    return {
+        "clusters": clusters,
+        "total_clusters": len(clusters),
+        "index": near_dup_index.get_stats(),
+    }
+
+@app.get("/admin/export")
+@monitor_request("/admin/export", "GET")
+def admin_export(include_text: bool = Query(True, description="Include chunk text (false = ids and metadata only)"),
+                 batch_size: int = Query(500, ge=1, le=5000)):
+    """Stream every chunk as NDJSON, one batch in memory at a time (see indexing.iter_docs for the order)."""
+    import json
+    from .indexing import iter_docs
+
+    include = ("documents", "metadatas") if include_text else ("metadatas",)
+    batches = iter_docs(batch_size=batch_size, include=include)
+
+    def lines():
+        for batch in batches:
+            for i, cid in enumerate(batch["ids"]):
+                record = {"id": cid, "metadata": batch["metas"][i]}
+                if include_text:
+                    record["text"] = batch["docs"][i]
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/admin/clear-logs")
 @monitor_request("/admin/clear-logs", "POST")
 def clear_logs():
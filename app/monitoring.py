@@ -21,6 +21,7 @@ class MetricsCollector:
             "errors": defaultdict(int),
             "file_uploads": defaultdict(int),
             "search_queries": defaultdict(int),
+            "embedding_cache": defaultdict(float),
             "system": {}
         }
         self.start_time = time.time()
@@ -39,6 +40,13 @@ class MetricsCollector:
         ext = os.path.splitext(filename)[1].lower()
         self.metrics["file_uploads"][f"{ext}_{'success' if success else 'failed'}"] += 1
     
+    def record_embedding_cache(self, hits: int, misses: int, seconds_saved: float):
+        """Record embedding-cache effectiveness for one ingested document"""
+        cache = self.metrics["embedding_cache"]
+        cache["hits"] += hits
+        cache["misses"] += misses
+        cache["seconds_saved"] += seconds_saved
+    
     def record_search_query(self, query_type: str, query_length: int, results_count: int):
         """Record search query metrics"""
         self.metrics["search_queries"][f"{query_type}_queries"] += 1
@@ -74,6 +82,7 @@ class MetricsCollector:
             "errors": dict(self.metrics["errors"]),
             "file_uploads": dict(self.metrics["file_uploads"]),
             "search_queries": dict(self.metrics["search_queries"]),
+            "embedding_cache": self._embedding_cache_summary(),
             "response_times": {
                 "average": avg_response_time,
                 "min": min(response_times) if response_times else 0,
@@ -83,6 +92,16 @@ class MetricsCollector:
             "system": self.get_system_metrics()
         }
     
+    def _embedding_cache_summary(self) -> Dict[str, Any]:
+        cache = self.metrics["embedding_cache"]
+        lookups = cache["hits"] + cache["misses"]
+        return {
+            "hits": int(cache["hits"]),
+            "misses": int(cache["misses"]),
+            "hit_rate": round(cache["hits"] / lookups, 4) if lookups else 0.0,
+            "seconds_saved": round(cache["seconds_saved"], 4),
+        }
+    
     def reset_metrics(self):
         """Reset all metrics"""
         self.metrics = {
@@ -91,6 +110,7 @@ class MetricsCollector:
             "errors": defaultdict(int),
             "file_uploads": defaultdict(int),
             "search_queries": defaultdict(int),
+            "embedding_cache": defaultdict(float),
             "system": {}
         }
         self.start_time = time.time()
@@ -0,0 +1,271 @@
+"""
+Near-duplicate document detection with MinHash signatures and an LSH index.
+
+Each ingested document gets a MinHash signature over its word shingles. The
+signature is split into bands and every band is stored as a bucket key in
+SQLite, so finding candidates for a new document costs one indexed lookup per
+band rather than a scan over the corpus. Candidates are confirmed by the
+estimated Jaccard similarity of the full signatures.
+"""
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+NEAR_DUP_ENABLED = os.getenv("NEAR_DUP_ENABLED", "true").lower() in ("1", "true", "yes")
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.85"))   # estimated Jaccard similarity
+NEAR_DUP_ACTION = os.getenv("NEAR_DUP_ACTION", "link").lower()          # "link" or "skip"
+NEAR_DUP_PERMUTATIONS = int(os.getenv("NEAR_DUP_PERMUTATIONS", "128"))
+NEAR_DUP_SHINGLE_WORDS = int(os.getenv("NEAR_DUP_SHINGLE_WORDS", "5"))
+NEAR_DUP_INDEX_PATH = os.getenv("NEAR_DUP_INDEX_PATH", os.path.join("data", "near_dup.sqlite3"))
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SEED = 1  # fixed so signatures stay comparable across processes and restarts
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    doc_id     TEXT PRIMARY KEY,
+    filename   TEXT,
+    sig        BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    band   INTEGER NOT NULL,
+    key    BLOB NOT NULL,
+    doc_id TEXT NOT NULL,
+    PRIMARY KEY (band, key, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_buckets_doc ON buckets(doc_id);
+CREATE TABLE IF NOT EXISTS links (
+    doc_id       TEXT PRIMARY KEY,
+    duplicate_of TEXT NOT NULL,
+    similarity   REAL NOT NULL,
+    action       TEXT NOT NULL,
+    filename     TEXT,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_links_target ON links(duplicate_of);
+"""
+
+
+def _optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Pick (bands, rows) minimizing false positive + false negative area around the threshold."""
+    def _area(fn, lo, hi, steps=200):
+        width = (hi - lo) / steps
+        return sum(fn(lo + (i + 0.5) * width) for i in range(steps)) * width
+
+    best, best_err = (1, num_perm), float("inf")
+    for b in range(1, num_perm + 1):
+        r = num_perm // b
+        if r < 1:
+            break
+        fp = _area(lambda s: 1 - (1 - s ** r) ** b, 0.0, threshold)
+        fn = _area(lambda s: 1 - (1 - (1 - s ** r) ** b), threshold, 1.0)
+        if fp + fn < best_err:
+            best, best_err = (b, r), fp + fn
+    return best
+
+
+def _shingle_hashes(text: str, k: int) -> np.ndarray:
+    words = re.findall(r"\w+", (text or "").lower())
+    if len(words) < k:
+        shingles = {" ".join(words)} if words else set()
+    else:
+        shingles = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+class NearDuplicateIndex:
+    """MinHash + banded LSH index persisted in SQLite"""
+
+    def __init__(self, path: str = NEAR_DUP_INDEX_PATH, threshold: float = NEAR_DUP_THRESHOLD,
+                 num_perm: int = NEAR_DUP_PERMUTATIONS, shingle_words: int = NEAR_DUP_SHINGLE_WORDS):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.bands, self.rows = _optimal_bands(threshold, num_perm)
+        rng = np.random.RandomState(_SEED)
+        self._a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    # ----------------------------
+    # Signatures
+    # ----------------------------
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature (uint32 per permutation) of the text's word shingles."""
+        sig = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        hashes = _shingle_hashes(text, self.shingle_words)
+        # Batches keep the (shingles x permutations) matrix small for long documents
+        for start in range(0, len(hashes), 8192):
+            hv = hashes[start:start + 8192][:, None]
+            with np.errstate(over="ignore"):
+                phv = ((hv * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+            sig = np.minimum(sig, phv.min(axis=0))
+        return sig.astype(np.uint32)
+
+    def _band_keys(self, sig: np.ndarray) -> List[bytes]:
+        return [
+            hashlib.blake2b(sig[i * self.rows:(i + 1) * self.rows].tobytes(), digest_size=8).digest()
+            for i in range(self.bands)
+        ]
+
+    @staticmethod
+    def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+        return float(np.mean(sig_a == sig_b))
+
+    # ----------------------------
+    # Index operations
+    # ----------------------------
+    def query(self, sig: np.ndarray, exclude: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Best indexed document whose estimated Jaccard similarity reaches the threshold."""
+        with self._lock:
+            conn = self._connect()
+            candidates = set()
+            for band, key in enumerate(self._band_keys(sig)):
+                for (doc_id,) in conn.execute("SELECT doc_id FROM buckets WHERE band = ? AND key = ?", (band, key)):
+                    candidates.add(doc_id)
+            candidates.discard(exclude)
+            best = None
+            for doc_id in candidates:
+                row = conn.execute("SELECT sig, filename FROM signatures WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row is None:
+                    continue
+                sim = self.similarity(sig, np.frombuffer(row[0], dtype=np.uint32))
+                if sim >= self.threshold and (best is None or sim > best["similarity"]):
+                    best = {"doc_id": doc_id, "filename": row[1], "similarity": round(sim, 4)}
+        return best
+
+    def add(self, doc_id: str, sig: np.ndarray, filename: Optional[str] = None):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO signatures(doc_id, filename, sig, created_at) VALUES (?, ?, ?, ?)",
+                    (doc_id, filename, sig.astype(np.uint32).tobytes(), time.time()),
+                )
+                conn.execute("DELETE FROM buckets WHERE doc_id = ?", (doc_id,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO buckets(band, key, doc_id) VALUES (?, ?, ?)",
+                    [(band, key, doc_id) for band, key in enumerate(self._band_keys(sig))],
+                )
+
+    def link(self, doc_id: str, match: Dict[str, Any], action: str, filename: Optional[str] = None):
+        """Record that doc_id is a near-duplicate of match['doc_id'] (kept as a link or skipped)."""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO links(doc_id, duplicate_of, similarity, action, filename, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_id, match["doc_id"], match["similarity"], action, filename, time.time()),
+                )
+
+    def remove_doc(self, doc_id: str):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM signatures WHERE doc_id = ?", (doc_id,))
+                conn.execute("DELETE FROM buckets WHERE doc_id = ?", (doc_id,))
+                conn.execute("DELETE FROM links WHERE doc_id = ? OR duplicate_of = ?", (doc_id, doc_id))
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM signatures")
+                conn.execute("DELETE FROM buckets")
+                conn.execute("DELETE FROM links")
+
+    def clusters(self) -> List[Dict[str, Any]]:
+        """Group recorded near-duplicate links into clusters rooted at the earliest document."""
+        with self._lock:
+            conn = self._connect()
+            links = conn.execute(
+                "SELECT doc_id, duplicate_of, similarity, action, filename, created_at FROM links ORDER BY created_at"
+            ).fetchall()
+            indexed = conn.execute(
+                "SELECT doc_id, filename, created_at FROM signatures "
+                "WHERE doc_id IN (SELECT duplicate_of FROM links UNION SELECT doc_id FROM links)"
+            ).fetchall()
+        names = {doc_id: filename for doc_id, filename, _ in indexed}
+        # When each document arrived: indexed ones by their signature, skipped ones by their link
+        created = {doc_id: created_at for doc_id, _, created_at in indexed}
+        for doc_id, *_, filename, created_at in links:
+            created.setdefault(doc_id, created_at)
+            names.setdefault(doc_id, filename)
+
+        parent: Dict[str, str] = {}
+
+        def _find(x: str) -> str:
+            parent.setdefault(x, x)
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def _age(x: str) -> Tuple[float, str]:
+            # A target with no record of its own predates the documents linked to it
+            return created.get(x, float("-inf")), x
+
+        for doc_id, target, *_ in links:
+            a, b = _find(doc_id), _find(target)
+            if a != b:
+                # The earlier document stays the root
+                a, b = sorted((a, b), key=_age)
+                parent[b] = a
+
+        grouped: Dict[str, Dict[str, Any]] = {}
+        for doc_id, target, sim, action, filename, created_at in links:
+            root = _find(doc_id)
+            cluster = grouped.setdefault(root, {"doc_id": root, "filename": names.get(root), "members": []})
+            cluster["members"].append({
+                "doc_id": doc_id,
+                "filename": filename,
+                "duplicate_of": target,
+                "similarity": sim,
+                "action": action,
+                "created_at": created_at,
+            })
+        return sorted(grouped.values(), key=lambda c: len(c["members"]), reverse=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connect()
+            docs = conn.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+            links = conn.execute("SELECT COUNT(*) FROM links").fetchone()[0]
+        return {
+            "documents": docs,
+            "links": links,
+            "threshold": self.threshold,
+            "bands": self.bands,
+            "rows": self.rows,
+            "action": NEAR_DUP_ACTION,
+        }
+
+
+# Global near-duplicate index
+near_dup_index = NearDuplicateIndex()
@@ -0,0 +1,170 @@
+"""
+Parallel page-level OCR for scanned PDFs.
+
+Pages are rasterized lazily, one small page range per task, inside a pool of
+worker processes, and the text comes back in page order. This module keeps its
+imports light because every pool worker imports it.
+"""
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Iterator, Tuple, Optional
+
+import pytesseract
+try:
+    from pdf2image import convert_from_path, pdfinfo_from_path  # needs poppler on the system/Docker
+    PDF2IMAGE_AVAILABLE = True
+except Exception:
+    PDF2IMAGE_AVAILABLE = False
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_PAGES_PER_TASK = int(os.getenv("OCR_PAGES_PER_TASK", "2"))
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # One tesseract thread per process; the pool provides the parallelism.
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Never fork the threaded server process; start workers from a clean interpreter.
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS), mp_context=ctx, initializer=_init_worker)
+        return _pool
+
+
+def _replace_broken_pool(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """Drop a pool left broken by a dead worker (OOM kill, tesseract crash) and start a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            logger.warning("OCR process pool is broken (a worker died); starting a new pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+    return _get_pool()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def pdf_page_count(path: str) -> int:
+    """Number of pages according to poppler (0 if unavailable)."""
+    if not PDF2IMAGE_AVAILABLE:
+        return 0
+    try:
+        return int(pdfinfo_from_path(path).get("Pages", 0))
+    except Exception:
+        return 0
+
+
+def ocr_page_range(path: str, first: int, last: int, dpi: int = OCR_DPI) -> List[Tuple[str, float]]:
+    """
+    Rasterize and OCR pages first..last (1-based, inclusive); runs in a pool worker.
+    Returns (text, seconds) per page, rasterization time split evenly across the range.
+    """
+    count = last - first + 1
+    start = time.perf_counter()
+    try:
+        images = convert_from_path(path, dpi=dpi, first_page=first, last_page=last)
+    except Exception:
+        return [("", 0.0)] * count
+    raster_share = (time.perf_counter() - start) / max(1, len(images))
+    results: List[Tuple[str, float]] = []
+    for img in images:
+        t0 = time.perf_counter()
+        try:
+            text = pytesseract.image_to_string(img) or ""
+        except Exception:
+            text = ""
+        finally:
+            img.close()
+        results.append((text, round(raster_share + time.perf_counter() - t0, 4)))
+    results.extend([("", 0.0)] * (count - len(results)))
+    return results[:count]
+
+
+def _page_ranges(pages: List[int], max_len: int) -> List[Tuple[int, int]]:
+    """Group sorted page numbers into contiguous ranges of at most max_len pages."""
+    ranges: List[Tuple[int, int]] = []
+    for p in sorted(set(pages)):
+        if ranges and p == ranges[-1][1] + 1 and p - ranges[-1][0] < max_len:
+            ranges[-1] = (ranges[-1][0], p)
+        else:
+            ranges.append((p, p))
+    return ranges
+
+
+def iter_ocr_pages(path: str, pages: Optional[List[int]] = None, dpi: int = OCR_DPI) -> Iterator[Tuple[int, str, float]]:
+    """
+    Yield (page_number, text, seconds) in page order, OCRing ranges in parallel.
+    At most ~2 tasks per worker are in flight, which bounds rasterized-page memory.
+    """
+    if not PDF2IMAGE_AVAILABLE:
+        return
+    if pages is None:
+        pages = list(range(1, pdf_page_count(path) + 1))
+    ranges = _page_ranges(pages, max(1, OCR_PAGES_PER_TASK))
+    if not ranges:
+        return
+
+    pool = _get_pool()
+    max_inflight = max(1, OCR_WORKERS) * 2
+    pending: deque = deque()
+    todo = iter(ranges)
+
+    def _submit(rng: Tuple[int, int]):
+        nonlocal pool
+        try:
+            return pool, pool.submit(ocr_page_range, path, rng[0], rng[1], dpi)
+        except BrokenProcessPool:
+            pool = _replace_broken_pool(pool)
+            return pool, pool.submit(ocr_page_range, path, rng[0], rng[1], dpi)
+
+    def _submit_next() -> bool:
+        rng = next(todo, None)
+        if rng is None:
+            return False
+        pending.append((rng, *_submit(rng), 0))
+        return True
+
+    for _ in range(max_inflight):
+        if not _submit_next():
+            break
+    while pending:
+        (first, last), owner, fut, retries = pending.popleft()
+        try:
+            results = fut.result()
+        except BrokenProcessPool as e:
+            # A dead worker fails every task in flight on its pool; retry this range once on a fresh pool
+            if retries < 1:
+                pool = _replace_broken_pool(owner)
+                pending.appendleft(((first, last), *_submit((first, last)), retries + 1))
+                continue
+            logger.warning(f"OCR failed for pages {first}-{last} of {path}: {e}")
+            results = [("", 0.0)] * (last - first + 1)
+        except Exception as e:
+            logger.warning(f"OCR failed for pages {first}-{last} of {path}: {e}")
+            results = [("", 0.0)] * (last - first + 1)
+        _submit_next()
+        for offset, (text, seconds) in enumerate(results):
+            yield first + offset, text, seconds
@@ -0,0 +1,112 @@
+"""
+In-process LRU cache of search and chat results.
+
+Entries are keyed by (mode, normalized query, k, index generation). The
+generation is a counter stored with the BM25 statistics and bumped by every
+upsert, delete and reset, so a write anywhere (in any worker) makes older
+entries unreachable without explicit invalidation; they age out through LRU
+eviction or their TTL. The cache is bounded by the approximate serialized size
+of its entries rather than their count, since a chat answer and a 50-hit
+result list differ by orders of magnitude.
+"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Tuple, Hashable, Optional
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form; every search mode already ignores both."""
+    return " ".join((query or "").lower().split())
+
+
+def _size_of(value: Any) -> int:
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class QueryCache:
+    """Byte-bounded LRU with TTL; cached values are shared and must be treated as read-only"""
+
+    def __init__(self, max_bytes: int = QUERY_CACHE_MAX_BYTES, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        self.max_bytes = max(0, max_bytes)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "oversized": 0}
+
+    def get_or_compute(self, mode: str, query: str, k: int, generation: int,
+                       compute: Callable[[], Any],
+                       cacheable: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        Return (value, hit). On a miss, `compute` runs outside the lock and its result is
+        stored, unless `cacheable(value)` is False (e.g. partial results after a timeout).
+        """
+        if not QUERY_CACHE_ENABLED or self.max_bytes == 0:
+            return compute(), False
+        key = (mode, normalize_query(query), int(k), int(generation))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[2], True
+                self._drop(key)
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self._put(key, value, now + self.ttl_seconds)
+        return value, False
+
+    def _put(self, key: Hashable, value: Any, expires: float):
+        size = _size_of(value)
+        with self._lock:
+            if size > self.max_bytes:
+                self._stats["oversized"] += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def _drop(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+            stats["ttl_seconds"] = self.ttl_seconds
+            stats["enabled"] = QUERY_CACHE_ENABLED
+        return stats
+
+
+# Global query cache
+query_cache = QueryCache()
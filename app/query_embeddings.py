@@ -0,0 +1,164 @@
+"""
+Query embedding service: an LRU of query vectors in front of a micro-batcher.
+
+Vector search used to embed every query on its own, so concurrent requests
+each paid for a batch-of-one forward pass. Here cache misses are queued, and a
+single background thread collects whatever arrives within a short window
+(QUERY_EMBED_BATCH_WINDOW_MS, up to QUERY_EMBED_MAX_BATCH texts) and embeds
+it in one call. Identical queries in flight at the same time share one slot
+in the batch.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from .resources import resource_registry
+
+logger = logging.getLogger(__name__)
+
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+QUERY_EMBED_BATCH_WINDOW_MS = float(os.getenv("QUERY_EMBED_BATCH_WINDOW_MS", "3"))
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "32"))
+QUERY_EMBED_TIMEOUT_SECONDS = float(os.getenv("QUERY_EMBED_TIMEOUT_SECONDS", "30"))
+
+
+class QueryEmbedder:
+    """Caching, micro-batching wrapper around the shared embedding model"""
+
+    def __init__(self, cache_size: int = QUERY_EMBED_CACHE_SIZE,
+                 window_ms: float = QUERY_EMBED_BATCH_WINDOW_MS, max_batch: int = QUERY_EMBED_MAX_BATCH):
+        self.cache_size = max(0, cache_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Future] = {}
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stats: Dict[str, Any] = {
+            "hits": 0, "misses": 0, "coalesced": 0,
+            "batches": 0, "batched_texts": 0, "max_batch": 0, "encode_seconds": 0.0,
+        }
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def embed(self, text: str) -> List[float]:
+        """Embedding of one query, from the cache or the next batched forward pass."""
+        key = (resource_registry.model_name, " ".join((text or "").split()))
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return vector.tolist()
+            self._stats["misses"] += 1
+            future = self._pending.get(key)
+            if future is not None:
+                self._stats["coalesced"] += 1
+            else:
+                future = Future()
+                self._pending[key] = future
+                self._queue.put(key)
+                self._ensure_thread()
+        return future.result(timeout=QUERY_EMBED_TIMEOUT_SECONDS).tolist()
+
+    def stop(self, timeout: float = 5.0):
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout=timeout)
+            self._thread = None
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["avg_batch"] = round(stats["batched_texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+            stats["encode_seconds"] = round(stats["encode_seconds"], 4)
+            stats["cached"] = len(self._cache)
+            stats["cache_size"] = self.cache_size
+        return stats
+
+    # ----------------------------
+    # Batching
+    # ----------------------------
+    def _ensure_thread(self):
+        # Caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="query-embedder", daemon=True)
+            self._thread.start()
+
+    def _collect(self, first: Tuple[str, str]) -> Tuple[List[Tuple[str, str]], bool]:
+        """Gather keys arriving within the batch window after `first`; returns (keys, stop requested)."""
+        keys = [first]
+        deadline = time.monotonic() + self.window
+        while len(keys) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                key = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if key is None:
+                return keys, True
+            keys.append(key)
+        return keys, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            keys, stop = self._collect(first)
+            self._encode(keys)
+            if stop:
+                return
+
+    def _encode(self, keys: List[Tuple[str, str]]):
+        try:
+            ef = resource_registry.get_embedding_function()
+            start = time.perf_counter()
+            vectors = np.asarray(ef([text for _, text in keys]), dtype=np.float32)
+            elapsed = time.perf_counter() - start
+            if len(vectors) != len(keys):
+                # zip() would leave the unmatched callers waiting until their timeout
+                raise ValueError(f"embedding function returned {len(vectors)} vectors for {len(keys)} texts")
+        except Exception as e:
+            logger.error(f"Query embedding batch of {len(keys)} failed: {e}")
+            with self._lock:
+                futures = [self._pending.pop(key) for key in keys]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            futures = []
+            for key, vector in zip(keys, vectors):
+                if self.cache_size:
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                futures.append((self._pending.pop(key), vector))
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._stats["batches"] += 1
+            self._stats["batched_texts"] += len(keys)
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(keys))
+            self._stats["encode_seconds"] += elapsed
+        for future, vector in futures:
+            future.set_result(vector)
+
+
+# Global query embedder
+query_embedder = QueryEmbedder()
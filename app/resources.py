@@ -0,0 +1,90 @@
+"""
+Process-wide registry for heavyweight resources (Chroma client, collections,
+embedding model) so they are created once per process and reused by every
+request instead of being rebuilt per call.
+"""
+import time
+import logging
+import threading
+from typing import Dict, Any, Callable
+
+import chromadb
+from chromadb.utils import embedding_functions
+
+from .utils import CHROMA_DB_DIR, EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry:
+    """Thread-safe lazy holder for the Chroma client, collections and embedding model"""
+
+    def __init__(self, db_dir: str = CHROMA_DB_DIR, model_name: str = EMBEDDING_MODEL):
+        self.db_dir = db_dir
+        self.model_name = model_name
+        self._lock = threading.RLock()
+        self._resources: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def _get(self, key: str, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            stats = self._stats.setdefault(key, {"loads": 0, "reuses": 0, "load_seconds": 0.0, "loaded_at": None})
+            if key in self._resources:
+                stats["reuses"] += 1
+                return self._resources[key]
+
+            start = time.perf_counter()
+            value = loader()
+            elapsed = time.perf_counter() - start
+
+            self._resources[key] = value
+            stats["loads"] += 1
+            stats["load_seconds"] = round(elapsed, 4)
+            stats["loaded_at"] = time.time()
+            logger.info(f"Loaded resource {key} in {elapsed:.2f}s")
+            return value
+
+    def get_client(self):
+        return self._get("chroma_client", lambda: chromadb.PersistentClient(path=self.db_dir))
+
+    def get_embedding_function(self):
+        return self._get(
+            "embedding_model",
+            lambda: embedding_functions.SentenceTransformerEmbeddingFunction(model_name=self.model_name),
+        )
+
+    def get_collection(self, name: str = "docs"):
+        def _load():
+            client = self.get_client()
+            ef = self.get_embedding_function()
+            return client.get_or_create_collection(name=name, embedding_function=ef)
+        return self._get(f"collection:{name}", _load)
+
+    def warm_up(self, collection: str = "docs") -> Dict[str, Any]:
+        """Load everything up front and run one embedding pass so the first request is not slow."""
+        self.get_collection(collection)
+        ef = self.get_embedding_function()
+        start = time.perf_counter()
+        ef(["warm up"])
+        with self._lock:
+            self._stats["embedding_model"]["warmup_seconds"] = round(time.perf_counter() - start, 4)
+        return self.get_stats()
+
+    def reset_storage(self):
+        """Drop client and collection handles (e.g. after the Chroma directory was wiped); keep the model."""
+        with self._lock:
+            for key in [k for k in self._resources if k == "chroma_client" or k.startswith("collection:")]:
+                self._resources.pop(key, None)
+            try:
+                from chromadb.api.client import SharedSystemClient
+                SharedSystemClient.clear_system_cache()
+            except Exception as e:
+                logger.warning(f"Could not clear Chroma system cache: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {key: dict(value) for key, value in self._stats.items()}
+
+
+# Global resource registry
+resource_registry = ResourceRegistry()
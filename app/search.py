@@ -1,26 +1,34 @@
-from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
-import numpy as np
-import re
+import os
+import time
+import heapq
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
-from .indexing import get_chroma_collection, fetch_all_docs
+from .indexing import get_chroma_collection
+from .bm25_index import bm25_index
+from .query_embeddings import query_embedder
+from .fusion import fuse, get_fusion, Ranked
 
+logger = logging.getLogger(__name__)
 
-def _tokenize(text: str) -> List[str]:
-    return re.findall(r"\w+", (text or "").lower())
+HYBRID_KEYWORD_TIMEOUT_SECONDS = float(os.getenv("HYBRID_KEYWORD_TIMEOUT_SECONDS", "2.0"))
+HYBRID_VECTOR_TIMEOUT_SECONDS = float(os.getenv("HYBRID_VECTOR_TIMEOUT_SECONDS", "2.0"))
+# Sync routes run on anyio's worker threads, so that limit is how many hybrid requests a
+# process serves at once; main.py sets it to REQUEST_THREADS (anyio's own default) at startup.
+# Two legs per request keeps legs from queueing behind each other. Leg threads do not pin
+# SQLite connections: BM25 reads borrow from a small pool (BM25_IDLE_READERS).
+REQUEST_THREADS = int(os.getenv("REQUEST_THREADS", "40"))
+HYBRID_LEG_WORKERS = int(os.getenv("HYBRID_LEG_WORKERS", str(2 * REQUEST_THREADS)))
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "blend")   # blend | rrf
+HYBRID_WEIGHTS = {
+    "keyword": float(os.getenv("HYBRID_KEYWORD_WEIGHT", "0.5")),
+    "vector": float(os.getenv("HYBRID_VECTOR_WEIGHT", "0.5")),
+}
 
-
-def _safe_norm(arr: np.ndarray) -> np.ndarray:
-    """
-    Normalize to 0..1 safely (NumPy 2.0 compatible).
-    Returns zeros if the array is constant or empty.
-    """
-    if arr.size == 0:
-        return arr.astype(float)
-    rng = float(np.ptp(arr))  # np.ptp works in NumPy 2.0+
-    if rng == 0.0:
-        return np.zeros_like(arr, dtype=float)
-    return (arr - float(arr.min())) / rng
+# Shared, bounded pool for the two legs of hybrid queries
+_leg_executor = ThreadPoolExecutor(max_workers=max(2, HYBRID_LEG_WORKERS), thread_name_prefix="hybrid-leg")
 
 
 def _excerpt(doc: str, query: str, width: int = 280) -> str:
@@ -44,25 +52,29 @@ def _excerpt(doc: str, query: str, width: int = 280) -> str:
 
 
 def keyword_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
-    data = fetch_all_docs()
-    corpus = data["docs"]
-    if not corpus:
+    hits = bm25_index.search(query, k=k)
+    if not hits:
         return []
-    tokenized_corpus = [_tokenize(d) for d in corpus]
-    bm25 = BM25Okapi(tokenized_corpus)
-    scores = bm25.get_scores(_tokenize(query))
-    top_idx = np.argsort(scores)[::-1][:k]
+
+    # Only the top-k chunks are fetched back from Chroma
+    coll = get_chroma_collection()
+    batch = coll.get(ids=[cid for cid, _ in hits], include=["documents", "metadatas"])
+    found = {
+        cid: (doc, meta)
+        for cid, doc, meta in zip(batch.get("ids", []), batch.get("documents", []), batch.get("metadatas", []))
+    }
 
     results = []
-    for i in top_idx:
-        doc = corpus[i]
-        meta = data["metas"][i]
+    for cid, score in hits:
+        if cid not in found:
+            continue
+        doc, meta = found[cid]
         results.append({
-            "id": data["ids"][i],
+            "id": cid,
             "document": doc,                         # keep full text for debugging
             "excerpt": _excerpt(doc, query),         # short snippet for UI
             "metadata": meta,
-            "score": float(scores[i]),
+            "score": float(score),
         })
     return results
 
@@ -70,7 +82,7 @@ def keyword_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
 def vector_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
     coll = get_chroma_collection()
     q = coll.query(
-        query_texts=[query],
+        query_embeddings=[query_embedder.embed(query)],
         n_results=max(k, 1),
         include=["documents", "metadatas", "distances"]
     )
@@ -89,62 +101,205 @@ def vector_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
     return results
 
 
-def hybrid_search(query: str, k: int = 5) -> List[Dict[str, Any]]:
-    # Pull extra candidates from each side, then merge + rerank
-    kw = keyword_search(query, k=k * 2)
-    vs = vector_search(query, k=k * 2)
+def _run_legs(legs: Dict[str, Tuple[Callable[[], List[Dict[str, Any]]], float]]
+              ) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, Dict[str, Any]]]:
+    """
+    Run search legs concurrently, each with its own deadline measured from when it starts
+    running, so time spent queued for a pool thread does not turn into a false timeout. A leg
+    may wait for a thread up to its timeout as well; if it has not started by then it is
+    cancelled. Returns ({leg: results}, {leg: {"status": ok|timeout|error, "seconds",
+    "queued_seconds", "hits"}}); a leg that times out or fails contributes no results. If
+    every leg fails, the first error is raised.
+    """
+    submitted = time.perf_counter()
+    started: Dict[str, float] = {}
+    events = {name: threading.Event() for name in legs}
+
+    def running(name: str, fn: Callable[[], List[Dict[str, Any]]]) -> Callable[[], List[Dict[str, Any]]]:
+        def run():
+            started[name] = time.perf_counter()
+            events[name].set()
+            return fn()
+        return run
+
+    futures = {name: (_leg_executor.submit(running(name, fn)), timeout) for name, (fn, timeout) in legs.items()}
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    info: Dict[str, Dict[str, Any]] = {}
+    errors: List[Exception] = []
+    for name, (future, timeout) in futures.items():
+        try:
+            if not events[name].wait(max(0.0, timeout - (time.perf_counter() - submitted))):
+                if future.cancel():
+                    raise FutureTimeoutError()
+                events[name].wait()   # it began running just now
+            remaining = max(0.0, timeout - (time.perf_counter() - started[name]))
+            results[name] = future.result(timeout=remaining)
+            status = "ok"
+        except FutureTimeoutError:
+            future.cancel()   # no-op if already running; the result is simply ignored
+            results[name] = []
+            status = "timeout"
+            logger.warning(f"Hybrid {name} leg missed its {timeout}s deadline")
+        except Exception as e:
+            results[name] = []
+            status = "error"
+            errors.append(e)
+            logger.error(f"Hybrid {name} leg failed: {e}")
+        now = time.perf_counter()
+        begun = started.get(name, now)
+        info[name] = {
+            "status": status,
+            "seconds": round(now - begun, 4),
+            "queued_seconds": round(begun - submitted, 4),
+            "hits": len(results[name]),
+        }
+    if errors and len(errors) == len(legs):
+        raise errors[0]
+    return results, info
+
+
+class _KeywordCursor:
+    """Keyword leg for app.fusion: BM25 scores are computed once, later rounds read further into them."""
+
+    def __init__(self, query: str):
+        self.query = query
+        self._scores: Optional[Dict[str, float]] = None
+
+    def __call__(self, depth: int) -> Ranked:
+        if self._scores is None:
+            self._scores = bm25_index.score_all(self.query)
+        return [(cid, score, None) for cid, score in heapq.nlargest(depth, self._scores.items(), key=lambda x: x[1])]
+
+
+class _VectorCursor:
+    """
+    Vector leg for app.fusion, scored by cosine similarity.
+
+    Chroma's HNSW search cannot resume where it stopped, so a deeper page is a new query, but
+    the query is embedded once and a page no deeper than the last one is served from it.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self._embedding: Optional[List[float]] = None
+        self._ranked: Ranked = []
+        self._depth = 0
+
+    def __call__(self, depth: int) -> Ranked:
+        if depth > self._depth:
+            if self._embedding is None:
+                self._embedding = query_embedder.embed(self.query)
+            q = get_chroma_collection().query(
+                query_embeddings=[self._embedding],
+                n_results=max(depth, 1),
+                include=["distances"]
+            )
+            ids, distances = (q["ids"][0], q["distances"][0]) if q and q.get("ids") else ([], [])
+            self._ranked = [(cid, _cosine(float(d)), None) for cid, d in zip(ids, distances)]
+            self._depth = depth
+        return self._ranked[:depth]
+
+
+def _cosine(distance: float) -> float:
+    # The collection uses Chroma's default squared-L2 space and the model's embeddings are unit
+    # length, so distance = 2 - 2 * cosine. Unlike 1 / (1 + distance), which squeezes every hit
+    # into a narrow band near 1, cosine keeps the spread the fusion bound needs to stop early.
+    return max(-1.0, min(1.0, 1.0 - distance / 2.0))
+
+
+def _chunk_doc_id(chunk_id: str) -> str:
+    # Chunk ids are "<doc_id>::chunk::<i>" (see indexing.upsert_document / ingestion._make_chunk_ids)
+    return chunk_id.split("::chunk::", 1)[0]
+
+
+def hybrid_search(query: str, k: int = 5, fusion: str = HYBRID_FUSION) -> List[Dict[str, Any]]:
+    return hybrid_search_with_info(query, k=k, fusion=fusion)[0]
 
-    pool: Dict[str, Dict[str, Any]] = {}
 
-    # Normalize BM25 (higher is better)
-    if kw:
-        kw_scores = np.array([r["score"] for r in kw], dtype=float)
-        kw_norm = _safe_norm(kw_scores)
-        for i, r in enumerate(kw):
-            pool[r["id"]] = {"result": r, "kw": float(kw_norm[i]), "vs": 0.0}
+def hybrid_search_with_info(query: str, k: int = 5,
+                            fusion: str = HYBRID_FUSION) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Hybrid results plus {"partial", "fusion", "rounds", "early_stop", "legs": {leg: {...}}}.
+
+    Both legs are read as cursors (depth 2k, then FUSION_GROWTH times deeper per round, fetched
+    concurrently) and fused by app.fusion until the top-k documents are settled or
+    FUSION_MAX_ROUNDS is reached ("round_capped"); "depth" per leg says how far each ranking
+    was read. partial is True when a leg timed out or failed and the fusion used only what
+    it had from that leg. Each hit carries "score_lower_bound" (exact when "score_exact"); the
+    order within the top-k follows that bound and is approximate after an early stop.
+    """
+    fuser = get_fusion(fusion, HYBRID_WEIGHTS)
+    rankers = {"keyword": _KeywordCursor(query), "vector": _VectorCursor(query)}
+    # Per-leg time budgets, spent only while the leg runs (see _run_legs)
+    budgets = {"keyword": HYBRID_KEYWORD_TIMEOUT_SECONDS, "vector": HYBRID_VECTOR_TIMEOUT_SECONDS}
+    leg_info: Dict[str, Dict[str, Any]] = {
+        name: {"status": "ok", "seconds": 0.0, "queued_seconds": 0.0} for name in rankers
+    }
+    rounds = [0]
 
-    # Normalize vector distances (lower is better → invert)
-    if vs:
-        vs_dists = np.array([r["distance"] for r in vs], dtype=float)
-        vs_norm = 1.0 - _safe_norm(vs_dists)
-        for i, r in enumerate(vs):
-            if r["id"] in pool:
-                pool[r["id"]]["vs"] = float(vs_norm[i])
+    def fetch(wanted: Dict[str, int]) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        legs = {}
+        for name, depth in wanted.items():
+            remaining = budgets[name] - leg_info[name]["seconds"]
+            if remaining <= 0:
+                leg_info[name]["status"] = "timeout"
+                out[name] = None
             else:
-                pool[r["id"]] = {"result": r, "kw": 0.0, "vs": float(vs_norm[i])}
-
-    # Blend scores
-    for v in pool.values():
-        v["blend"] = 0.5 * v["kw"] + 0.5 * v["vs"]
-
-    merged = sorted(pool.values(), key=lambda x: x["blend"], reverse=True)
-
-    # Dedupe by doc_id (keep best-scoring per document)
-    seen_docs = set()
-    unique = []
-    for m in merged:
-        r = m["result"]
-        meta = (r.get("metadata") or {})
-        doc_id = meta.get("doc_id") or meta.get("docId") or ""
-        if doc_id in seen_docs:
-            continue
-        seen_docs.add(doc_id)
-        unique.append(m)
-        if len(unique) >= k:
-            break
+                legs[name] = (lambda fn=rankers[name], d=depth: fn(d), remaining)
+        if not legs:
+            return out
+        rounds[0] += 1
+        try:
+            results, info = _run_legs(legs)
+        except Exception:
+            # Every leg failing up front is an error; a later failure keeps what was read
+            if rounds[0] == 1:
+                raise
+            results, info = {}, {name: {"status": "error", "seconds": 0.0, "queued_seconds": 0.0} for name in legs}
+        for name in legs:
+            for key in ("seconds", "queued_seconds"):
+                leg_info[name][key] = round(leg_info[name][key] + info[name][key], 4)
+            if info[name]["status"] != "ok":
+                leg_info[name]["status"] = info[name]["status"]
+                out[name] = None
+            else:
+                out[name] = results[name]
+        return out
+
+    fused, report = fuse(list(rankers), fetch, k, fuser, group=_chunk_doc_id)
+    for name, leg in report.pop("legs").items():
+        leg_info[name].update(leg)
+    info = {
+        "partial": any(leg["status"] != "ok" for leg in leg_info.values()),
+        **report,
+        "legs": leg_info,
+    }
+    if not fused:
+        return [], info
+
+    # Only the final top-k chunks are fetched back from Chroma
+    coll = get_chroma_collection()
+    batch = coll.get(ids=[f["id"] for f in fused], include=["documents", "metadatas"])
+    found = {
+        cid: (doc, meta)
+        for cid, doc, meta in zip(batch.get("ids", []), batch.get("documents", []), batch.get("metadatas", []))
+    }
 
     final: List[Dict[str, Any]] = []
-    for m in unique[:k]:
-        r = m["result"]
-        meta = r.get("metadata", {}) or {}
-        doc = r.get("document") or ""
+    for f in fused:
+        if f["id"] not in found:
+            continue
+        doc, meta = found[f["id"]]
+        meta = meta or {}
         final.append({
-            "id": r["id"],
-            "excerpt": _excerpt(doc, query),
+            "id": f["id"],
+            "excerpt": _excerpt(doc or "", query),
             "filename": meta.get("filename"),
             "doc_id": meta.get("doc_id"),
             "chunk_index": meta.get("chunk_index"),
             "source_path": meta.get("source_path"),
-            "score_blend": m["blend"],
+            "score_lower_bound": f["score_lower_bound"],
+            "score_exact": f["score_exact"],
         })
-    return final
+    return final, info
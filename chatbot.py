@@ -4,15 +4,16 @@ from typing import Dict, List, Any, Optional
 from datetime import datetime
 import json
 
-from search_engine import SearchEngine
+from search_engine import SearchEngine, get_search_engine
 
 logger = logging.getLogger(__name__)
 
 class ChatBot:
     """Chatbot for Q&A with document context"""
     
-    def __init__(self):
-        self.search_engine = SearchEngine()
+    def __init__(self, search_engine: Optional[SearchEngine] = None):
+        # Share the process-wide engine so documents indexed via the API are visible immediately
+        self.search_engine = search_engine or get_search_engine()
         self.conversation_history = []
         self.max_context_length = 4000  # Token limit for context
         
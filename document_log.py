@@ -0,0 +1,286 @@
+import os
+import json
+import zlib
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Fold the log into a new snapshot once it grows past this many bytes
+DOC_LOG_COMPACT_BYTES = int(os.getenv("DOC_LOG_COMPACT_BYTES", str(64 * 1024 * 1024)))
+
+
+class DocumentLog:
+    """Write-ahead, append-only log of document changes with periodic snapshots
+
+    Every put/delete is appended as one CRC-checked JSON line and fsynced, so an
+    ingest writes only that document's bytes. State is the last snapshot (the
+    plain {doc_id: document} JSON the engine always used) plus a replay of the
+    log. Compaction rotates the log, writes a new snapshot atomically in a
+    background thread and then drops the rotated log. Replay is idempotent, so
+    a crash at any point recovers to the last fsynced record; a torn trailing
+    record is detected by its checksum and truncated.
+
+    Several processes (e.g. server workers) may share the files. Appends and
+    rotation take a file lock and first replay records other processes wrote,
+    and only one process compacts at a time, so each snapshot holds every
+    record. refresh() applies other processes' records and reports them as
+    changes for the caller's own indexes.
+    """
+
+    def __init__(self, snapshot_file: str = "search_documents.json", log_file: Optional[str] = None,
+                 compact_bytes: int = DOC_LOG_COMPACT_BYTES):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file or os.path.splitext(snapshot_file)[0] + ".log"
+        self.rotated_file = self.log_file + ".old"
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.log_file + ".lock")              # appends, rotation, reload
+        self._compaction_lock = FileLock(self.log_file + ".compact.lock")  # one compaction at a time
+        self._log = None
+        self._log_pid: Optional[int] = None   # process that opened self._log
+        self._log_id: Optional[int] = None    # inode of the log applied so far
+        self._log_bytes = 0                   # bytes of it applied
+        self._pending: List[Tuple[str, Any, Any]] = []  # (doc_id, before, after) from other processes
+        self._compacting = False
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._documents: Dict[str, Any] = {}
+
+    # ----------------------------
+    # Records
+    # ----------------------------
+    @staticmethod
+    def _encode(record: Dict[str, Any]) -> bytes:
+        payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return b"%08x\t%s\n" % (zlib.crc32(payload), payload)
+
+    @staticmethod
+    def _decode(line: bytes) -> Optional[Dict[str, Any]]:
+        if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b"\t":
+            return None
+        payload = line[9:-1]
+        try:
+            if int(line[:8], 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload.decode("utf-8"))
+        except ValueError:
+            return None
+
+    def _apply(self, documents: Dict[str, Any], record: Dict[str, Any]):
+        if record.get("op") == "put":
+            documents[record["id"]] = record["doc"]
+        elif record.get("op") == "delete":
+            documents.pop(record["id"], None)
+
+    def _replay(self, path: str, documents: Dict[str, Any]) -> int:
+        """Apply every valid record in path; truncate at the first torn/corrupt one. Returns records applied."""
+        if not os.path.exists(path):
+            return 0
+        applied = 0
+        good_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                record = self._decode(line)
+                if record is None:
+                    break
+                self._apply(documents, record)
+                applied += 1
+                good_bytes += len(line)
+        if good_bytes < os.path.getsize(path):
+            logger.warning(f"Truncating {path} at byte {good_bytes}: incomplete or corrupt record")
+            with open(path, "r+b") as f:
+                f.truncate(good_bytes)
+        return applied
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def load(self) -> Dict[str, Any]:
+        """Recover state: snapshot, then the rotated log left by an interrupted compaction, then the live log
+
+        The returned dict is live (see documents): put/delete update it, so callers should
+        read it but write only through the log. If anything raises, the previous state is kept.
+        """
+        with self._lock, self._file_lock:
+            documents, replayed = self._read_state()
+            self._documents = documents
+            self._pending = []
+            self._open_log()
+            self._log_bytes = self._log.tell()
+        logger.info(f"Loaded {len(documents)} documents ({replayed} log records replayed)")
+        if replayed:
+            self.compact_async()
+        return documents
+
+    def _read_state(self) -> Tuple[Dict[str, Any], int]:
+        """Snapshot plus rotated and live logs (caller holds the file lock)"""
+        documents: Dict[str, Any] = {}
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r", encoding="utf-8") as f:
+                documents = json.load(f)
+        replayed = self._replay(self.rotated_file, documents) + self._replay(self.log_file, documents)
+        return documents, replayed
+
+    def _open_log(self):
+        """(Re)open the append handle on the current log, e.g. after fork or rotation elsewhere"""
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_file, "ab")
+        self._log_pid = os.getpid()
+        self._log_id = os.fstat(self._log.fileno()).st_ino
+
+    def _unchanged(self) -> bool:
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return True
+        return self._log_id is None or (st.st_ino == self._log_id and st.st_size == self._log_bytes)
+
+    def _catch_up(self):
+        """Apply records other processes appended or a rotation they made (caller holds both locks)"""
+        if self._log_id is None:
+            return
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._log_id:
+            # Rotated by another process's compaction: reload and report the difference
+            documents, _ = self._read_state()
+            for doc_id in set(self._documents) | set(documents):
+                before, after = self._documents.get(doc_id), documents.get(doc_id)
+                if before != after:
+                    self._pending.append((doc_id, before, after))
+            self._documents = documents
+            self._open_log()
+            self._log_bytes = self._log.tell()
+            return
+        if st.st_size > self._log_bytes:
+            with open(self.log_file, "rb") as f:
+                f.seek(self._log_bytes)
+                for line in f:
+                    record = self._decode(line)
+                    if record is None:
+                        break
+                    before = self._documents.get(record.get("id"))
+                    self._apply(self._documents, record)
+                    self._pending.append((record.get("id"), before, self._documents.get(record.get("id"))))
+                    self._log_bytes += len(line)
+        if self._log is None or self._log_pid != os.getpid():
+            self._open_log()   # the handle was opened before a fork
+        if os.path.getsize(self.log_file) > self._log_bytes:
+            # Bytes past the last valid record belong to a writer that died mid-record
+            os.truncate(self.log_file, self._log_bytes)
+
+    def refresh(self) -> List[Tuple[str, Any, Any]]:
+        """Apply records written by other processes; return their (doc_id, before, after) changes once"""
+        if not self._pending and self._unchanged():
+            return []
+        with self._lock:
+            with self._file_lock:
+                self._catch_up()
+            changes, self._pending = self._pending, []
+        return changes
+
+    @property
+    def documents(self) -> Dict[str, Any]:
+        """The live {doc_id: document} dict; safe for single lookups, iterate via items() or ids()"""
+        return self._documents
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Snapshot of (doc_id, document) pairs, taken under the lock writers apply records with"""
+        with self._lock:
+            return list(self._documents.items())
+
+    def ids(self) -> Set[str]:
+        with self._lock:
+            return set(self._documents)
+
+    def put(self, doc_id: str, document: Dict[str, Any]):
+        self._append({"op": "put", "id": doc_id, "doc": document})
+
+    def delete(self, doc_id: str):
+        self._append({"op": "delete", "id": doc_id})
+
+    def _append(self, record: Dict[str, Any]):
+        data = self._encode(record)
+        with self._lock:
+            with self._file_lock:
+                if self._log is None:
+                    self._open_log()
+                    self._log_bytes = self._log.tell()
+                self._catch_up()
+                self._log.write(data)
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self._log_bytes += len(data)
+            self._apply(self._documents, record)
+            due = self._log_bytes >= self.compact_bytes
+        if due:
+            self.compact_async()
+
+    def compact_async(self):
+        """Start a background compaction unless one is already running"""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        thread = threading.Thread(target=self._compact, name="document-log-compaction", daemon=True)
+        self._compaction_thread = thread
+        thread.start()
+
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """Block until a running background compaction finishes (e.g. before forking workers)"""
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _compact(self):
+        try:
+            with self._compaction_lock:
+                with self._lock, self._file_lock:
+                    # Rotate: appends continue in a fresh log while the snapshot is written
+                    self._catch_up()
+                    if self._log is not None:
+                        self._log.close()
+                    if os.path.exists(self.log_file):
+                        if os.path.exists(self.rotated_file):
+                            # Left by a compaction that died mid-way; keep record order
+                            with open(self.rotated_file, "ab") as dst, open(self.log_file, "rb") as src:
+                                dst.write(src.read())
+                                dst.flush()
+                                os.fsync(dst.fileno())
+                            os.remove(self.log_file)
+                        else:
+                            os.replace(self.log_file, self.rotated_file)
+                    self._log = None
+                    self._open_log()
+                    self._log_bytes = 0
+                    snapshot = dict(self._documents)
+
+                tmp = self.snapshot_file + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with self._file_lock:
+                    os.replace(tmp, self.snapshot_file)
+                    if os.path.exists(self.rotated_file):
+                        os.remove(self.rotated_file)
+            logger.info(f"Compacted document log into snapshot ({len(snapshot)} documents)")
+        except Exception as e:
+            logger.error(f"Document log compaction failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "log_bytes": self._log_bytes,
+                "compacting": self._compacting,
+            }
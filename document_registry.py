@@ -0,0 +1,188 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_REGISTRY_PATH = os.getenv("DOCUMENT_REGISTRY_PATH", os.path.join("data", "document_registry.sqlite3"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_hash    TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    filename     TEXT NOT NULL,
+    upload_date  TEXT NOT NULL,
+    file_size    INTEGER NOT NULL,
+    doc_type     TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'indexed'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash);
+CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON documents(upload_date);
+"""
+
+_COLUMNS = ("filename", "file_hash", "content_hash", "upload_date", "file_size", "doc_type", "status")
+
+
+class DocumentRegistry:
+    """Transactional registry of processed documents in SQLite (WAL)
+
+    The primary key on file_hash and the unique index on content_hash make
+    `reserve` an atomic duplicate check-and-insert, so concurrent uploads of
+    the same file or content cannot both be registered, even across workers.
+    """
+
+    def __init__(self, db_path: str = DOCUMENT_REGISTRY_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(self.db_path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        return {col: row[col] for col in _COLUMNS} if row is not None else None
+
+    def get(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+        return self._to_dict(row)
+
+    def find_by_content(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM documents WHERE content_hash = ?", (content_hash,)).fetchone()
+        return self._to_dict(row)
+
+    def reserve(self, doc_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Insert a document as 'processing' unless its file or content hash is taken
+
+        Returns None if this call registered it, otherwise the existing document.
+        """
+        values = dict(doc_info, status="processing")
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"INSERT INTO documents({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                        [values[col] for col in _COLUMNS],
+                    )
+                return None
+            except sqlite3.IntegrityError:
+                return self.get(doc_info["file_hash"]) or self.find_by_content(doc_info["content_hash"])
+
+    def mark_indexed(self, file_hash: str):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("UPDATE documents SET status = 'indexed' WHERE file_hash = ?", (file_hash,))
+
+    def delete(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Remove a document atomically; returns it, or None if it was not registered"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT * FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+                if row is not None:
+                    conn.execute("DELETE FROM documents WHERE file_hash = ?", (file_hash,))
+        return self._to_dict(row)
+
+    def list(self, limit: int = 50, offset: int = 0, doc_type: Optional[str] = None,
+             filename: Optional[str] = None, uploaded_after: Optional[str] = None,
+             uploaded_before: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """(total matching, page of documents newest first) for the given filters"""
+        where = ["status = 'indexed'"]
+        params: List[Any] = []
+        if doc_type:
+            where.append("doc_type = ?")
+            params.append(doc_type.lstrip(".").lower())
+        if filename:
+            where.append("filename LIKE ? ESCAPE '\\'")
+            escaped = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if uploaded_after:
+            where.append("upload_date >= ?")
+            params.append(uploaded_after)
+        if uploaded_before:
+            where.append("upload_date < ?")
+            params.append(uploaded_before)
+        clause = " WHERE " + " AND ".join(where)
+        with self._lock:
+            conn = self._connect()
+            total = conn.execute(f"SELECT COUNT(*) FROM documents{clause}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM documents{clause} ORDER BY upload_date DESC, file_hash LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def clear_stale(self, max_age_seconds: int = 600) -> int:
+        """Drop 'processing' reservations left behind by a worker that died mid-upload"""
+        cutoff = (datetime.now() - timedelta(seconds=max_age_seconds)).isoformat()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                removed = conn.execute(
+                    "DELETE FROM documents WHERE status = 'processing' AND upload_date < ?", (cutoff,)
+                ).rowcount
+        if removed:
+            logger.warning(f"Removed {removed} stale document reservations")
+        return removed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def migrate_from_json(self, json_file: str) -> int:
+        """Import a legacy processed_documents.json once; the JSON file is renamed afterwards
+
+        Safe to run from several workers at once: rows are inserted idempotently and
+        whichever worker renames the file first wins.
+        """
+        try:
+            with open(json_file, 'r') as f:
+                legacy = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.error(f"Error reading {json_file} for migration: {e}")
+            return 0
+        rows = []
+        for file_hash, info in legacy.items():
+            rows.append((
+                info.get("filename", ""),
+                info.get("file_hash", file_hash),
+                info.get("content_hash", file_hash),
+                info.get("upload_date", ""),
+                int(info.get("file_size", 0)),
+                info.get("doc_type", ""),
+                "indexed",
+            ))
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO documents({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows,
+                )
+                migrated = conn.total_changes - before
+        try:
+            os.replace(json_file, json_file + ".migrated")
+        except FileNotFoundError:
+            pass  # renamed by another worker that migrated the same rows
+        logger.info(f"Migrated {migrated} documents from {json_file} to the document registry")
+        return migrated
@@ -0,0 +1,311 @@
+import os
+import json
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from file_lock import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Compact once dead (deleted) rows outnumber live ones and there are at least this many
+COMPACT_MIN_DEAD_ROWS = 1024
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped float32 store of per-document chunk embeddings
+
+    Vectors are L2-normalized and appended as raw float32 rows to a data file.
+    Which rows belong to which doc_id is recorded in a manifest log: one JSON
+    line per add or remove, so adding a document appends its rows and one
+    record instead of rewriting the manifest. A JSON snapshot of the manifest is
+    written only by compaction, which also starts a fresh log. Loading maps the
+    data file instead of parsing it.
+
+    Several processes may share the files. Appends, removals and compaction
+    take a file lock and first replay records other processes wrote, so row
+    offsets are always taken from the shared data file; readers call refresh()
+    to pick up the same records.
+    """
+
+    def __init__(self, base_path: str = "document_embeddings"):
+        self.base_path = base_path
+        self.manifest_file = f"{base_path}.manifest.json"
+        self.log_file = f"{base_path}.manifest.log"
+        self.dim: Optional[int] = None
+        self.rows = 0                  # committed rows in the data file
+        self.generation = 0            # bumped by compaction, names the data file
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._mmap: Optional[np.memmap] = None
+        self._log_id: Optional[int] = None   # inode of the manifest log replayed so far
+        self._log_pos = 0                    # bytes of it applied
+        self._file_lock = FileLock(f"{base_path}.lock")
+        with self._file_lock:
+            self._load()
+
+    # ----------------------------
+    # Files
+    # ----------------------------
+    @property
+    def data_file(self) -> str:
+        return f"{self.base_path}.{self.generation}.f32"
+
+    def _load(self):
+        """Read the snapshot and the manifest log; drop rows no record refers to (crash leftovers)
+
+        Caller holds the file lock.
+        """
+        self.dim, self.rows, self.generation, self.docs = None, 0, 0, {}
+        self._mmap = None
+        self._log_id, self._log_pos = None, 0
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                manifest = json.load(f)
+            self.dim = manifest.get('dim')
+            self.rows = manifest.get('rows', 0)
+            self.generation = manifest.get('generation', 0)
+            self.docs = manifest.get('docs', {})
+        self._replay_log(truncate_torn=True)
+        if self.dim and os.path.exists(self.data_file):
+            expected = self.rows * self.dim * 4
+            if os.path.getsize(self.data_file) > expected:
+                with open(self.data_file, 'r+b') as f:
+                    f.truncate(expected)
+        logger.info(f"Loaded embedding store: {len(self.docs)} documents, {self.rows} rows")
+
+    def _replay_log(self, truncate_torn: bool = False):
+        """Apply manifest records past the replayed position (caller holds the file lock)"""
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, 'rb') as f:
+            self._log_id = os.fstat(f.fileno()).st_ino
+            f.seek(self._log_pos)
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    if truncate_torn:
+                        logger.warning(f"Truncating {self.log_file} at byte {self._log_pos}: incomplete record")
+                        f.close()
+                        with open(self.log_file, 'r+b') as w:
+                            w.truncate(self._log_pos)
+                    break
+                self._apply(record)
+                self._log_pos += len(line)
+
+    def _apply(self, record: Dict[str, Any]):
+        # Records from before the last compaction describe rows of an older data file
+        if record.get('generation', 0) != self.generation:
+            return
+        if record.get('op') == 'add':
+            if self.dim is None:
+                self.dim = record['dim']
+            self.docs[record['id']] = {'offset': record['offset'], 'count': record['count'],
+                                       'created_date': record.get('created_date')}
+            self.rows = max(self.rows, record['offset'] + record['count'])
+        elif record.get('op') == 'remove':
+            self.docs.pop(record['id'], None)
+
+    def _write_record(self, record: Dict[str, Any]):
+        """Append one manifest record, fsynced, and apply it (caller holds the file lock)"""
+        record['generation'] = self.generation
+        data = json.dumps(record, separators=(',', ':')).encode('utf-8') + b"\n"
+        with open(self.log_file, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self._log_id = os.fstat(f.fileno()).st_ino
+        self._log_pos += len(data)
+        self._apply(record)
+
+    def _write_snapshot(self):
+        """Write the manifest snapshot and start an empty log (caller holds the file lock)"""
+        manifest = {
+            'dim': self.dim,
+            'rows': self.rows,
+            'generation': self.generation,
+            'docs': self.docs,
+        }
+        tmp = self.manifest_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_file)
+        # A new file (new inode) tells other processes to reload rather than resume
+        tmp = self.log_file + ".tmp"
+        with open(tmp, 'wb') as f:
+            os.fsync(f.fileno())
+            self._log_id = os.fstat(f.fileno()).st_ino
+        os.replace(tmp, self.log_file)
+        self._log_pos = 0
+
+    def refresh(self) -> bool:
+        """Pick up records written by other processes; returns whether anything changed"""
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return False
+        if st.st_ino == self._log_id and st.st_size == self._log_pos:
+            return False
+        with self._file_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> bool:
+        try:
+            st = os.stat(self.log_file)
+        except FileNotFoundError:
+            return False
+        if st.st_ino == self._log_id and st.st_size == self._log_pos:
+            return False
+        if st.st_ino != self._log_id:
+            self._load()       # compacted elsewhere: offsets refer to a new data file
+        else:
+            self._replay_log()
+        return True
+
+    def _matrix_view(self) -> Optional[np.memmap]:
+        """Read-only memory map over all committed rows (remapped after appends)"""
+        if not self.dim or not self.rows:
+            return None
+        if self._mmap is None or self._mmap.shape[0] != self.rows:
+            self._mmap = np.memmap(self.data_file, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+        return self._mmap
+
+    # ----------------------------
+    # Public API
+    # ----------------------------
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.docs
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, doc_id: str, vectors: Any, created_date: Optional[str] = None):
+        """Append a document's chunk embeddings (normalized) and record them in the manifest log"""
+        with self._file_lock:
+            self._refresh_locked()
+            self._append(doc_id, vectors, created_date)
+
+    def _append(self, doc_id: str, vectors: Any, created_date: Optional[str]) -> bool:
+        """Append rows at the end of the shared data file (caller holds the file lock)"""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[0] == 0:
+            return False
+        if self.dim is not None and matrix.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {matrix.shape[1]} does not match store dim {self.dim}")
+        dim = int(matrix.shape[1])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = np.ascontiguousarray(matrix / norms)
+
+        offset = self.rows
+        with open(self.data_file, 'ab') as f:
+            if f.tell() > offset * dim * 4:
+                f.truncate(offset * dim * 4)   # rows of an append that crashed before its record
+            f.write(matrix.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_record({'op': 'add', 'id': doc_id, 'offset': offset, 'count': int(matrix.shape[0]),
+                            'dim': dim, 'created_date': created_date})
+        return True
+
+    def get(self, doc_id: str) -> Optional[np.ndarray]:
+        entry = self.docs.get(doc_id)
+        matrix = self._matrix_view()
+        if entry is None or matrix is None:
+            return None
+        return matrix[entry['offset']:entry['offset'] + entry['count']]
+
+    def remove(self, doc_id: str) -> bool:
+        """Forget a document; its rows become dead space reclaimed by compaction"""
+        with self._file_lock:
+            self._refresh_locked()
+            if doc_id not in self.docs:
+                return False
+            self._write_record({'op': 'remove', 'id': doc_id})
+            dead = self.rows - self.live_rows()
+            if dead >= COMPACT_MIN_DEAD_ROWS and dead > self.live_rows():
+                self.compact()
+        return True
+
+    def live_rows(self) -> int:
+        return sum(entry['count'] for entry in list(self.docs.values()))
+
+    def segments(self, doc_ids: Optional[set] = None) -> Tuple[Optional[np.ndarray], List[str], Optional[np.ndarray]]:
+        """Return (matrix, doc_ids, offsets) with doc i at rows [offsets[i], offsets[i+1])
+
+        When every stored row belongs to a live document the matrix is the memory map
+        itself (no copy); otherwise the live rows are gathered into a new array.
+        """
+        matrix = self._matrix_view()
+        if matrix is None:
+            return None, [], None
+        entries = sorted(
+            ((doc_id, e) for doc_id, e in list(self.docs.items()) if doc_ids is None or doc_id in doc_ids),
+            key=lambda item: item[1]['offset'],
+        )
+        if not entries:
+            return None, [], None
+        ids = [doc_id for doc_id, _ in entries]
+        offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([e['count'] for _, e in entries])
+        if offsets[-1] == self.rows:
+            return matrix, ids, offsets
+        gathered = np.concatenate([matrix[e['offset']:e['offset'] + e['count']] for _, e in entries])
+        return gathered, ids, offsets
+
+    def compact(self):
+        """Rewrite live rows into a new generation file, then switch the manifest over to it"""
+        with self._file_lock:
+            self._refresh_locked()
+            old_file = self.data_file
+            matrix = self._matrix_view()
+            new_docs: Dict[str, Dict[str, Any]] = {}
+            rows = 0
+            self.generation += 1
+            with open(self.data_file, 'wb') as f:
+                for doc_id, entry in sorted(self.docs.items(), key=lambda item: item[1]['offset']):
+                    f.write(np.ascontiguousarray(matrix[entry['offset']:entry['offset'] + entry['count']]).tobytes())
+                    new_docs[doc_id] = dict(entry, offset=rows)
+                    rows += entry['count']
+                f.flush()
+                os.fsync(f.fileno())
+            self.docs = new_docs
+            self.rows = rows
+            self._mmap = None
+            self._write_snapshot()
+            try:
+                os.remove(old_file)
+            except OSError as e:  # e.g. still mapped on Windows; harmless leftover
+                logger.warning(f"Could not remove old embedding data file {old_file}: {e}")
+        logger.info(f"Compacted embedding store to {rows} rows (generation {self.generation})")
+
+    def migrate_from_json(self, json_file: str) -> int:
+        """Import a legacy document_embeddings.json once; the JSON file is renamed afterwards"""
+        with self._file_lock:
+            # Another process may have migrated (and renamed) it already
+            if not os.path.exists(json_file):
+                return 0
+            self._refresh_locked()
+            with open(json_file, 'r') as f:
+                legacy = json.load(f)
+            migrated = 0
+            for doc_id, entry in legacy.items():
+                if doc_id not in self.docs and self._append(doc_id, entry.get('chunk_embeddings') or [], entry.get('created_date')):
+                    migrated += 1
+            os.replace(json_file, json_file + ".migrated")
+        logger.info(f"Migrated {migrated} documents from {json_file} to the binary embedding store")
+        return migrated
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'documents': len(self.docs),
+            'rows': self.rows,
+            'live_rows': self.live_rows(),
+            'dim': self.dim,
+            'data_bytes': os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0,
+        }
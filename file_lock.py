@@ -0,0 +1,59 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock; the legacy app runs as a single process there
+    fcntl = None
+
+
+class FileLock:
+    """Exclusive lock held across threads of this process and across processes
+
+    Uses flock() on a side file. The descriptor is opened lazily and reopened in
+    a forked child, because flock locks belong to the open file description and
+    a descriptor inherited across fork would be shared with the parent instead of
+    excluding it. Re-entrant within a thread, like threading.RLock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._fd = None
+        self._pid = None
+        self._depth = 0
+
+    def _descriptor(self) -> int:
+        if self._pid != os.getpid():
+            # Inherited descriptors are left alone; closing them would not drop the parent's lock anyway
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0 and fcntl is not None:
+                fcntl.flock(self._descriptor(), fcntl.LOCK_EX)
+            self._depth += 1
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0 and fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
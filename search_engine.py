@@ -1,29 +1,61 @@
 import os
-import json
 import logging
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 import hashlib
 from sentence_transformers import SentenceTransformer
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import re
+import math
+import heapq
+import threading
+from array import array
+
+from app.embedding_cache import embedding_cache
+from embedding_store import EmbeddingStore
+from document_log import DocumentLog
+from simhash import simhash64, jaccard, candidate_radius, SimHashIndex
 
 logger = logging.getLogger(__name__)
 
+SENTENCE_MODEL_NAME = 'all-MiniLM-L6-v2'
+STOP_WORDS = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should'}
+WORD_PATTERN = re.compile(r'\w+')  # the tokens _tokenize keeps: runs of word characters
+BM25_K1 = 1.5
+BM25_B = 0.75
+IMPACT_LEVELS = 255  # impacts are quantized to 1..255
+IMPACT_REQUANTIZE_DRIFT = 0.25  # recompute impacts when avg doc length drifts this far
+SAAT_BLOCK = 64  # postings taken per step in score-at-a-time search
+TOMBSTONE_PURGE_BATCH = int(os.getenv("TOMBSTONE_PURGE_BATCH", "64"))  # purge postings once this many deletes pile up
+
 class SearchEngine:
     """Search engine with keyword, vector, and hybrid search capabilities with deduplication"""
     
     def __init__(self):
-        self.documents = {}  # Store documents with hash as key
-        self.embeddings = {}  # Store document embeddings
-        self.inverted_index = {}  # Keyword search index
-        self.documents_file = "search_documents.json"
-        self.embeddings_file = "document_embeddings.json"
+        self.documents_file = "search_documents.json"  # snapshot; changes go to the document log
+        self.doc_log = DocumentLog(self.documents_file)  # owns the documents; see the documents property
+        self.content_hashes = {}  # content_hash -> doc_id, for O(1) duplicate checks
+        self.embeddings = EmbeddingStore("document_embeddings")  # mmapped chunk embeddings
+        # Search matrix: L2-normalized chunk embeddings, one row per chunk, with doc i's
+        # chunks at rows [offsets[i], offsets[i+1]). Refreshed lazily when dirty.
+        self._matrix = None
+        self._matrix_doc_ids = []
+        self._matrix_offsets = None
+        self._matrix_dirty = True
+        self.inverted_index = {}  # Keyword search index: term -> {doc_id: quantized BM25 impact}
+        self._impact_lists = {}  # term -> (impacts, doc_ids) sorted by impact desc; built lazily
+        self._doc_lengths = {}  # doc_id -> token count
+        self._total_length = 0
+        self._quantized_avgdl = None  # average doc length the stored impacts were computed with
+        self.forward_index = {}  # doc_id -> {term: array of char offsets}; drives deletes and snippets
+        self._tombstones = set()  # deleted doc_ids whose postings are not purged yet
+        self._purging = False
+        self._lock = threading.RLock()
+        self.embeddings_file = "document_embeddings.json"  # legacy format, migrated on load
         
         # Initialize sentence transformer for vector search
         try:
-            self.sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
+            self.sentence_model = SentenceTransformer(SENTENCE_MODEL_NAME)
         except Exception as e:
             logger.warning(f"Could not load sentence transformer: {e}")
             self.sentence_model = None
@@ -33,17 +65,26 @@ class SearchEngine:
         self._load_embeddings()
         self._build_inverted_index()
     
+    @property
+    def documents(self) -> Dict[str, Any]:
+        """Current documents by id, as kept by the document log (read entries; iterate doc_log.items())"""
+        return self.doc_log.documents
+    
     def index_document(self, filename: str, content: str, file_hash: str, content_hash: str) -> str:
         """Index a document with proper deduplication"""
+        doc_id = file_hash  # Use file hash as document ID
+        self.refresh()
+        
+        # Check for duplicate content hash and reserve it, atomically w.r.t. concurrent uploads
+        with self._lock:
+            existing_id = self.content_hashes.get(content_hash)
+            if existing_id is not None:
+                logger.info(f"Document with same content already indexed: {existing_id}")
+                return existing_id
+            self.content_hashes[content_hash] = doc_id
+        
         try:
-            # Check for duplicate content hash
-            for doc_id, doc in self.documents.items():
-                if doc.get('content_hash') == content_hash:
-                    logger.info(f"Document with same content already indexed: {doc['filename']}")
-                    return doc_id
-            
             # Create document entry
-            doc_id = file_hash  # Use file hash as document ID
             document = {
                 'id': doc_id,
                 'filename': filename,
@@ -55,8 +96,8 @@ class SearchEngine:
                 'chunks': self._create_chunks(content)
             }
             
-            # Store document
-            self.documents[doc_id] = document
+            # Store document (one fsynced log record; self.documents is updated by the log)
+            self.doc_log.put(doc_id, document)
             
             # Create embeddings for vector search
             if self.sentence_model:
@@ -65,20 +106,36 @@ class SearchEngine:
             # Update inverted index for keyword search
             self._update_inverted_index(doc_id, content)
             
-            # Save data
-            self._save_documents()
-            self._save_embeddings()
-            
             logger.info(f"Successfully indexed document: {filename} (ID: {doc_id})")
             return doc_id
             
         except Exception as e:
+            with self._lock:
+                if self.content_hashes.get(content_hash) == doc_id:
+                    del self.content_hashes[content_hash]
             logger.error(f"Error indexing document {filename}: {str(e)}")
             raise
     
+    def refresh(self):
+        """Apply documents and embeddings written by other processes since the last call"""
+        for doc_id, before, after in self.doc_log.refresh():
+            with self._lock:
+                if before and self.content_hashes.get(before.get('content_hash')) == doc_id:
+                    del self.content_hashes[before['content_hash']]
+                if after and after.get('content_hash'):
+                    self.content_hashes[after['content_hash']] = doc_id
+            if after is None:
+                self._tombstone(doc_id)
+            else:
+                self._update_inverted_index(doc_id, after['content'])
+            self._matrix_dirty = True
+        if self.embeddings.refresh():
+            self._matrix_dirty = True
+    
     def search(self, query: str, search_type: str = "hybrid", limit: int = 10) -> List[Dict[str, Any]]:
         """Search documents with specified method"""
         try:
+            self.refresh()
             if search_type == "keyword":
                 results = self._keyword_search(query, limit)
             elif search_type == "vector":
@@ -96,25 +153,17 @@ class SearchEngine:
     
     def _keyword_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Perform keyword-based search"""
-        query_terms = self._tokenize(query.lower())
-        doc_scores = {}
+        query_terms = list(dict.fromkeys(self._tokenize(query.lower())))
         
-        for term in query_terms:
-            if term in self.inverted_index:
-                for doc_id, tf_score in self.inverted_index[term].items():
-                    if doc_id in doc_scores:
-                        doc_scores[doc_id] += tf_score
-                    else:
-                        doc_scores[doc_id] = tf_score
-        
-        # Sort by score and get top results
-        sorted_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+        with self._lock:
+            self._maybe_requantize()
+            sorted_docs = self._score_at_a_time(query_terms, limit)
         
         results = []
         for doc_id, score in sorted_docs:
             if doc_id in self.documents:
                 doc = self.documents[doc_id]
-                snippet = self._get_snippet(doc['content'], query)
+                snippet = self._get_snippet(doc['content'], query, doc_id=doc_id)
                 
                 results.append({
                     'document_id': doc_id,
@@ -128,38 +177,155 @@ class SearchEngine:
         
         return results
     
+    def _score_at_a_time(self, query_terms: List[str], limit: int) -> List[tuple]:
+        """Top-k (doc_id, BM25 score) from impact-ordered postings, stopping once the top-k is settled
+        
+        Postings are consumed in blocks from whichever term offers the largest next contribution,
+        keeping the k best accumulators and their minimum (the threshold) up to date. Once the
+        threshold reaches the sum of the terms' next contributions, no unseen document can enter
+        the top-k; the top-k and any seen document that could still overtake it are then scored
+        exactly by posting lookups.
+        """
+        if limit <= 0:
+            return []
+        n_docs = max(1, len(self.documents))
+        cursors = []  # [weight, impacts, doc_ids, position]
+        weights = {}
+        for term in query_terms:
+            postings = self.inverted_index.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            weight = idf * (BM25_K1 + 1) / IMPACT_LEVELS
+            impacts, doc_ids = self._impact_list(term)
+            cursors.append([weight, impacts, doc_ids, 0])
+            weights[term] = weight
+        
+        accum = {}
+        top = {}  # the k best accumulators; every other document has at most `threshold`
+        threshold, floor_doc = 0.0, None
+        stopped = False
+        while True:
+            best, best_next, remaining = None, 0.0, 0.0
+            for cursor in cursors:
+                weight, impacts, _, pos = cursor
+                if pos < len(impacts):
+                    contribution = weight * impacts[pos]
+                    remaining += contribution
+                    if best is None or contribution > best_next:
+                        best, best_next = cursor, contribution
+            if best is None:
+                break
+            if len(top) >= limit and threshold >= remaining:
+                stopped = True
+                break
+            weight, impacts, doc_ids, pos = best
+            end = min(pos + SAAT_BLOCK, len(impacts))
+            for i in range(pos, end):
+                doc_id = doc_ids[i]
+                if doc_id in self._tombstones:
+                    continue
+                score = accum.get(doc_id, 0.0) + weight * impacts[i]
+                accum[doc_id] = score
+                if doc_id in top:
+                    top[doc_id] = score
+                    if doc_id != floor_doc:
+                        continue
+                elif len(top) < limit:
+                    top[doc_id] = score
+                    if len(top) < limit:
+                        continue
+                elif score > threshold:
+                    del top[floor_doc]
+                    top[doc_id] = score
+                else:
+                    continue
+                floor_doc = min(top, key=top.get)
+                threshold = top[floor_doc]
+            best[3] = end
+        
+        if not stopped:
+            # Every posting was read, so the accumulators are exact
+            return heapq.nlargest(limit, accum.items(), key=lambda x: x[1])
+        
+        # A seen document outside the top-k may still be missing contributions worth up to `remaining`
+        candidates = [doc_id for doc_id, score in accum.items() if doc_id in top or score + remaining > threshold]
+        scored = [
+            (doc_id, sum(weight * self.inverted_index[term].get(doc_id, 0) for term, weight in weights.items()))
+            for doc_id in candidates
+        ]
+        return heapq.nlargest(limit, scored, key=lambda x: x[1])
+    
+    def _impact_list(self, term: str):
+        """(impacts, doc_ids) for a term sorted by impact descending, cached until its postings change"""
+        cached = self._impact_lists.get(term)
+        if cached is None:
+            ordered = sorted(self.inverted_index[term].items(), key=lambda item: item[1], reverse=True)
+            cached = (array('B', [impact for _, impact in ordered]), [doc_id for doc_id, _ in ordered])
+            self._impact_lists[term] = cached
+        return cached
+    
+    @staticmethod
+    def _impact(tf: int, doc_length: int, avgdl: float) -> int:
+        """BM25 term-frequency component quantized to 1..IMPACT_LEVELS (IDF is applied at query time)"""
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avgdl)
+        weight = tf * (BM25_K1 + 1) / (tf + norm)
+        return max(1, min(IMPACT_LEVELS, int(round(weight / (BM25_K1 + 1) * IMPACT_LEVELS))))
+    
+    def _avgdl(self) -> float:
+        return self._total_length / len(self._doc_lengths) if self._doc_lengths else 1.0
+    
+    def _maybe_requantize(self):
+        """Recompute all impacts once the average document length has drifted (caller holds the lock)"""
+        if not self._doc_lengths or self._quantized_avgdl is None:
+            return
+        if abs(self._avgdl() / self._quantized_avgdl - 1) > IMPACT_REQUANTIZE_DRIFT:
+            self._requantize()
+    
+    def _requantize(self):
+        avgdl = max(self._avgdl(), 1.0)
+        for doc_id, term_positions in self.forward_index.items():
+            doc_length = self._doc_lengths.get(doc_id, 0)
+            for term, positions in term_positions.items():
+                self.inverted_index[term][doc_id] = self._impact(len(positions), doc_length, avgdl)
+        self._impact_lists = {}
+        self._quantized_avgdl = avgdl
+    
     def _vector_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Perform vector-based semantic search"""
         if not self.sentence_model or not self.embeddings:
             return []
         
         try:
-            # Create query embedding
-            query_embedding = self.sentence_model.encode([query])
+            matrix, doc_ids, offsets = self._get_search_matrix()
+            if matrix is None:
+                return []
             
-            doc_scores = []
-            for doc_id, doc_embeddings in self.embeddings.items():
-                if doc_id not in self.documents:
-                    continue
-                
-                # Calculate similarity with all chunks and take the best score
-                max_similarity = 0
-                best_chunk_idx = 0
-                
-                for i, chunk_embedding in enumerate(doc_embeddings['chunk_embeddings']):
-                    similarity = cosine_similarity(query_embedding, [chunk_embedding])[0][0]
-                    if similarity > max_similarity:
-                        max_similarity = similarity
-                        best_chunk_idx = i
-                
-                doc_scores.append((doc_id, max_similarity, best_chunk_idx))
+            # One matrix-vector product scores every chunk; the segmented max gives each doc its best chunk
+            query_vec = np.asarray(self.sentence_model.encode([query])[0], dtype=np.float32)
+            query_vec /= (np.linalg.norm(query_vec) or 1.0)
+            chunk_scores = matrix @ query_vec
+            doc_max = np.maximum.reduceat(chunk_scores, offsets[:-1])
+            
+            k = min(limit, len(doc_ids))
+            if k <= 0:
+                return []
+            top = np.argpartition(-doc_max, k - 1)[:k]
+            top = top[np.argsort(-doc_max[top])]
             
-            # Sort by similarity score
-            doc_scores.sort(key=lambda x: x[1], reverse=True)
+            doc_scores = []
+            for i in top:
+                start, end = offsets[i], offsets[i + 1]
+                score = max(float(doc_max[i]), 0.0)
+                chunk_idx = int(np.argmax(chunk_scores[start:end])) if score > 0 else 0
+                doc_scores.append((doc_ids[i], score, chunk_idx))
             
             results = []
-            for doc_id, score, chunk_idx in doc_scores[:limit]:
-                doc = self.documents[doc_id]
+            for doc_id, score, chunk_idx in doc_scores:
+                doc = self.documents.get(doc_id)
+                if doc is None:  # deleted since the matrix was built
+                    continue
                 chunk = doc['chunks'][chunk_idx] if chunk_idx < len(doc['chunks']) else doc['content'][:500]
                 
                 results.append({
@@ -178,6 +344,16 @@ class SearchEngine:
             logger.error(f"Error in vector search: {str(e)}")
             return []
     
+    def _get_search_matrix(self):
+        """Return (matrix, doc_ids, offsets) for vector search, rebuilding it if embeddings changed."""
+        if self._matrix_dirty:
+            live = self.doc_log.ids()
+            if all(d in live for d in list(self.embeddings.docs)):
+                live = None
+            self._matrix, self._matrix_doc_ids, self._matrix_offsets = self.embeddings.segments(live)
+            self._matrix_dirty = False
+        return self._matrix, self._matrix_doc_ids, self._matrix_offsets
+    
     def _hybrid_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
         """Combine keyword and vector search results"""
         keyword_results = self._keyword_search(query, limit * 2)
@@ -241,6 +417,7 @@ class SearchEngine:
         
         deduplicated = []
         seen_content_hashes = set()
+        kept = SimHashIndex(candidate_radius(similarity_threshold))
         
         for result in results:
             content_hash = result.get('content_hash', '')
@@ -250,58 +427,43 @@ class SearchEngine:
                 logger.info(f"Skipping duplicate result: {result['filename']}")
                 continue
             
-            # Check for similar content using snippet similarity
-            is_duplicate = False
-            for existing_result in deduplicated:
-                if self._are_snippets_similar(result.get('snippet', ''), 
-                                            existing_result.get('snippet', ''), 
-                                            similarity_threshold):
-                    logger.info(f"Skipping similar result: {result['filename']} (similar to {existing_result['filename']})")
-                    is_duplicate = True
-                    break
+            # Check for similar content: SimHash finds candidates, the snippets' token-set Jaccard decides
+            tokens = set(self._tokenize(result.get('snippet', '').lower()))
+            fingerprint = simhash64(tokens)
+            match = kept.find(
+                fingerprint, lambda item: jaccard(tokens, item[1]) >= similarity_threshold
+            ) if fingerprint else None
+            similar = match[0] if match else None
+            if similar is not None:
+                logger.info(f"Skipping similar result: {result['filename']} (similar to {similar['filename']})")
+                continue
             
-            if not is_duplicate:
-                deduplicated.append(result)
-                if content_hash:
-                    seen_content_hashes.add(content_hash)
+            deduplicated.append(result)
+            if fingerprint:
+                kept.add(fingerprint, (result, tokens))
+            if content_hash:
+                seen_content_hashes.add(content_hash)
         
         return deduplicated
     
-    def _are_snippets_similar(self, snippet1: str, snippet2: str, threshold: float) -> bool:
-        """Check if two snippets are similar using simple text comparison"""
-        if not snippet1 or not snippet2:
-            return False
-        
-        # Simple similarity check using common words
-        words1 = set(self._tokenize(snippet1.lower()))
-        words2 = set(self._tokenize(snippet2.lower()))
-        
-        if not words1 or not words2:
-            return False
-        
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
-        
-        similarity = intersection / union if union > 0 else 0
-        return similarity >= threshold
-    
     def delete_document(self, doc_id: str):
         """Delete a document from the search index"""
         try:
+            self.refresh()
             if doc_id in self.documents:
                 # Remove from documents
-                deleted_doc = self.documents.pop(doc_id)
+                deleted_doc = self.documents[doc_id]
+                self.doc_log.delete(doc_id)
+                with self._lock:
+                    if self.content_hashes.get(deleted_doc.get('content_hash')) == doc_id:
+                        del self.content_hashes[deleted_doc['content_hash']]
                 
                 # Remove from embeddings
-                if doc_id in self.embeddings:
-                    del self.embeddings[doc_id]
-                
-                # Rebuild inverted index (simple approach)
-                self._build_inverted_index()
+                if self.embeddings.remove(doc_id):
+                    self._matrix_dirty = True
                 
-                # Save changes
-                self._save_documents()
-                self._save_embeddings()
+                # Tombstone its postings; they are purged later in batches
+                self._tombstone(doc_id)
                 
                 logger.info(f"Deleted document: {deleted_doc.get('filename', doc_id)}")
                 return True
@@ -356,39 +518,97 @@ class SearchEngine:
     def _create_embeddings(self, doc_id: str, chunks: List[str]):
         """Create embeddings for document chunks"""
         try:
-            embeddings_list = self.sentence_model.encode(chunks)
-            self.embeddings[doc_id] = {
-                'chunk_embeddings': embeddings_list.tolist(),
-                'created_date': datetime.now().isoformat()
-            }
+            embeddings_list, cache_info = embedding_cache.embed(
+                SENTENCE_MODEL_NAME, chunks, self.sentence_model.encode
+            )
+            logger.info(f"Embedding cache for {doc_id}: {cache_info}")
+            self.embeddings.add(doc_id, embeddings_list, datetime.now().isoformat())
+            self._matrix_dirty = True
         except Exception as e:
             logger.error(f"Error creating embeddings for {doc_id}: {str(e)}")
     
     def _update_inverted_index(self, doc_id: str, content: str):
-        """Update inverted index with document terms"""
-        terms = self._tokenize(content.lower())
-        term_freq = {}
-        
-        # Count term frequencies
-        for term in terms:
-            if term in term_freq:
-                term_freq[term] += 1
-            else:
-                term_freq[term] = 1
-        
-        # Update inverted index
-        for term, freq in term_freq.items():
-            if term not in self.inverted_index:
-                self.inverted_index[term] = {}
+        """Update inverted index with document terms and their positions"""
+        term_positions = {}
+        for term, start in self._tokenize_with_positions(content):
+            positions = term_positions.get(term)
+            if positions is None:
+                positions = term_positions[term] = array('I')
+            positions.append(start)
+        
+        with self._lock:
+            # Re-indexing a deleted doc_id: drop its stale postings first
+            if doc_id in self._tombstones:
+                self._purge_document(doc_id)
+            
+            doc_length = sum(len(positions) for positions in term_positions.values())
+            self._total_length += doc_length - self._doc_lengths.get(doc_id, 0)
+            self._doc_lengths[doc_id] = doc_length
+            if self._quantized_avgdl is None:
+                self._quantized_avgdl = max(self._avgdl(), 1.0)
             
-            # Simple TF score (could be enhanced with TF-IDF)
-            self.inverted_index[term][doc_id] = freq
+            # Update inverted index with quantized BM25 impacts
+            for term, positions in term_positions.items():
+                if term not in self.inverted_index:
+                    self.inverted_index[term] = {}
+                self.inverted_index[term][doc_id] = self._impact(len(positions), doc_length, self._quantized_avgdl)
+                self._impact_lists.pop(term, None)
+            self.forward_index[doc_id] = term_positions
     
     def _build_inverted_index(self):
         """Rebuild the inverted index from all documents"""
-        self.inverted_index = {}
-        for doc_id, doc in self.documents.items():
-            self._update_inverted_index(doc_id, doc['content'])
+        with self._lock:
+            self.inverted_index = {}
+            self.forward_index = {}
+            self._impact_lists = {}
+            self._doc_lengths = {}
+            self._total_length = 0
+            self._quantized_avgdl = None
+            self._tombstones = set()
+            for doc_id, doc in self.doc_log.items():
+                self._update_inverted_index(doc_id, doc['content'])
+            # Early documents were quantized against a partial average; settle on the final one
+            if self._doc_lengths:
+                self._requantize()
+    
+    def _tombstone(self, doc_id: str):
+        """Hide a deleted document from keyword search in O(1); schedule a batched purge"""
+        with self._lock:
+            self._tombstones.add(doc_id)
+            start_purge = len(self._tombstones) >= TOMBSTONE_PURGE_BATCH and not self._purging
+            if start_purge:
+                self._purging = True
+        if start_purge:
+            threading.Thread(target=self._purge_tombstones, name="inverted-index-purge", daemon=True).start()
+    
+    def _purge_document(self, doc_id: str):
+        """Remove one document's postings via the forward index (caller holds the lock)"""
+        for term in self.forward_index.pop(doc_id, ()):
+            self._impact_lists.pop(term, None)
+            postings = self.inverted_index.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.inverted_index[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+        self._tombstones.discard(doc_id)
+    
+    def _purge_tombstones(self, batch_size: int = 16):
+        """Background compaction: purge tombstoned postings a few documents per lock hold"""
+        try:
+            while True:
+                with self._lock:
+                    batch = [doc_id for doc_id, _ in zip(self._tombstones, range(batch_size))]
+                    if not batch:
+                        break
+                    for doc_id in batch:
+                        self._purge_document(doc_id)
+        except Exception as e:
+            logger.error(f"Error purging deleted postings: {str(e)}")
+        finally:
+            with self._lock:
+                self._purging = False
     
     def _tokenize(self, text: str) -> List[str]:
         """Simple tokenization"""
@@ -397,28 +617,61 @@ class SearchEngine:
         tokens = cleaned.split()
         
         # Filter out very short tokens and common stop words
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should'}
-        tokens = [token for token in tokens if len(token) > 2 and token.lower() not in stop_words]
+        tokens = [token for token in tokens if len(token) > 2 and token.lower() not in STOP_WORDS]
         
         return tokens
     
-    def _get_snippet(self, content: str, query: str, snippet_length: int = 300) -> str:
-        """Extract relevant snippet from content based on query"""
-        query_terms = self._tokenize(query.lower())
-        content_lower = content.lower()
-        
-        # Find the best position for snippet
+    def _tokenize_with_positions(self, text: str):
+        """Yield (token, char offset into text) for the tokens _tokenize produces from text.lower()"""
+        lowered = text.lower()
+        offsets = None
+        if len(lowered) != len(text):
+            # Lowercasing changed the length (e.g. 'İ' -> 'i̇'), so map offsets back to the original text
+            offsets = [i for i, ch in enumerate(text) for _ in ch.lower()]
+        for match in WORD_PATTERN.finditer(lowered):
+            token = match.group()
+            if len(token) > 2 and token not in STOP_WORDS:
+                yield token, match.start() if offsets is None else offsets[match.start()]
+    
+    def _get_snippet(self, content: str, query: str, snippet_length: int = 300, doc_id: Optional[str] = None) -> str:
+        """Extract relevant snippet from content based on query
+        
+        Sweeps a window over the sorted positions of the query terms (from the forward
+        index when doc_id is given) and picks the one covering the most distinct terms,
+        so the cost follows the number of matches rather than the document length.
+        """
+        query_terms = set(self._tokenize(query.lower()))
+        term_positions = self.forward_index.get(doc_id) if doc_id is not None else None
+        if term_positions is None:
+            term_positions = {}
+            for term, start in self._tokenize_with_positions(content):
+                if term in query_terms:
+                    term_positions.setdefault(term, []).append(start)
+        
+        hits = sorted(
+            (pos, term) for term in query_terms for pos in term_positions.get(term, ())
+        )
+        
+        # Densest window: most distinct terms, then most occurrences
         best_position = 0
-        max_matches = 0
-        
-        # Check different positions
-        for i in range(0, len(content) - snippet_length, 100):
-            snippet_text = content[i:i + snippet_length].lower()
-            matches = sum(1 for term in query_terms if term in snippet_text)
-            
-            if matches > max_matches:
-                max_matches = matches
-                best_position = i
+        best_key = (0, 0)
+        counts = {}
+        left = 0
+        for right, (pos, term) in enumerate(hits):
+            counts[term] = counts.get(term, 0) + 1
+            while left < right and pos - hits[left][0] > snippet_length - len(term):
+                left_term = hits[left][1]
+                counts[left_term] -= 1
+                if not counts[left_term]:
+                    del counts[left_term]
+                left += 1
+            key = (len(counts), right - left + 1)
+            if key > best_key:
+                best_key = key
+                # Center the matched span in the window
+                span_end = pos + len(term)
+                lead = (snippet_length - (span_end - hits[left][0])) // 2
+                best_position = max(0, min(hits[left][0] - lead, len(content) - snippet_length))
         
         # Extract snippet and clean it up
         snippet = content[best_position:best_position + snippet_length]
@@ -435,47 +688,65 @@ class SearchEngine:
         
         return snippet.strip()
     
-    def _save_documents(self):
-        """Save documents to file"""
-        try:
-            with open(self.documents_file, 'w', encoding='utf-8') as f:
-                json.dump(self.documents, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            logger.error(f"Error saving documents: {str(e)}")
-    
     def _load_documents(self):
-        """Load documents from file"""
+        """Recover documents from the last snapshot plus the document log, and rebuild the content-hash map
+
+        A store that cannot be read stops the engine from starting: carrying on with an
+        empty view would let the next compaction overwrite the snapshot with it.
+        """
         try:
-            if os.path.exists(self.documents_file):
-                with open(self.documents_file, 'r', encoding='utf-8') as f:
-                    self.documents = json.load(f)
-                logger.info(f"Loaded {len(self.documents)} documents from storage")
+            self.doc_log.load()
         except Exception as e:
             logger.error(f"Error loading documents: {str(e)}")
-    
-    def _save_embeddings(self):
-        """Save embeddings to file"""
-        try:
-            with open(self.embeddings_file, 'w') as f:
-                json.dump(self.embeddings, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving embeddings: {str(e)}")
+            raise
+        self.content_hashes = {
+            doc['content_hash']: doc_id
+            for doc_id, doc in self.doc_log.items() if doc.get('content_hash')
+        }
     
     def _load_embeddings(self):
-        """Load embeddings from file"""
+        """Open the binary embedding store, migrating a legacy JSON file on first run"""
         try:
-            if os.path.exists(self.embeddings_file):
-                with open(self.embeddings_file, 'r') as f:
-                    self.embeddings = json.load(f)
-                logger.info(f"Loaded embeddings for {len(self.embeddings)} documents")
+            self.embeddings.migrate_from_json(self.embeddings_file)
+            self._matrix_dirty = True
+            logger.info(f"Loaded embeddings for {len(self.embeddings)} documents")
         except Exception as e:
             logger.error(f"Error loading embeddings: {str(e)}")
     
     def get_stats(self) -> Dict[str, Any]:
         """Get search engine statistics"""
+        self.refresh()
         return {
             'total_documents': len(self.documents),
             'total_terms': len(self.inverted_index),
+            'pending_tombstones': len(self._tombstones),
             'has_vector_search': self.sentence_model is not None,
             'total_embeddings': len(self.embeddings)
-        }
\ No newline at end of file
+        }
+
+
+# One engine per process, shared by the API routes and ChatBot
+_engine: Optional[SearchEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_search_engine() -> SearchEngine:
+    """Return the process-wide SearchEngine, loading it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SearchEngine()
+        return _engine
+
+
+def preload_search_engine() -> SearchEngine:
+    """Load the shared engine at import time, before a forking server starts its workers
+
+    Waits for background compaction so no lock is held across fork. Each worker
+    still has its own in-memory indexes: file handles and locks are reopened
+    lazily in the worker, and documents written by any worker reach the others
+    through the document log and embedding store (see SearchEngine.refresh).
+    """
+    engine = get_search_engine()
+    engine.doc_log.wait_for_compaction()
+    return engine
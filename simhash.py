@@ -0,0 +1,92 @@
+import math
+import hashlib
+from typing import Iterable, Dict, List, Any, Optional, Callable
+
+import numpy as np
+
+FINGERPRINT_BITS = 64
+
+
+def simhash64(tokens: Iterable[str]) -> int:
+    """64-bit SimHash of a token set (unweighted, so it tracks set overlap like Jaccard)"""
+    features = set(tokens)
+    if not features:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), 'little') for t in features),
+        dtype=np.uint64,
+        count=len(features),
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    majority = (bits.sum(axis=0) * 2 > len(features)).astype(np.uint8)
+    return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def candidate_radius(threshold: float, miss_rate: float = 0.001) -> int:
+    """Hamming radius within which pairs at the Jaccard threshold fall with probability 1 - miss_rate
+
+    For two equal-size sets, Jaccard J corresponds to cosine 2J/(1+J), and each SimHash
+    bit disagrees with probability p = arccos(cosine) / pi, so the distance is
+    Binomial(64, p). Its mean alone misses about half of the pairs at the threshold
+    (more for short texts, whose fingerprints are noisier), so the radius is the
+    (1 - miss_rate) quantile instead. Pairs within it are only candidates: confirm
+    them with the exact Jaccard.
+    """
+    threshold = min(max(threshold, 0.0), 1.0)
+    cosine = 2 * threshold / (1 + threshold) if threshold > 0 else 0.0
+    p = math.acos(min(cosine, 1.0)) / math.pi
+    cdf = 0.0
+    for radius in range(FINGERPRINT_BITS + 1):
+        cdf += math.comb(FINGERPRINT_BITS, radius) * p ** radius * (1 - p) ** (FINGERPRINT_BITS - radius)
+        if cdf >= 1 - miss_rate:
+            return radius
+    return FINGERPRINT_BITS
+
+
+class SimHashIndex:
+    """Banded lookup of fingerprints within a Hamming radius
+
+    The 64 bits are split into radius + 1 bands; by pigeonhole, two fingerprints
+    within the radius agree exactly on at least one band, so only fingerprints
+    sharing a band value are compared.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max(0, max_distance)
+        bands = min(FINGERPRINT_BITS, self.max_distance + 1)
+        edges = [round(i * FINGERPRINT_BITS / bands) for i in range(bands + 1)]
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        self._buckets: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        self._fingerprints: List[int] = []
+        self._items: List[Any] = []
+
+    def find(self, fingerprint: int, accept: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """Return an indexed item within the radius (that `accept` confirms, if given), or None"""
+        seen = set()
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            for idx in buckets.get((fingerprint >> shift) & mask, ()):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                if hamming(fingerprint, self._fingerprints[idx]) > self.max_distance:
+                    continue
+                if accept is None or accept(self._items[idx]):
+                    return self._items[idx]
+        return None
+
+    def add(self, fingerprint: int, item: Any):
+        idx = len(self._fingerprints)
+        self._fingerprints.append(fingerprint)
+        self._items.append(item)
+        for (shift, mask), buckets in zip(self._bands, self._buckets):
+            buckets.setdefault((fingerprint >> shift) & mask, []).append(idx)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the repo root importable (app/, search_engine.py, ...) however pytest is invoked
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,80 @@
+"""
+Tests for the content-addressed blob store (app/blobstore.py)
+"""
+import os
+import threading
+
+import pytest
+
+from app.blobstore import BlobStore
+
+
+def _stage(store, data: bytes) -> str:
+    path = store.staging_path()
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(root=str(tmp_path / "blobs"))
+
+
+class TestBlobStore:
+    """Reference counting, atomic put+ref and garbage collection"""
+
+    def test_identical_content_is_stored_once(self, store):
+        info, created = store.put_file(_stage(store, b"abc"), "a" * 64, 3, "doc1", "one.txt")
+        again, created_again = store.put_file(_stage(store, b"abc"), "a" * 64, 3, "doc2", "two.txt")
+        assert created and not created_again
+        assert info["path"] == again["path"]
+        assert [r["doc_id"] for r in store.refs("a" * 64)] == ["doc1", "doc2"]
+        assert os.listdir(os.path.join(store.root, "tmp")) == []
+
+    def test_release_deletes_blob_with_last_reference(self, store):
+        info, _ = store.put_file(_stage(store, b"abc"), "b" * 64, 3, "doc1")
+        store.add_ref("b" * 64, "doc2")
+        assert store.release("b" * 64, "doc1") == 1
+        assert os.path.exists(info["path"])
+        assert store.release("b" * 64, "doc2") == 0
+        assert not os.path.exists(info["path"])
+        assert store.get("b" * 64) is None
+
+    def test_put_with_ref_survives_concurrent_release(self, store):
+        """A release of the last old reference must never delete a blob a new upload is taking"""
+        sha = "c" * 64
+        failures = []
+
+        def cycle(i):
+            doc = f"doc{i}"
+            try:
+                info, _ = store.put_file(_stage(store, b"same bytes"), sha, 10, doc)
+                if not os.path.exists(info["path"]):
+                    failures.append(doc)
+            finally:
+                store.release(sha, doc)
+
+        for _ in range(20):
+            threads = [threading.Thread(target=cycle, args=(i,)) for i in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        assert failures == []
+        assert store.get(sha) is None
+
+    def test_gc_removes_only_unreferenced_blobs_past_grace(self, store):
+        kept, _ = store.put_file(_stage(store, b"kept"), "d" * 64, 4, "doc1")
+        orphan, _ = store.put_file(_stage(store, b"orphan"), "e" * 64, 6)   # /upload-style, no ref
+        assert store.gc(grace_seconds=3600)["blobs"] == 0
+        result = store.gc(grace_seconds=0)
+        assert result["blobs"] == 1
+        assert os.path.exists(kept["path"]) and not os.path.exists(orphan["path"])
+
+    def test_clear_refs_then_gc_empties_the_store(self, store):
+        info, _ = store.put_file(_stage(store, b"x"), "f" * 64, 1, "doc1")
+        store.clear_refs()
+        store.gc(grace_seconds=0)
+        assert not os.path.exists(info["path"])
+        assert store.get_stats()["blobs"] == 0
@@ -0,0 +1,173 @@
+"""
+Tests for the persistent BM25 index (app/bm25_index.py)
+"""
+import math
+import threading
+from collections import Counter
+
+import pytest
+
+from app import bm25_index
+from app.bm25_index import BM25Index, tokenize
+
+
+def brute_force_bm25(chunks, query, k1=1.5, b=0.75):
+    """Reference Okapi BM25 over {chunk_id: text} with the index's log1p IDF"""
+    docs = {cid: tokenize(text) for cid, text in chunks.items()}
+    n = len(docs)
+    avgdl = sum(len(t) for t in docs.values()) / n
+    scores = {}
+    for term, qtf in Counter(tokenize(query)).items():
+        containing = [cid for cid, toks in docs.items() if term in toks]
+        if not containing:
+            continue
+        idf = math.log(1.0 + (n - len(containing) + 0.5) / (len(containing) + 0.5))
+        for cid in containing:
+            tf = docs[cid].count(term)
+            denom = tf + k1 * (1.0 - b + b * len(docs[cid]) / avgdl)
+            scores[cid] = scores.get(cid, 0.0) + qtf * idf * tf * (k1 + 1.0) / denom
+    return scores
+
+
+CORPUS = {
+    "a::chunk::0": "the annual events calendar lists every convention",
+    "a::chunk::1": "convention center parking and convention shuttle times",
+    "b::chunk::0": "parking rates for the stadium and the arena",
+    "c::chunk::0": "catering menu for events at the convention center",
+    "c::chunk::1": "security policy for all staff and contractors",
+}
+
+
+class TestBM25Index:
+    """BM25 scoring and incremental maintenance"""
+
+    def setup_method(self):
+        self.index = None
+
+    def teardown_method(self):
+        if self.index is not None:
+            self.index.close()
+
+    def _build(self, tmp_path, corpus=CORPUS):
+        self.index = BM25Index(path=str(tmp_path / "bm25.sqlite3"))
+        by_doc = {}
+        for cid, text in corpus.items():
+            by_doc.setdefault(cid.split("::")[0], ([], []))
+            by_doc[cid.split("::")[0]][0].append(cid)
+            by_doc[cid.split("::")[0]][1].append(text)
+        for doc_id, (ids, texts) in by_doc.items():
+            self.index.upsert_chunks(doc_id, ids, texts)
+        return self.index
+
+    @pytest.mark.parametrize("query", ["convention", "parking convention", "events center", "security staff"])
+    def test_scores_match_brute_force(self, tmp_path, query):
+        index = self._build(tmp_path)
+        expected = brute_force_bm25(CORPUS, query)
+        hits = index.search(query, k=len(CORPUS))
+        assert {cid for cid, _ in hits} == set(expected)
+        for cid, score in hits:
+            assert score == pytest.approx(expected[cid])
+        assert [s for _, s in hits] == sorted((s for _, s in hits), reverse=True)
+
+    def test_upsert_replaces_and_remove_updates_stats(self, tmp_path):
+        index = self._build(tmp_path)
+        index.upsert_chunks("a", ["a::chunk::0"], ["parking only"])
+        corpus = {cid: t for cid, t in CORPUS.items() if not cid.startswith("a::")}
+        corpus["a::chunk::0"] = "parking only"
+        assert index.count() == len(corpus)
+        expected = brute_force_bm25(corpus, "parking")
+        assert dict(index.search("parking", k=10)) == pytest.approx(expected)
+
+        assert index.remove_document("a") == 1
+        assert "a::chunk::0" not in dict(index.search("parking", k=10))
+        assert index.count() == len(corpus) - 1
+
+    def test_generation_bumps_on_every_write(self, tmp_path):
+        index = self._build(tmp_path)
+        g0 = index.generation()
+        index.upsert_chunks("d", ["d::chunk::0"], ["new text"])
+        g1 = index.generation()
+        index.remove_document("d")
+        g2 = index.generation()
+        index.clear()
+        g3 = index.generation()
+        assert g0 < g1 < g2 < g3
+        assert index.count() == 0
+
+    def test_generation_does_not_wait_for_the_index_lock(self, tmp_path):
+        index = self._build(tmp_path)
+        before = index.generation()
+        result = []
+        with index._lock:   # e.g. a long search in another thread
+            reader = threading.Thread(target=lambda: result.append(index.generation()))
+            reader.start()
+            reader.join(5)
+            assert result == [before]
+        index.upsert_chunks("d", ["d::chunk::0"], ["new text"])
+        assert index.generation() > before
+
+    def test_chunk_ids_after_is_a_keyset_scan(self, tmp_path):
+        index = self._build(tmp_path)
+        seen, after = [], None
+        while True:
+            page = index.chunk_ids_after(after, 2)
+            if not page:
+                break
+            seen.extend(page)
+            after = page[-1]
+        assert seen == sorted(CORPUS)
+
+    def test_queries_do_not_wait_for_the_index_lock(self, tmp_path):
+        index = self._build(tmp_path)
+        expected = index.search("parking", k=3)
+        result = []
+        with index._lock:   # e.g. an upsert in another thread
+            reader = threading.Thread(target=lambda: result.append(index.search("parking", k=3)))
+            reader.start()
+            reader.join(5)
+            assert result == [expected]
+
+    def test_idle_read_connections_are_bounded(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(bm25_index, "BM25_IDLE_READERS", 2)
+        index = self._build(tmp_path)
+        barrier = threading.Barrier(8)
+
+        def query():
+            with index._reader() as conn:
+                barrier.wait()   # all eight borrowed at once
+                conn.execute("SELECT 1")
+
+        threads = [threading.Thread(target=query) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(index._idle) == 2
+        index.close()
+        assert index._idle == []
+
+    def test_rebuild_is_invisible_until_it_commits(self, tmp_path):
+        index = self._build(tmp_path)
+        before = index.search("parking", k=10)
+        seen_mid_rebuild = []
+
+        def batches():
+            yield ["x::chunk::0"], ["parking garage"], [{"doc_id": "x"}]
+            seen_mid_rebuild.append(index.search("parking", k=10))   # a query while the rebuild runs
+            yield ["x::chunk::1"], ["more parking"], [{"doc_id": "x"}]
+
+        assert index.rebuild(batches()) == 2
+        assert seen_mid_rebuild == [before]
+        assert {cid for cid, _ in index.search("parking", k=10)} == {"x::chunk::0", "x::chunk::1"}
+        assert index.count() == 2
+
+    def test_failed_rebuild_keeps_the_old_index(self, tmp_path):
+        index = self._build(tmp_path)
+
+        def batches():
+            yield ["x::chunk::0"], ["parking garage"], [{"doc_id": "x"}]
+            raise RuntimeError("chroma went away")
+
+        with pytest.raises(RuntimeError):
+            index.rebuild(batches())
+        assert index.count() == len(CORPUS)
@@ -0,0 +1,116 @@
+"""
+Tests for the legacy engine's append-only document log (document_log.py)
+"""
+import json
+
+import pytest
+
+from document_log import DocumentLog
+
+
+def make_log(tmp_path, **kwargs):
+    return DocumentLog(str(tmp_path / "docs.json"), **kwargs)
+
+
+class TestDocumentLog:
+    """Replay, compaction and failure handling"""
+
+    def test_changes_survive_reload(self, tmp_path):
+        log = make_log(tmp_path)
+        log.load()
+        log.put("a", {"content": "alpha"})
+        log.put("b", {"content": "beta"})
+        log.delete("a")
+        log.wait_for_compaction()
+
+        assert make_log(tmp_path).load() == {"b": {"content": "beta"}}
+
+    def test_torn_trailing_record_is_truncated(self, tmp_path):
+        log = make_log(tmp_path)
+        log.load()
+        log.put("a", {"content": "alpha"})
+        with open(log.log_file, "ab") as f:
+            f.write(b"0badc0de\t{\"op\":\"put\"")
+
+        reloaded = make_log(tmp_path)
+        assert reloaded.load() == {"a": {"content": "alpha"}}
+        reloaded.wait_for_compaction()
+
+    def test_compaction_folds_the_log_into_the_snapshot(self, tmp_path):
+        log = make_log(tmp_path, compact_bytes=1)
+        log.load()
+        log.put("a", {"content": "alpha"})
+        log.wait_for_compaction()
+
+        with open(log.snapshot_file, encoding="utf-8") as f:
+            assert json.load(f) == {"a": {"content": "alpha"}}
+        assert make_log(tmp_path).load() == {"a": {"content": "alpha"}}
+
+    def test_failed_load_raises_and_keeps_state(self, tmp_path):
+        (tmp_path / "docs.json").write_text("{not json", encoding="utf-8")
+        log = make_log(tmp_path)
+        with pytest.raises(ValueError):
+            log.load()
+        assert log.documents == {} and log.items() == []
+
+    def test_items_is_a_snapshot(self, tmp_path):
+        log = make_log(tmp_path)
+        log.load()
+        log.put("a", {"content": "alpha"})
+        items = log.items()
+        log.put("b", {"content": "beta"})
+        assert [doc_id for doc_id, _ in items] == ["a"]
+        assert log.ids() == {"a", "b"}
+
+
+def _append_many(snapshot_file, worker, count):
+    log = DocumentLog(snapshot_file, compact_bytes=2048)
+    log.load()
+    for i in range(count):
+        log.put(f"{worker}-{i}", {"content": "x" * 50})
+    log.wait_for_compaction()
+
+
+class TestSharedDocumentLog:
+    """Several processes (or instances standing in for them) on the same files"""
+
+    def test_refresh_reports_other_writers_records(self, tmp_path):
+        a, b = make_log(tmp_path), make_log(tmp_path)
+        a.load()
+        b.load()
+        a.put("x", {"content": "from a"})
+        b.delete("missing")
+
+        assert b.documents == {"x": {"content": "from a"}}   # caught up before appending
+        assert b.refresh() == [("x", None, {"content": "from a"})]
+        assert b.refresh() == []
+        assert a.refresh() == [("missing", None, None)]
+
+    def test_compaction_keeps_other_writers_records(self, tmp_path):
+        a, b = make_log(tmp_path), make_log(tmp_path)
+        a.load()
+        b.load()
+        b.put("from-b", {"content": "b"})
+        a.put("from-a", {"content": "a"})
+        a.compact_async()
+        a.wait_for_compaction()
+
+        with open(a.snapshot_file, encoding="utf-8") as f:
+            assert set(json.load(f)) == {"from-a", "from-b"}
+        b.put("after", {"content": "b2"})     # b's handle still points at the rotated file
+        assert set(make_log(tmp_path).load()) == {"from-a", "from-b", "after"}
+        assert [doc_id for doc_id, _, _ in b.refresh()] == ["from-a"]
+        assert b.ids() == {"from-a", "from-b", "after"}
+
+    def test_concurrent_processes_lose_no_records(self, tmp_path):
+        multiprocessing = pytest.importorskip("multiprocessing")
+        ctx = multiprocessing.get_context("fork")
+        snapshot_file = str(tmp_path / "docs.json")
+        workers = [ctx.Process(target=_append_many, args=(snapshot_file, w, 40)) for w in range(4)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(30)
+            assert p.exitcode == 0
+
+        assert len(DocumentLog(snapshot_file).load()) == 160
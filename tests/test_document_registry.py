@@ -0,0 +1,73 @@
+"""
+Tests for the legacy app's SQLite document registry (document_registry.py)
+"""
+import json
+import os
+import threading
+
+import document_registry
+from document_registry import DocumentRegistry
+
+
+def doc_info(file_hash, content_hash=None, filename="a.pdf"):
+    return {
+        "filename": filename,
+        "file_hash": file_hash,
+        "content_hash": content_hash or f"content-{file_hash}",
+        "upload_date": "2026-01-01T00:00:00",
+        "file_size": 10,
+        "doc_type": "pdf",
+    }
+
+
+class TestDocumentRegistry:
+    """Atomic reservation, delete and one-time migration"""
+
+    def test_reserve_rejects_same_file_or_content(self, tmp_path):
+        registry = DocumentRegistry(str(tmp_path / "registry.sqlite3"))
+        assert registry.reserve(doc_info("f1")) is None
+        assert registry.reserve(doc_info("f1", "other"))["file_hash"] == "f1"
+        assert registry.reserve(doc_info("f2", "content-f1"))["file_hash"] == "f1"
+
+    def test_concurrent_reservations_across_connections_register_once(self, tmp_path):
+        path = str(tmp_path / "registry.sqlite3")
+        registries = [DocumentRegistry(path) for _ in range(8)]   # one connection each, like workers
+        outcomes = []
+        barrier = threading.Barrier(len(registries))
+
+        def reserve(registry, i):
+            barrier.wait()
+            outcomes.append(registry.reserve(doc_info(f"file{i}", "same-content")))
+
+        threads = [threading.Thread(target=reserve, args=(r, i)) for i, r in enumerate(registries)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sum(outcome is None for outcome in outcomes) == 1
+        assert registries[0].count() == 1
+
+    def test_delete_returns_the_row_once(self, tmp_path):
+        registry = DocumentRegistry(str(tmp_path / "registry.sqlite3"))
+        registry.reserve(doc_info("f1"))
+        assert registry.delete("f1")["file_hash"] == "f1"
+        assert registry.delete("f1") is None
+        assert registry.get("f1") is None
+
+    def test_migration_tolerates_another_worker_renaming_the_file(self, tmp_path, monkeypatch):
+        legacy = tmp_path / "processed_documents.json"
+        legacy.write_text(json.dumps({"f1": doc_info("f1")}))
+        path = str(tmp_path / "registry.sqlite3")
+        other = DocumentRegistry(path)
+        real_replace = os.replace
+
+        def replace_after_other_worker(src, dst):
+            monkeypatch.setattr(document_registry.os, "replace", real_replace)
+            other.migrate_from_json(str(legacy))      # wins the race and renames the file
+            real_replace(src, dst)
+
+        monkeypatch.setattr(document_registry.os, "replace", replace_after_other_worker)
+        DocumentRegistry(path).migrate_from_json(str(legacy))
+        assert other.count() == 1
+        assert not legacy.exists() and (tmp_path / "processed_documents.json.migrated").exists()
+        assert DocumentRegistry(path).migrate_from_json(str(legacy)) == 0
@@ -0,0 +1,52 @@
+"""
+Tests for the content-addressed embedding cache (app/embedding_cache.py)
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+from app.embedding_cache import EmbeddingCache, chunk_key, model_key  # noqa: E402
+
+
+def fake_encoder(calls):
+    """Deterministic 4-d 'embedding' per text, counting what actually gets encoded"""
+    def encode(texts):
+        calls.extend(texts)
+        return np.array([[len(t), sum(map(ord, t)) % 97, t.count(" "), 1.0] for t in texts], dtype=np.float32)
+    return encode
+
+
+class TestEmbeddingCache:
+    """Hits, canonical model keys and slot verification across processes"""
+
+    def test_second_embed_is_served_from_cache(self, tmp_path):
+        cache = EmbeddingCache(root=str(tmp_path), capacity=16)
+        calls = []
+        first, info1 = cache.embed("m", ["a b", "c d", "a  b"], fake_encoder(calls))
+        second, info2 = cache.embed("m", ["c d", "a b"], fake_encoder(calls))
+        assert calls == ["a b", "c d"]            # whitespace-normalized duplicates embedded once
+        assert info1["misses"] == 3 and info2["hits"] == 2
+        np.testing.assert_array_equal(second, first[[1, 0]])
+
+    def test_model_names_are_canonical(self, tmp_path):
+        assert model_key("sentence-transformers/all-MiniLM-L6-v2") == model_key("all-MiniLM-L6-v2")
+        cache = EmbeddingCache(root=str(tmp_path), capacity=16)
+        calls = []
+        cache.embed("sentence-transformers/all-MiniLM-L6-v2", ["shared text"], fake_encoder(calls))
+        _, info = cache.embed("all-MiniLM-L6-v2", ["shared text"], fake_encoder(calls))
+        assert info["hits"] == 1 and calls == ["shared text"]
+
+    def test_slot_rewritten_by_another_process_is_a_miss(self, tmp_path, monkeypatch):
+        """A stale key->slot lookup must not return whatever vector now occupies the slot"""
+        a = EmbeddingCache(root=str(tmp_path), capacity=1)
+        b = EmbeddingCache(root=str(tmp_path), capacity=1)   # separate connection and maps, like another process
+        calls = []
+        expected, _ = a.embed("m", ["first text"], fake_encoder(calls))
+
+        # A looks the key up, then B evicts it and reuses slot 0 before A reads the vector
+        stale = {chunk_key("first text"): 0}
+        b.embed("m", ["other text"], fake_encoder(calls))
+        monkeypatch.setattr(a, "_lookup", lambda conn, model, keys: dict(stale))
+
+        got, info = a.embed("m", ["first text"], fake_encoder(calls))
+        assert info["hits"] == 0
+        np.testing.assert_array_equal(got, expected)
@@ -0,0 +1,74 @@
+"""
+Tests for the memory-mapped embedding store (embedding_store.py)
+"""
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from embedding_store import EmbeddingStore  # noqa: E402
+
+
+def unit_rows(seed, count, dim=4):
+    rows = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+class TestEmbeddingStore:
+    """Manifest log, reload and sharing the files between instances"""
+
+    def test_add_appends_a_record_and_survives_reopen(self, tmp_path):
+        base = str(tmp_path / "emb")
+        store = EmbeddingStore(base)
+        store.add("a", unit_rows(1, 3))
+        store.add("b", unit_rows(2, 2))
+        assert not os.path.exists(store.manifest_file)       # no snapshot rewrite per add
+        with open(store.log_file) as f:
+            assert len(f.readlines()) == 2
+
+        reopened = EmbeddingStore(base)
+        np.testing.assert_allclose(reopened.get("a"), unit_rows(1, 3), rtol=1e-6)
+        np.testing.assert_allclose(reopened.get("b"), unit_rows(2, 2), rtol=1e-6)
+
+    def test_instances_sharing_files_never_overlap_rows(self, tmp_path):
+        """Two stores on the same files stand in for two worker processes"""
+        base = str(tmp_path / "emb")
+        first, second = EmbeddingStore(base), EmbeddingStore(base)
+        first.add("a", unit_rows(1, 3))
+        second.add("b", unit_rows(2, 2))        # must append after a's rows, not at row 0
+        first.add("c", unit_rows(3, 1))
+
+        for store in (first, second):
+            store.refresh()
+            assert sorted(store.docs) == ["a", "b", "c"]
+            np.testing.assert_allclose(store.get("b"), unit_rows(2, 2), rtol=1e-6)
+            np.testing.assert_allclose(store.get("c"), unit_rows(3, 1), rtol=1e-6)
+
+    def test_compaction_elsewhere_is_picked_up_by_refresh(self, tmp_path):
+        base = str(tmp_path / "emb")
+        first, second = EmbeddingStore(base), EmbeddingStore(base)
+        first.add("a", unit_rows(1, 3))
+        first.add("b", unit_rows(2, 2))
+        second.refresh()
+        first.remove("a")
+        first.compact()
+
+        assert second.refresh()
+        assert second.generation == first.generation == 1
+        assert sorted(second.docs) == ["b"]
+        np.testing.assert_allclose(second.get("b"), unit_rows(2, 2), rtol=1e-6)
+
+    def test_torn_record_and_orphan_rows_are_dropped(self, tmp_path):
+        base = str(tmp_path / "emb")
+        store = EmbeddingStore(base)
+        store.add("a", unit_rows(1, 2))
+        with open(store.data_file, "ab") as f:
+            f.write(unit_rows(9, 1).tobytes())   # rows appended before a crash ...
+        with open(store.log_file, "ab") as f:
+            f.write(b'{"op":"add","id":"x"')     # ... and a half-written record
+
+        reopened = EmbeddingStore(base)
+        assert list(reopened.docs) == ["a"]
+        assert os.path.getsize(reopened.data_file) == 2 * 4 * 4
+        reopened.add("b", unit_rows(2, 1))
+        np.testing.assert_allclose(EmbeddingStore(base).get("b"), unit_rows(2, 1), rtol=1e-6)
@@ -0,0 +1,128 @@
+"""
+Tests for incremental rank fusion with early termination (app/fusion.py)
+"""
+import random
+
+import pytest
+
+from app.fusion import fuse, get_fusion, WeightedBlend, ReciprocalRankFusion
+
+
+def ranked(scores):
+    """{item: score} -> [(item, score, payload)] best first"""
+    return [(item, score, {"score": score}) for item, score in sorted(scores.items(), key=lambda x: -x[1])]
+
+
+class Legs:
+    """fetch() over fixed full rankings, recording the depths asked for"""
+
+    def __init__(self, rankings, failing=()):
+        self.rankings = rankings
+        self.failing = set(failing)
+        self.calls = []
+
+    def fetch(self, wanted):
+        self.calls.append(dict(wanted))
+        return {name: None if name in self.failing else self.rankings[name][:depth] for name, depth in wanted.items()}
+
+
+def exact_scores(rankings, fusion):
+    exact = {}
+    for name, items in rankings.items():
+        top = items[0][1] if items else 0.0
+        for rank, (item, score, _) in enumerate(items, start=1):
+            exact[item] = exact.get(item, 0.0) + fusion.contribution(name, rank, score, top)
+    return exact
+
+
+def brute_force(rankings, fusion, k, group):
+    """Top-k groups by exact fused score, reading every leg to the end"""
+    exact = exact_scores(rankings, fusion)
+    best = {}
+    for item, score in exact.items():
+        best[group(item)] = max(best.get(group(item), 0.0), score)
+    return sorted(best.items(), key=lambda x: -x[1])[:k]
+
+
+class TestFuse:
+    """Correctness against a full read, and the depth/round report"""
+
+    @pytest.mark.parametrize("fusion_name", ["blend", "rrf"])
+    def test_randomized_against_brute_force(self, fusion_name):
+        rng = random.Random(2024)
+        fusion = get_fusion(fusion_name, {"keyword": rng.uniform(0.2, 1), "vector": rng.uniform(0.2, 1)})
+        for _ in range(300):
+            universe = [f"doc{rng.randrange(40)}::chunk::{i}" for i in range(rng.randint(1, 200))]
+            rankings = {
+                "keyword": ranked({item: rng.expovariate(1.0) for item in rng.sample(universe, rng.randint(0, len(universe)))}),
+                "vector": ranked({item: rng.uniform(-0.2, 1.0) for item in rng.sample(universe, rng.randint(0, len(universe)))}),
+            }
+            k = rng.randint(1, 10)
+            group = lambda item: item.split("::chunk::")[0]
+            legs = Legs(rankings)
+            results, report = fuse(["keyword", "vector"], legs.fetch, k, fusion, group=group,
+                                   max_depth=10_000, max_rounds=100)
+
+            expected = brute_force(rankings, fusion, k, group)
+            cutoff = expected[-1][1] if expected else 0.0
+            if any(abs(score - cutoff) < 1e-9 for g, score in brute_force(rankings, fusion, 10_000, group)
+                   if g not in dict(expected)):
+                continue   # a tie at the cut-off: either group is a valid answer
+            assert {r["group"] for r in results} == {g for g, _ in expected}
+            exact = exact_scores(rankings, fusion)
+            for r in results:
+                assert r["score_lower_bound"] <= exact[r["id"]] + 1e-12
+                if r["score_exact"]:
+                    assert r["score_lower_bound"] == pytest.approx(exact[r["id"]])
+            assert not report["round_capped"]
+            for name, leg in report["legs"].items():
+                assert leg["depth"] <= len(rankings[name])
+                assert leg["depth"] == len(rankings[name]) or not leg["exhausted"]
+
+    def test_clear_winner_stops_after_the_first_round(self):
+        keyword = {f"d{i}": 100.0 / (i + 1) ** 2 for i in range(500)}
+        vector = {f"d{i}": 0.9 - i / 400 for i in range(500)}
+        legs = Legs({"keyword": ranked(keyword), "vector": ranked(vector)})
+        results, report = fuse(["keyword", "vector"], legs.fetch, 3, WeightedBlend({"keyword": 0.7, "vector": 0.3}))
+        assert [r["id"] for r in results] == ["d0", "d1", "d2"]
+        assert all(r["score_exact"] for r in results)   # both legs reached each winner
+        assert report["rounds"] == 1 and report["early_stop"] and not report["round_capped"]
+        assert report["legs"]["keyword"]["depth"] == report["legs"]["vector"]["depth"] == 6
+
+    def test_rounds_are_capped_and_depth_grows_geometrically(self):
+        # Flat scores never let the bound settle
+        rankings = {name: ranked({f"d{i}": 1.0 - i * 1e-6 for i in range(1000)}) for name in ("keyword", "vector")}
+        rankings["vector"] = list(reversed(rankings["vector"]))
+        legs = Legs(rankings)
+        results, report = fuse(["keyword", "vector"], legs.fetch, 5, ReciprocalRankFusion(),
+                               max_rounds=3, growth=4, max_depth=256)
+        assert [call["keyword"] for call in legs.calls] == [10, 40, 160]
+        assert report["rounds"] == 3 and report["round_capped"] and not report["early_stop"]
+        assert report["legs"]["keyword"] == {"depth": 160, "exhausted": False, "failed": False, "capped": False}
+        assert len(results) == 5
+
+    def test_depth_report_for_short_and_failed_legs(self):
+        legs = Legs({"keyword": ranked({"a": 3.0, "b": 1.0}), "vector": ranked({"c": 0.5})}, failing={"vector"})
+        results, report = fuse(["keyword", "vector"], legs.fetch, 5, WeightedBlend())
+        assert [r["id"] for r in results] == ["a", "b"]
+        assert report["legs"]["keyword"] == {"depth": 2, "exhausted": True, "failed": False, "capped": False}
+        assert report["legs"]["vector"] == {"depth": 0, "exhausted": False, "failed": True, "capped": False}
+        assert report["rounds"] == 1
+
+    def test_unread_contributions_are_reported_as_a_bound(self):
+        # "b" wins on keyword alone; its vector score is deeper than the first page
+        keyword = {"b": 10.0, **{f"k{i}": 0.02 - i / 1000 for i in range(10)}}
+        vector = {"a": 1.0, **{f"v{i}": 0.99 - i / 100 for i in range(20)}, "b": 0.5}
+        legs = Legs({"keyword": ranked(keyword), "vector": ranked(vector)})
+        results, report = fuse(["keyword", "vector"], legs.fetch, 1, WeightedBlend({"keyword": 0.7, "vector": 0.3}))
+        assert report["early_stop"] and [r["id"] for r in results] == ["b"]
+        assert not results[0]["score_exact"]
+        assert results[0]["score_lower_bound"] == pytest.approx(0.7)   # keyword only; vector not read yet
+
+    def test_max_depth_caps_each_leg(self):
+        rankings = {name: ranked({f"d{i}": 1.0 - i * 1e-6 for i in range(100)}) for name in ("keyword", "vector")}
+        rankings["vector"] = list(reversed(rankings["vector"]))
+        legs = Legs(rankings)
+        _, report = fuse(["keyword", "vector"], legs.fetch, 5, WeightedBlend(), max_depth=16, max_rounds=10)
+        assert max(call["keyword"] for call in legs.calls) == 16
+        assert report["legs"]["keyword"]["capped"] and report["legs"]["keyword"]["depth"] == 16
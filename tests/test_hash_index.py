@@ -0,0 +1,55 @@
+"""
+Tests for the ingest duplicate-detection hash index (app/hash_index.py)
+"""
+import threading
+
+from app.hash_index import HashIndex, content_hash, FILE, CONTENT
+
+
+class TestHashIndex:
+    """Constant-time lookups and atomic claims"""
+
+    def test_content_hash_ignores_case_and_whitespace(self):
+        assert content_hash("Annual  Report\n2026 ") == content_hash("annual report 2026")
+        assert content_hash("annual report 2026") != content_hash("annual report 2025")
+
+    def test_claim_returns_the_existing_owner(self, tmp_path):
+        index = HashIndex(str(tmp_path / "hashes.sqlite3"))
+        assert index.claim(FILE, "f1", "doc1", "a.pdf") is None
+        assert index.claim(FILE, "f1", "doc1") is None                  # re-claiming your own hash
+        assert index.claim(FILE, "f1", "doc2", "b.pdf")["doc_id"] == "doc1"
+        assert index.claim(CONTENT, "f1", "doc2") is None              # kinds are separate keys
+        owner = index.lookup(FILE, "f1")
+        assert (owner["doc_id"], owner["filename"]) == ("doc1", "a.pdf")
+        assert index.lookup(FILE, "missing") is None
+
+    def test_concurrent_claims_across_connections_have_one_winner(self, tmp_path):
+        path = str(tmp_path / "hashes.sqlite3")
+        indexes = [HashIndex(path) for _ in range(8)]
+        outcomes = []
+        barrier = threading.Barrier(len(indexes))
+
+        def claim(index, i):
+            barrier.wait()
+            outcomes.append(index.claim(CONTENT, "same", f"doc{i}"))
+
+        threads = [threading.Thread(target=claim, args=(index, i)) for i, index in enumerate(indexes)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        winners = [o for o in outcomes if o is None]
+        assert len(winners) == 1
+        assert len({o["doc_id"] for o in outcomes if o is not None}) == 1
+        assert indexes[0].count() == {CONTENT: 1}
+
+    def test_assign_and_remove_doc(self, tmp_path):
+        index = HashIndex(str(tmp_path / "hashes.sqlite3"))
+        index.claim(FILE, "f1", "doc1")
+        index.claim(CONTENT, "c1", "doc1")
+        index.assign(FILE, "f1", "doc2")
+        assert index.lookup(FILE, "f1")["doc_id"] == "doc2"
+        assert index.remove_doc("doc1") == 1
+        assert index.count() == {FILE: 1}
+        index.clear()
+        assert index.count() == {}
@@ -0,0 +1,84 @@
+"""
+Tests for running hybrid search legs under deadlines (app/search.py)
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+search = pytest.importorskip("app.search")
+
+
+@pytest.fixture
+def one_thread(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(search, "_leg_executor", pool)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def sleeper(seconds, value):
+    def run():
+        time.sleep(seconds)
+        return value
+    return run
+
+
+class TestRunLegs:
+    """Deadlines count running time, not time queued for a thread"""
+
+    def test_queue_wait_does_not_cause_a_timeout(self, one_thread):
+        one_thread.submit(time.sleep, 0.3)           # another request's leg holds the only thread
+        results, info = search._run_legs({"keyword": (sleeper(0.3, ["hit"]), 0.5)})
+        assert results == {"keyword": ["hit"]}
+        assert info["keyword"]["status"] == "ok"
+        assert info["keyword"]["queued_seconds"] >= 0.25
+        assert info["keyword"]["seconds"] < 0.5
+
+    def test_a_leg_that_never_starts_is_cancelled(self, one_thread):
+        one_thread.submit(time.sleep, 0.5)
+        ran = []
+        results, info = search._run_legs({
+            "keyword": (lambda: ran.append(1) or ["late"], 0.1),
+        })
+        assert results == {"keyword": []} and info["keyword"]["status"] == "timeout"
+        one_thread.shutdown(wait=True)
+        assert ran == []
+
+    def test_a_slow_running_leg_times_out(self, one_thread):
+        results, info = search._run_legs({"vector": (sleeper(0.4, ["late"]), 0.1)})
+        assert results == {"vector": []} and info["vector"]["status"] == "timeout"
+
+
+class FakeCollection:
+    def __init__(self, distances):
+        self.distances = distances
+        self.queries = []
+
+    def query(self, query_embeddings, n_results, include):
+        self.queries.append(n_results)
+        return {"ids": [[f"c{i}" for i in range(n_results)]], "distances": [self.distances[:n_results]]}
+
+
+class TestCursors:
+    """Each leg is scored or embedded once per search and read deeper across rounds"""
+
+    def test_keyword_cursor_scores_once(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(search.bm25_index, "score_all",
+                            lambda query: calls.append(query) or {f"c{i}": float(i) for i in range(50)})
+        cursor = search._KeywordCursor("q")
+        assert [cid for cid, _, _ in cursor(3)] == ["c49", "c48", "c47"]
+        assert [cid for cid, _, _ in cursor(12)][:3] == ["c49", "c48", "c47"]
+        assert calls == ["q"]
+
+    def test_vector_cursor_embeds_once_and_scores_by_cosine(self, monkeypatch):
+        embedded = []
+        collection = FakeCollection([i / 25 for i in range(50)])
+        monkeypatch.setattr(search.query_embedder, "embed", lambda query: embedded.append(query) or [1.0])
+        monkeypatch.setattr(search, "get_chroma_collection", lambda: collection)
+        cursor = search._VectorCursor("q")
+        first = cursor(10)
+        assert cursor(5) == first[:5] and cursor(40)[:10] == first
+        assert embedded == ["q"] and collection.queries == [10, 40]
+        assert first[0][1] == 1.0 and first[-1][1] == pytest.approx(1 - 9 / 50)
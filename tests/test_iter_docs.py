@@ -0,0 +1,59 @@
+"""
+Tests for streaming the collection in bounded batches (app/indexing.py)
+"""
+import pytest
+
+indexing = pytest.importorskip("app.indexing")
+from app.bm25_index import BM25Index  # noqa: E402
+
+
+class FakeCollection:
+    """Chroma's get() over rows kept in insertion order, recording the page sizes it returned"""
+
+    def __init__(self, rows):
+        self.rows = rows   # {id: (document, metadata)}
+        self.returned = []
+
+    def get(self, ids=None, include=(), limit=None, offset=0):
+        selected = [cid for cid in self.rows if ids is None or cid in ids]
+        if ids is not None:
+            selected.reverse()   # Chroma does not promise id order
+        selected = selected[offset:None if limit is None else offset + limit]
+        self.returned.append(len(selected))
+        batch = {"ids": selected}
+        if "documents" in include:
+            batch["documents"] = [self.rows[cid][0] for cid in selected]
+        if "metadatas" in include:
+            batch["metadatas"] = [self.rows[cid][1] for cid in selected]
+        return batch
+
+
+@pytest.fixture
+def rows():
+    ids = [f"doc{i % 7}::chunk::{i}" for i in range(23)]
+    return {cid: (f"text of {cid}", {"doc_id": cid.split("::")[0]}) for cid in reversed(ids)}
+
+
+class TestIterDocs:
+    """Both id sources stream every chunk without loading the collection at once"""
+
+    def test_chroma_source_pages_with_limit_and_offset(self, rows, monkeypatch):
+        coll = FakeCollection(rows)
+        monkeypatch.setattr(indexing, "get_chroma_collection", lambda: coll)
+        batches = list(indexing.iter_docs(batch_size=5, id_source="chroma"))
+        assert [cid for b in batches for cid in b["ids"]] == list(rows)
+        assert all(b["docs"] == [rows[cid][0] for cid in b["ids"]] for b in batches)
+        assert max(coll.returned) == 5
+
+    def test_bm25_source_streams_in_id_order(self, rows, monkeypatch, tmp_path):
+        coll = FakeCollection(rows)
+        index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+        for cid, (text, meta) in rows.items():
+            index.upsert_chunks(cid, [cid], [text])   # one chunk per key keeps the fixture simple
+        monkeypatch.setattr(indexing, "get_chroma_collection", lambda: coll)
+        monkeypatch.setattr(indexing, "bm25_index", index)
+        batches = list(indexing.iter_docs(batch_size=5, include=("metadatas",)))
+        assert [cid for b in batches for cid in b["ids"]] == sorted(rows)
+        assert all(b["metas"] == [rows[cid][1] for cid in b["ids"]] and "docs" not in b for b in batches)
+        assert max(coll.returned) == 5
+        index.close()
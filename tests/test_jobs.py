@@ -0,0 +1,20 @@
+"""
+Tests for the durable ingestion job queue (app/jobs.py)
+"""
+from app.jobs import JobQueue
+
+
+class TestJobQueue:
+    """Claiming and cancelling queued jobs"""
+
+    def test_cancel_queued_leaves_running_jobs_alone(self, tmp_path):
+        queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+        first = queue.enqueue("a.pdf", "/blobs/a", "doc-a")
+        second = queue.enqueue("b.pdf", "/blobs/b", "doc-b")
+        assert queue.claim("worker-1")["id"] == first["id"]
+
+        assert queue.cancel_queued("cancelled by index reset") == 1
+        assert queue.get(first["id"])["status"] == "running"
+        cancelled = queue.get(second["id"])
+        assert cancelled["status"] == "failed" and cancelled["error"] == "cancelled by index reset"
+        assert queue.claim("worker-1") is None
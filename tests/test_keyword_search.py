@@ -0,0 +1,105 @@
+"""
+Tests for the legacy engine's score-at-a-time keyword search (search_engine.py)
+"""
+import math
+import random
+
+import pytest
+
+search_engine = pytest.importorskip("search_engine")
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """An engine with its files in tmp_path and no embedding model (keyword search only)"""
+    def no_model(name):
+        raise RuntimeError("no model in tests")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(search_engine, "SentenceTransformer", no_model)
+    return search_engine.SearchEngine()
+
+
+def index_corpus(engine, docs):
+    for i, text in enumerate(docs):
+        engine.index_document(f"doc{i}.txt", text, f"hash{i}", f"content{i}")
+
+
+def dict_walk(engine, terms, limit):
+    """Reference: score every posting of every term"""
+    n_docs = max(1, len(engine.documents))
+    scores = {}
+    for term in dict.fromkeys(terms):
+        postings = engine.inverted_index.get(term) or {}
+        if not postings:
+            continue
+        idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+        weight = idf * (search_engine.BM25_K1 + 1) / search_engine.IMPACT_LEVELS
+        for doc_id, impact in postings.items():
+            if doc_id not in engine._tombstones:
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight * impact
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+
+class CountingList(list):
+    """Counts indexed reads, to see how many postings a query touched"""
+
+    reads = 0
+
+    def __getitem__(self, index):
+        CountingList.reads += 1
+        return super().__getitem__(index)
+
+
+class TestScoreAtATime:
+    """Early termination must not change the top-k"""
+
+    @pytest.fixture
+    def corpus(self):
+        rng = random.Random(11)
+        vocabulary = [f"word{i}" for i in range(200)]
+        docs = []
+        for _ in range(400):
+            words = ["common"] * rng.randint(1, 8)
+            words += rng.choices(vocabulary, weights=[1 / (i + 1) for i in range(200)], k=rng.randint(20, 120))
+            docs.append(" ".join(words))
+        return docs
+
+    @pytest.mark.parametrize("query", ["common", "word0", "common word1", "word3 word7 word40", "word199 missing"])
+    def test_matches_a_full_dict_walk(self, engine, corpus, query):
+        index_corpus(engine, corpus)
+        terms = engine._tokenize(query.lower())
+        for limit in (1, 5, 20):
+            got = engine._score_at_a_time(list(dict.fromkeys(terms)), limit)
+            expected = dict_walk(engine, terms, limit)
+            assert [score for _, score in got] == pytest.approx([score for _, score in expected])
+            reference = dict(dict_walk(engine, terms, len(corpus)))
+            assert all(reference[doc_id] == pytest.approx(score) for doc_id, score in got)
+
+    def test_tombstoned_documents_are_skipped(self, engine, corpus):
+        index_corpus(engine, corpus)
+        first = engine._score_at_a_time(["common"], 3)[0][0]
+        engine.delete_document(first)
+        assert first not in {d for d, _ in engine._score_at_a_time(["common"], 3)}
+
+    def test_single_common_term_stops_after_the_first_block(self, engine, corpus, monkeypatch):
+        index_corpus(engine, corpus)
+        impacts, doc_ids = engine._impact_list("common")
+        monkeypatch.setitem(engine._impact_lists, "common", (impacts, CountingList(doc_ids)))
+        CountingList.reads = 0
+        engine._score_at_a_time(["common"], 10)
+        assert len(doc_ids) == 400
+        assert CountingList.reads <= search_engine.SAAT_BLOCK
+
+
+class TestSnippets:
+    """Snippets are cut around the matches in the original text"""
+
+    def test_snippet_finds_the_match_after_length_changing_lowercase(self, engine):
+        # Each 'İ' lowercases to two characters, which used to shift every offset after it
+        content = "İSTANBUL İZMİR " * 60 + "the quarterly venue budget is approved" + " filler words" * 40
+        engine.index_document("cities.txt", content, "hash-cities", "content-cities")
+        doc_id = next(iter(engine.documents))
+        for snippet in (engine._get_snippet(content, "venue budget", 60, doc_id=doc_id),
+                        engine._get_snippet(content, "venue budget", 60)):
+            assert "venue budget" in snippet
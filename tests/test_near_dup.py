@@ -0,0 +1,91 @@
+"""
+Tests for MinHash/LSH near-duplicate document detection (app/near_dup.py)
+"""
+import random
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+from app.near_dup import NearDuplicateIndex, _optimal_bands  # noqa: E402
+
+
+def make_doc(rng, words=400):
+    return " ".join(f"w{rng.randrange(5000)}" for _ in range(words))
+
+
+def shingles(text, k=5):
+    words = text.split()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return NearDuplicateIndex(str(tmp_path / "near_dup.sqlite3"), threshold=0.8)
+
+
+class TestNearDuplicateIndex:
+    """Signatures, banded lookups and duplicate clusters"""
+
+    def test_signature_estimates_jaccard(self, index):
+        rng = random.Random(1)
+        a = make_doc(rng).split()
+        b = list(a)
+        for i in rng.sample(range(len(b)), 10):
+            b[i] = "changed"
+        a, b = " ".join(a), " ".join(b)
+        true = len(shingles(a) & shingles(b)) / len(shingles(a) | shingles(b))
+        assert index.similarity(index.signature(a), index.signature(b)) == pytest.approx(true, abs=0.12)
+        assert (index.signature(a) == index.signature(a)).all()
+
+    def test_bands_put_the_s_curve_near_the_threshold(self):
+        for threshold in (0.5, 0.8, 0.9):
+            bands, rows = _optimal_bands(threshold, 128)
+            assert bands * rows <= 128
+            assert abs((1 / bands) ** (1 / rows) - threshold) < 0.15
+
+    def test_query_finds_an_edited_copy_and_not_unrelated_documents(self, index):
+        rng = random.Random(2)
+        corpus = {f"doc{i}": make_doc(rng) for i in range(50)}
+        for doc_id, text in corpus.items():
+            index.add(doc_id, index.signature(text), f"{doc_id}.pdf")
+        edited = "Revised 2026-10-16 " + corpus["doc7"]
+        match = index.query(index.signature(edited))
+        assert match["doc_id"] == "doc7" and match["filename"] == "doc7.pdf"
+        assert match["similarity"] >= 0.8
+        assert index.query(index.signature(make_doc(rng))) is None
+        assert index.query(index.signature(corpus["doc7"]), exclude="doc7") is None
+
+    def test_clusters_group_chained_links(self, index):
+        rng = random.Random(3)
+        text = make_doc(rng)
+        index.add("root", index.signature(text), "root.pdf")
+        index.link("copy1", {"doc_id": "root", "similarity": 0.95}, "link", "copy1.pdf")
+        index.link("copy2", {"doc_id": "copy1", "similarity": 0.9}, "skip", "copy2.pdf")
+        index.link("other", {"doc_id": "elsewhere", "similarity": 0.85}, "link")
+        clusters = index.clusters()
+        assert [c["doc_id"] for c in clusters] == ["root", "elsewhere"]
+        assert clusters[0]["filename"] == "root.pdf"
+        assert {m["doc_id"] for m in clusters[0]["members"]} == {"copy1", "copy2"}
+
+    def test_cluster_root_is_the_earliest_document(self, index, monkeypatch):
+        rng = random.Random(5)
+        clock = iter(range(1, 100))
+        monkeypatch.setattr(time, "time", lambda: float(next(clock)))
+        index.add("old", index.signature(make_doc(rng)), "old.pdf")      # t=1
+        index.link("copy", {"doc_id": "old", "similarity": 0.9}, "skip")   # t=2
+        index.add("new", index.signature(make_doc(rng)), "new.pdf")      # t=3
+        index.link("old", {"doc_id": "new", "similarity": 0.9}, "link")    # t=4, e.g. re-linked on re-ingest
+        [cluster] = index.clusters()
+        assert cluster["doc_id"] == "old" and cluster["filename"] == "old.pdf"
+        assert {m["doc_id"] for m in cluster["members"]} == {"copy", "old"}
+
+    def test_remove_doc_drops_signature_and_links(self, index):
+        rng = random.Random(4)
+        text = make_doc(rng)
+        index.add("a", index.signature(text))
+        index.link("b", {"doc_id": "a", "similarity": 0.9}, "link")
+        index.remove_doc("a")
+        assert index.query(index.signature(text)) is None
+        assert index.clusters() == []
+        assert index.get_stats()["documents"] == 0
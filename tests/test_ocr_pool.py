@@ -0,0 +1,60 @@
+"""
+Tests for OCR pool recovery (app/ocr.py)
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("pytesseract")
+from app import ocr  # noqa: E402
+
+
+class FakePool:
+    """Executor whose first task dies like an OOM-killed worker, breaking the pool"""
+
+    created = []
+
+    def __init__(self, *args, **kwargs):
+        self.broken = False
+        self.break_on_first = not FakePool.created
+        FakePool.created.append(self)
+
+    def submit(self, fn, *args):
+        if self.broken:
+            raise BrokenProcessPool("pool is broken")
+        future = Future()
+        if self.break_on_first:
+            self.broken = True
+            future.set_exception(BrokenProcessPool("worker died"))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class TestOcrPoolRecovery:
+    """A dead OCR worker must not break OCR for the rest of the process"""
+
+    def test_broken_pool_is_replaced_and_pages_retried(self, monkeypatch):
+        FakePool.created = []
+        monkeypatch.setattr(ocr, "ProcessPoolExecutor", FakePool)
+        monkeypatch.setattr(ocr, "_pool", None)
+        monkeypatch.setattr(ocr, "PDF2IMAGE_AVAILABLE", True)
+        monkeypatch.setattr(ocr, "OCR_PAGES_PER_TASK", 1)
+        monkeypatch.setattr(
+            ocr, "ocr_page_range",
+            lambda path, first, last, dpi: [(f"page {p}", 0.0) for p in range(first, last + 1)],
+        )
+
+        pages = list(ocr.iter_ocr_pages("doc.pdf", pages=[1, 2, 3, 4]))
+
+        assert [(p, text) for p, text, _ in pages] == [(1, "page 1"), (2, "page 2"), (3, "page 3"), (4, "page 4")]
+        assert len(FakePool.created) == 2
+        assert ocr._pool is FakePool.created[1]
+
+        # Later ingests keep using the healthy pool
+        assert [t for _, t, _ in ocr.iter_ocr_pages("doc.pdf", pages=[5])] == ["page 5"]
+        assert len(FakePool.created) == 2
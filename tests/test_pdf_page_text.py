@@ -0,0 +1,23 @@
+"""
+Tests for per-page native/OCR text selection (app/ingestion.py)
+"""
+import pytest
+
+ingestion = pytest.importorskip("app.ingestion")
+
+
+class TestPickPageText:
+    """An OCR-routed page never ends up with less text than its native layer"""
+
+    def test_ocr_text_wins_when_it_finds_more(self):
+        assert ingestion._pick_page_text("scanned paragraph text", "2") == ("scanned paragraph text", "ocr")
+
+    def test_failed_ocr_keeps_native_text(self):
+        # The OCR pool reports failures as ""
+        assert ingestion._pick_page_text("", "Header  7") == ("Header  7", "native_fallback")
+
+    def test_shorter_ocr_keeps_native_text(self):
+        assert ingestion._pick_page_text("  Hdr ", "Header with caption") == ("Header with caption", "native_fallback")
+
+    def test_no_text_either_way(self):
+        assert ingestion._pick_page_text("", "") == ("", "ocr")
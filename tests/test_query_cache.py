@@ -0,0 +1,54 @@
+"""
+Tests for the search/chat result cache (app/query_cache.py)
+"""
+import pytest
+
+from app import query_cache as query_cache_module
+from app.query_cache import QueryCache
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(query_cache_module, "QUERY_CACHE_ENABLED", True)
+
+
+class TestQueryCache:
+    """Keying by index generation, cacheability and the byte bound"""
+
+    def test_same_generation_hits_and_new_generation_misses(self):
+        cache = QueryCache(max_bytes=1 << 20)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"results": [len(calls)]}
+
+        assert cache.get_or_compute("keyword", "Parking  Rates", 5, 1, compute) == ({"results": [1]}, False)
+        assert cache.get_or_compute("keyword", "parking rates", 5, 1, compute) == ({"results": [1]}, True)
+        # A write anywhere bumps the generation: the old entry is unreachable
+        assert cache.get_or_compute("keyword", "parking rates", 5, 2, compute) == ({"results": [2]}, False)
+        assert cache.get_or_compute("keyword", "parking rates", 6, 2, compute)[1] is False
+        assert cache.get_or_compute("vector", "parking rates", 5, 2, compute)[1] is False
+
+    def test_uncacheable_values_are_recomputed(self):
+        cache = QueryCache(max_bytes=1 << 20)
+        partial = lambda value: not value.get("partial")
+        cache.get_or_compute("hybrid", "q", 5, 1, lambda: {"partial": True}, partial)
+        assert cache.get_or_compute("hybrid", "q", 5, 1, lambda: {"partial": False}, partial) == ({"partial": False}, False)
+        assert cache.get_or_compute("hybrid", "q", 5, 1, lambda: {"partial": True}, partial) == ({"partial": False}, True)
+
+    def test_expired_entries_are_recomputed(self):
+        cache = QueryCache(max_bytes=1 << 20, ttl_seconds=0)
+        cache.get_or_compute("keyword", "q", 5, 1, lambda: "old")
+        assert cache.get_or_compute("keyword", "q", 5, 1, lambda: "new") == ("new", False)
+        assert cache.get_stats()["expired"] == 1
+
+    def test_least_recently_used_entries_go_first_when_over_budget(self):
+        cache = QueryCache(max_bytes=30)
+        for q in ("a", "b"):
+            cache.get_or_compute("keyword", q, 5, 1, lambda: "x" * 10)
+        cache.get_or_compute("keyword", "a", 5, 1, lambda: "unused")          # a is now most recent
+        cache.get_or_compute("keyword", "c", 5, 1, lambda: "x" * 10)
+        assert cache.get_or_compute("keyword", "a", 5, 1, lambda: "recomputed")[1] is True
+        assert cache.get_or_compute("keyword", "b", 5, 1, lambda: "recomputed") == ("recomputed", False)
+        assert cache.get_stats()["bytes"] <= 30
@@ -0,0 +1,56 @@
+"""
+Tests for the caching, micro-batching query embedder (app/query_embeddings.py)
+"""
+import threading
+
+import pytest
+
+query_embeddings = pytest.importorskip("app.query_embeddings")
+
+
+class FakeRegistry:
+    model_name = "test-model"
+
+    def __init__(self, ef):
+        self.ef = ef
+
+    def get_embedding_function(self):
+        return self.ef
+
+
+class TestQueryEmbedder:
+    """Every caller waiting on a batch gets a vector or an error"""
+
+    def _embed_concurrently(self, embedder, texts):
+        outcomes = {}
+
+        def run(text):
+            try:
+                outcomes[text] = embedder.embed(text)
+            except Exception as e:
+                outcomes[text] = e
+
+        threads = [threading.Thread(target=run, args=(text,)) for text in texts]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        return outcomes
+
+    def test_batches_concurrent_queries(self, monkeypatch):
+        monkeypatch.setattr(query_embeddings, "resource_registry",
+                            FakeRegistry(lambda texts: [[float(len(t))] for t in texts]))
+        embedder = query_embeddings.QueryEmbedder(window_ms=50)
+        outcomes = self._embed_concurrently(embedder, ["a", "bb", "ccc"])
+        embedder.stop()
+        assert outcomes == {"a": [1.0], "bb": [2.0], "ccc": [3.0]}
+
+    def test_short_batch_fails_every_caller(self, monkeypatch):
+        monkeypatch.setattr(query_embeddings, "resource_registry",
+                            FakeRegistry(lambda texts: [[0.0]] * (len(texts) - 1)))
+        embedder = query_embeddings.QueryEmbedder(window_ms=50)
+        outcomes = self._embed_concurrently(embedder, ["a", "bb", "ccc"])
+        embedder.stop()
+        assert len(outcomes) == 3
+        assert all(isinstance(outcome, ValueError) for outcome in outcomes.values())
+        assert embedder._pending == {}
@@ -0,0 +1,67 @@
+"""
+Tests for SimHash near-duplicate detection of search results (simhash.py)
+"""
+import math
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+from simhash import simhash64, hamming, jaccard, candidate_radius, SimHashIndex  # noqa: E402
+
+
+def pair_with_jaccard(rng, size, threshold):
+    """Two token sets of `size` tokens each whose Jaccard is the smallest reachable one >= `threshold`"""
+    shared = math.ceil(2 * size * threshold / (1 + threshold))
+    common = [f"c{rng.random()}" for _ in range(shared)]
+    a = set(common + [f"a{rng.random()}" for _ in range(size - shared)])
+    b = set(common + [f"b{rng.random()}" for _ in range(size - shared)])
+    return a, b
+
+
+class TestSimHash:
+    """Candidate radius recall and confirmed lookups"""
+
+    @pytest.mark.parametrize("size", [30, 100])
+    @pytest.mark.parametrize("threshold", [0.8, 0.9])
+    def test_radius_keeps_pairs_at_the_threshold(self, size, threshold):
+        rng = random.Random(size * 10 + int(threshold * 10))
+        radius = candidate_radius(threshold)
+        pairs = [pair_with_jaccard(rng, size, threshold) for _ in range(500)]
+        assert all(jaccard(a, b) >= threshold for a, b in pairs)
+        kept = sum(hamming(simhash64(a), simhash64(b)) <= radius for a, b in pairs)
+        assert kept >= 0.99 * len(pairs)
+
+    def test_radius_grows_as_threshold_drops(self):
+        radii = [candidate_radius(t) for t in (1.0, 0.95, 0.9, 0.8, 0.7)]
+        assert radii[0] == 0
+        assert radii == sorted(radii)
+
+    def test_find_returns_only_confirmed_items(self):
+        rng = random.Random(7)
+        a, b = pair_with_jaccard(rng, 30, 0.9)
+        index = SimHashIndex(candidate_radius(0.9))
+        index.add(simhash64(a), ("a", a))
+        assert index.find(simhash64(b), lambda item: jaccard(b, item[1]) >= 0.8) == ("a", a)
+        assert index.find(simhash64(b), lambda item: jaccard(b, item[1]) >= 0.99) is None
+
+    def test_deduplicate_matches_pairwise_jaccard(self):
+        """Same decisions as the pairwise snippet comparison it replaced"""
+        search_engine = pytest.importorskip("search_engine")
+        engine = search_engine.SearchEngine.__new__(search_engine.SearchEngine)
+        rng = random.Random(3)
+        vocabulary = [f"term{i}" for i in range(60)]
+        base = [rng.sample(vocabulary, 30) for _ in range(6)]
+        results = []
+        for i in range(60):
+            words = list(rng.choice(base))
+            for _ in range(rng.randint(0, 6)):
+                words[rng.randrange(len(words))] = rng.choice(vocabulary)
+            results.append({"filename": f"f{i}", "snippet": " ".join(words), "content_hash": ""})
+
+        expected = []
+        for result in results:
+            tokens = set(engine._tokenize(result["snippet"]))
+            if all(jaccard(tokens, set(engine._tokenize(r["snippet"]))) < 0.9 for r in expected):
+                expected.append(result)
+        assert engine.deduplicate_results(results, 0.9) == expected
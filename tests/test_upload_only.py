@@ -0,0 +1,29 @@
+"""
+Tests for saving uploads without indexing them (app/ingestion.py)
+"""
+import io
+from types import SimpleNamespace
+
+import pytest
+
+ingestion = pytest.importorskip("app.ingestion")
+from app.blobstore import BlobStore  # noqa: E402
+
+
+class TestUploadOnly:
+    """The upload is stored in the blob store and referenced by a new doc_id"""
+
+    def test_saves_and_references_the_upload(self, tmp_path, monkeypatch):
+        store = BlobStore(root=str(tmp_path / "blobs"))
+        monkeypatch.setattr(ingestion, "blob_store", store)
+        upload = SimpleNamespace(filename="dir/notes.txt", file=io.BytesIO(b"meeting notes"))
+
+        result = ingestion.upload_only(upload)
+
+        assert result["message"] == "Uploaded"
+        assert result["filename"] == "dir_notes.txt"
+        assert result["size_bytes"] == len(b"meeting notes")
+        with open(result["saved_path"], "rb") as f:
+            assert f.read() == b"meeting notes"
+        sha256 = result["saved_path"].rsplit("/", 1)[-1]
+        assert [ref["doc_id"] for ref in store.refs(sha256)] == [result["doc_id"]]